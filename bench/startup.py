@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Startup latency benchmarks of the external runner and docker-init.
+
+Measures end-to-end run time of the installed runner and of
+``docker-init`` while scaling the number of plugins and options.  Stub
+``docker`` and ``docker-machine`` programs (recording their arguments
+and exiting immediately) are put on ``PATH``, so only the overhead of
+the runner and init is measured, not of docker itself.
+
+Results are compared with (and optionally saved as) a JSON baseline, so
+that startup time regressions can be detected locally::
+
+    python bench/startup.py --save      # record baseline
+    python bench/startup.py             # compare with baseline
+
+Runner benchmarks bypass the invocation cache (with
+``++no-invocation-cache``), except for the ones named ``.../cached``,
+which measure repeated identical invocations.
+
+Exits with status 1 if any benchmark's median is slower than the
+baseline by more than the tolerance.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # PY2
+    from time import time as clock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from devops_utils import PROGS  # noqa: E402
+from devops_utils.install import Replacer  # noqa: E402
+
+PLUGIN_COUNTS = (1, 10, 100, 1000)
+OPTION_COUNTS = (0, 10, 100)
+
+STUB = '''#!/bin/sh
+echo "$(basename "$0") $*" >> "$BENCH_ARGV_LOG"
+'''
+
+RUNNER_PLUGIN = '''
+@argparse_builder
+def argparse_bench_{i}(parser):
+    parser.add_argument('++bench-{i}', action='store_true')
+
+
+@docker_run_builder
+def docker_run_bench_{i}(args, docker_run):
+    if args.bench_{i}:
+        docker_run.docker_args.extend(['-e', 'BENCH_{i}=1'])
+'''
+
+INIT_PLUGIN = '''
+@initfunc
+def init_bench_{i}(prog, args):
+    os.environ.setdefault('BENCH_{i}', '1')
+'''
+
+
+def make_stubs(workdir):
+    """Create stub ``docker`` and ``docker-machine`` in ``workdir/bin``."""
+    bindir = os.path.join(workdir, 'bin')
+    os.mkdir(bindir)
+    for name in ('docker', 'docker-machine'):
+        path = os.path.join(bindir, name)
+        with open(path, 'w') as fobj:
+            fobj.write(STUB)
+        os.chmod(path, 0o755)
+    return bindir
+
+
+def make_plugins(plugin_dir, type_, template, count):
+    """Create real plugins of ``type_`` plus ``count`` generated ones."""
+    dir = os.path.join(plugin_dir, type_ + '_plugins')
+    shutil.copytree(os.path.join(ROOT, type_ + '_plugins'), dir,
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    for i in range(count):
+        with open(os.path.join(dir, 'bench_{:04}.py'.format(i)), 'w') as fobj:
+            fobj.write(template.format(i=i))
+
+
+def install_runner(plugin_dir, target):
+    """Render the runner with plugins from ``plugin_dir`` into ``target``."""
+    context = {
+        'DOCKER_IMAGE': 'bench/devops-utils',
+        'PROGS': PROGS,
+        'RUNNER_NAME': 'devops-utils',
+    }
+    with open(os.path.join(ROOT, 'external_runner.py')) as sfobj,\
+            open(target, 'w') as dfobj:
+        for line in Replacer(sfobj, context, plugin_dir):
+            dfobj.write(line)
+    os.chmod(target, 0o755)
+
+
+def measure(cmd, env, repeat):
+    """Run ``cmd`` ``repeat`` times (after a warm-up run), return timings."""
+    subprocess.check_call(cmd, env=env)
+    times = []
+    for _ in range(repeat):
+        start = clock()
+        subprocess.check_call(cmd, env=env)
+        times.append(clock() - start)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2],
+            'max': times[-1]}
+
+
+def bench_env(workdir, bindir):
+    env = dict(os.environ)
+    for var in ('SSH_AUTH_SOCK', 'DOCKER_HOST', 'DEVOPS_UTILS_BACKEND',
+                'ACTIVE_DM', 'DEVOPS_UTILS_DEBUG', 'DEVOPS_UTILS_PROFILE',
+                'XDG_CACHE_HOME'):
+        env.pop(var, None)
+    env.update({
+        'PATH': os.pathsep.join([bindir, env.get('PATH', '')]),
+        'HOME': workdir,
+        'PYTHONPATH': ROOT,
+        'BENCH_ARGV_LOG': os.path.join(workdir, 'argv.log'),
+    })
+    return env
+
+
+def bench_runner(workdir, env, plugins, options, repeat, cached=False):
+    plugin_dir = os.path.join(workdir, 'runner-{}'.format(plugins))
+    if not os.path.isdir(plugin_dir):
+        os.mkdir(plugin_dir)
+        make_plugins(plugin_dir, 'runner', RUNNER_PLUGIN, plugins)
+        install_runner(plugin_dir, os.path.join(plugin_dir, 'devops-utils'))
+    cmd = [sys.executable, os.path.join(plugin_dir, 'devops-utils')]
+    if not cached:
+        cmd.append('++no-invocation-cache')
+    cmd.extend('++bench-{}'.format(i) for i in range(min(options, plugins)))
+    for i in range(options - min(options, plugins)):
+        cmd.extend(['+O', 'label=bench{}'.format(i)])
+    cmd.append('true')
+    return measure(cmd, env, repeat)
+
+
+def bench_init(workdir, env, plugins, repeat):
+    plugin_dir = os.path.join(workdir, 'init-{}'.format(plugins))
+    os.mkdir(plugin_dir)
+    make_plugins(plugin_dir, 'init', INIT_PLUGIN, plugins)
+    env = dict(env, DEVOPS_UTILS_PLUGIN_DIR=plugin_dir)
+    cmd = [sys.executable, '-m', 'devops_utils.init', 'true']
+    return measure(cmd, env, repeat)
+
+
+def run_benchmarks(plugin_counts, option_counts, repeat):
+    """Run all benchmarks and return a dict of results by name."""
+    workdir = tempfile.mkdtemp(prefix='devops-utils-bench-')
+    try:
+        env = bench_env(workdir, make_stubs(workdir))
+        results = {}
+        for plugins in plugin_counts:
+            for options in option_counts:
+                name = 'runner/plugins={}/options={}'.format(plugins, options)
+                results[name] = bench_runner(workdir, env, plugins, options,
+                                             repeat)
+                print('{:40} {:8.1f} ms'.format(
+                    name, results[name]['median'] * 1000))
+            name = 'runner/plugins={}/options={}/cached'.format(
+                plugins, option_counts[-1])
+            results[name] = bench_runner(workdir, env, plugins,
+                                         option_counts[-1], repeat,
+                                         cached=True)
+            print('{:40} {:8.1f} ms'.format(
+                name, results[name]['median'] * 1000))
+            name = 'init/plugins={}'.format(plugins)
+            results[name] = bench_init(workdir, env, plugins, repeat)
+            print('{:40} {:8.1f} ms'.format(
+                name, results[name]['median'] * 1000))
+        with open(env['BENCH_ARGV_LOG']) as fobj:
+            if not fobj.readline().startswith('docker run '):
+                raise RuntimeError('stub docker was not called by runner')
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """Return a list of messages about benchmarks slower than baseline."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], result['median']
+        if after > before * (1 + tolerance):
+            regressions.append('{}: {:.1f} ms -> {:.1f} ms (+{:.0%})'.format(
+                name, before * 1000, after * 1000, after / before - 1))
+    return regressions
+
+
+def main(args=sys.argv[1:]):
+    """Benchmark startup latency of the runner and docker-init."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--baseline', help='baseline file (def: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='save results as the new baseline')
+    parser.add_argument('--repeat', type=int,
+                        help='runs per benchmark (def: %(default)s)')
+    parser.add_argument('--tolerance', type=float,
+                        help=('allowed slowdown vs baseline as a fraction '
+                              '(def: %(default)s)'))
+    parser.add_argument('--plugins', type=int, nargs='+',
+                        help='numbers of plugins (def: %(default)s)')
+    parser.add_argument('--options', type=int, nargs='+',
+                        help='numbers of runner options (def: %(default)s)')
+    parser.set_defaults(
+        baseline=os.path.join(ROOT, '.benchmarks', 'startup.json'),
+        repeat=5, tolerance=0.2, plugins=list(PLUGIN_COUNTS),
+        options=list(OPTION_COUNTS))
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(args.plugins, args.options, args.repeat)
+
+    if args.save:
+        if not os.path.isdir(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, 'w') as fobj:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, fobj, indent=2, sort_keys=True)
+        print('saved baseline to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('no baseline in {}, run with --save'.format(args.baseline))
+        return 0
+    with open(args.baseline) as fobj:
+        baseline = json.load(fobj)['results']
+    regressions = compare(baseline, results, args.tolerance)
+    for msg in regressions:
+        print('REGRESSION {}'.format(msg))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
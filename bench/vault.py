@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmark of the vault key cache agent (``++vault-cache``).
+
+Encrypts a number of files with Ansible vault (each gets its own salt,
+like files vaulted separately) and measures the time a new Python
+process takes to decrypt all of them, the way each run in a new
+container does:
+
+* ``plain``: without the agent,
+* ``first``: with the agent, deriving and storing the keys,
+* ``cached``: with the agent holding the keys of all files.
+
+Requires Ansible (run it in the image, or where Ansible is
+installed)::
+
+    python bench/vault.py --files 300
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # PY2
+    from time import time as clock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from devops_utils import vault  # noqa: E402
+
+PASSWORD = b'bench'
+
+DECRYPT = '''
+import os, sys
+from ansible.parsing.vault import VaultLib, VaultSecret
+lib = VaultLib([('default', VaultSecret({password!r}))])
+for name in sorted(os.listdir(sys.argv[1])):
+    with open(os.path.join(sys.argv[1], name), 'rb') as fobj:
+        lib.decrypt(fobj.read())
+'''
+
+
+def encrypt_files(dir, count):
+    from ansible.parsing.vault import VaultLib, VaultSecret
+    lib = VaultLib([('default', VaultSecret(PASSWORD))])
+    for i in range(count):
+        with open(os.path.join(dir, '{:05}.yml'.format(i)), 'wb') as fobj:
+            fobj.write(lib.encrypt('secret_{}: value\n'.format(i)))
+
+
+def start_agent(workdir):
+    """Start the runner's agent with cache in ``workdir``, return socket."""
+    os.environ['XDG_CACHE_HOME'] = workdir
+    sys.argv = ['devops-utils']
+    import external_runner
+    return external_runner.vault_agent_start(external_runner.vault_dir(),
+                                             3600)
+
+
+def measure(cmd, env):
+    start = clock()
+    subprocess.check_call(cmd, env=env)
+    return clock() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=100,
+                        help='number of vaulted files (def: %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        import ansible.parsing.vault  # noqa: F401
+    except ImportError:
+        sys.exit('Ansible is required to run this benchmark')
+
+    workdir = tempfile.mkdtemp(prefix='dvu-vault-')
+    try:
+        files = os.path.join(workdir, 'files')
+        os.mkdir(files)
+        encrypt_files(files, args.files)
+        path = start_agent(workdir)
+        cmd = [sys.executable, '-c', DECRYPT.format(password=PASSWORD),
+               files]
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        site = vault.write_site(os.path.join(workdir, 'site'))
+        agent_env = dict(env, DEVOPS_UTILS_VAULT_SOCK=path,
+                         PYTHONPATH=os.pathsep.join([site, ROOT]))
+
+        for name, run_env in (('plain', env), ('first', agent_env),
+                              ('cached', agent_env)):
+            print('{:8} {:8.1f} ms'.format(
+                name, measure(cmd, run_env) * 1000))
+        stats = vault.request('stats', path)
+        print('{} keys cached, {:.2f}s of key derivation saved'.format(
+            stats['keys'], stats['saved']))
+        vault.request('stop', path)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,9 +24,11 @@ __author__ = 'gimoh'
 __email__ = 'gimoh@bitmessage.ch'
 __version__ = '0.1.0'
 
+import os
+
 
 PROGS = (
     'ansible', 'ansible-doc', 'ansible-galaxy', 'ansible-playbook',
     'ansible-vault', 'fab',
 )
-PLUGIN_DIR = '/etc/devops-utils'
+PLUGIN_DIR = os.environ.get('DEVOPS_UTILS_PLUGIN_DIR', '/etc/devops-utils')
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tunes Ansible to the resources available to the container.
+
+The ``ansible_tuning`` init plugin calls :py:func:`apply`, which reads
+the CPU quota and memory limit of the container's cgroup and writes
+:py:data:`CONFIG` with the number of forks, pipelining, SSH arguments
+and internal poll interval derived from them, according to a profile
+from :py:data:`PROFILES` (chosen with ``++ansible-profile``).
+
+Ansible only reads the first configuration file it finds, so if the
+project has its own (e.g. ``ansible.cfg`` in the current directory),
+the tuned options it doesn't set are passed in environment variables
+instead (except for the poll interval, which can't be).
+"""
+
+import os
+
+try:
+    from configparser import ConfigParser, Error as ConfigError
+except ImportError:  # python 2
+    from ConfigParser import SafeConfigParser as ConfigParser, \
+        Error as ConfigError
+
+
+__all__ = ('CGROUP_ROOT', 'CONFIG', 'PROFILES', 'apply', 'cpu_limit',
+           'memory_limit', 'settings')
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+"Where the container's cgroup filesystem is mounted."
+CONFIG = '/etc/ansible/ansible.cfg'
+"Configuration file written by :py:func:`apply`."
+PROFILES = {
+    'default': {'forks_per_cpu': 4, 'max_forks': 50, 'fork_memory': 96,
+                'pipelining': True, 'control_persist': 60,
+                'poll_interval': 0.005},
+    'fast': {'forks_per_cpu': 10, 'max_forks': 100, 'fork_memory': 64,
+             'pipelining': True, 'control_persist': 300,
+             'poll_interval': 0.001},
+    'safe': {'forks_per_cpu': 2, 'max_forks': 20, 'fork_memory': 160,
+             'pipelining': False, 'control_persist': 30,
+             'poll_interval': 0.01},
+}
+"""Tuning profiles.
+
+The number of forks is ``forks_per_cpu`` per CPU, but at most
+``max_forks`` and no more than fit in the memory limit (less
+:py:data:`RESERVED_MEMORY`) using ``fork_memory`` MiB each.  ``safe``
+disables pipelining, which doesn't work with ``requiretty`` in sudoers.
+"""
+RESERVED_MEMORY = 256
+"Memory (in MiB) left to the Ansible controller process itself."
+ENV = {
+    ('defaults', 'forks'): 'ANSIBLE_FORKS',
+    ('ssh_connection', 'pipelining'): 'ANSIBLE_PIPELINING',
+    ('ssh_connection', 'ssh_args'): 'ANSIBLE_SSH_ARGS',
+}
+"Environment variables overriding tuned options."
+
+
+def read_value(path):
+    """Return first line of ``path`` or None if it can't be read."""
+    try:
+        with open(path) as fobj:
+            return fobj.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cpu_count():
+    """Return number of CPUs the process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+
+def cpu_limit(root=None):
+    """Return number of CPUs available in cgroup mounted at ``root``.
+
+    Reads the CFS quota of cgroup v2 (``cpu.max``) or v1 (``cpu`` and
+    ``cpu,cpuacct`` hierarchies), capped at :py:func:`cpu_count`.
+
+    :param str root: cgroup filesystem root (def: :py:data:`CGROUP_ROOT`)
+    :rtype: float
+    """
+    root = root or CGROUP_ROOT
+    cpus = float(cpu_count())
+    quota = period = None
+    value = read_value(os.path.join(root, 'cpu.max'))
+    if value:
+        quota, _, period = value.partition(' ')
+    else:
+        for dir in ('cpu', 'cpu,cpuacct'):
+            quota = read_value(os.path.join(root, dir, 'cpu.cfs_quota_us'))
+            period = read_value(os.path.join(root, dir, 'cpu.cfs_period_us'))
+            if quota:
+                break
+    if quota and quota not in ('max', '-1') and period:
+        cpus = min(cpus, float(quota) / float(period))
+    return cpus
+
+
+def memory_limit(root=None):
+    """Return memory limit (in bytes) of cgroup mounted at ``root``.
+
+    :returns: the limit or None if there's none
+    """
+    root = root or CGROUP_ROOT
+    for path in ('memory.max', os.path.join('memory',
+                                            'memory.limit_in_bytes')):
+        value = read_value(os.path.join(root, path))
+        if value:
+            break
+    if not value or value == 'max':
+        return None
+    limit = int(value)
+    # cgroup v1 reports "no limit" as a huge number
+    if limit >= 2 ** 60:
+        return None
+    return limit
+
+
+def settings(cpus, memory=None, profile='default'):
+    """Return Ansible options tuned for ``cpus`` and ``memory``.
+
+    :param float cpus: number of CPUs available
+    :param int memory: memory limit (in bytes), if any
+    :param str profile: name of profile in :py:data:`PROFILES`
+    :returns: dict mapping (section, option) to value
+    """
+    params = PROFILES[profile]
+    forks = min(int(round(cpus * params['forks_per_cpu'])),
+                params['max_forks'])
+    if memory is not None:
+        forks = min(forks, (memory // 1024 // 1024 - RESERVED_MEMORY) //
+                    params['fork_memory'])
+    return {
+        ('defaults', 'forks'): str(max(forks, 1)),
+        ('defaults', 'internal_poll_interval'): str(params['poll_interval']),
+        ('ssh_connection', 'pipelining'): str(params['pipelining']),
+        ('ssh_connection', 'ssh_args'):
+            '-C -o ControlMaster=auto -o ControlPersist={}s'.format(
+                params['control_persist']),
+    }
+
+
+def render(options):
+    """Return contents of ``ansible.cfg`` setting ``options``."""
+    lines = ['# generated by devops-utils from container resources']
+    section = None
+    for (sect, option), value in sorted(options.items()):
+        if sect != section:
+            lines.extend(['', '[{}]'.format(sect)])
+            section = sect
+        lines.append('{} = {}'.format(option, value))
+    return '\n'.join(lines) + '\n'
+
+
+def project_config(cwd=None):
+    """Return configuration file Ansible would read before :py:data:`CONFIG`.
+
+    :returns: path or None if there's none
+    """
+    cwd = cwd or os.getcwd()
+    path = os.environ.get('ANSIBLE_CONFIG')
+    if path and os.path.isdir(path):
+        path = os.path.join(path, 'ansible.cfg')
+    candidates = [path, os.path.join(cwd, 'ansible.cfg'),
+                  os.path.expanduser('~/.ansible.cfg')]
+    for path in candidates:
+        if path and os.path.exists(path) and path != CONFIG:
+            return path
+    return None
+
+
+def configured(path):
+    """Return (section, option) pairs set in configuration file ``path``."""
+    parser = ConfigParser()
+    try:
+        parser.read(path)
+    except ConfigError:
+        return set()
+    return set((section, option) for section in parser.sections()
+               for option in parser.options(section))
+
+
+def write_config(options, path=None):
+    """Write ``options`` to ``path`` unless it already has them.
+
+    Not rewriting unchanged file keeps its mtime, which the zygote
+    compares with the one it has seen (see
+    :py:func:`devops_utils.zygote.config_key`).
+    """
+    path = path or CONFIG
+    contents = render(options)
+    try:
+        with open(path) as fobj:
+            if fobj.read() == contents:
+                return
+    except (IOError, OSError):
+        pass
+    with open(path, 'w') as fobj:
+        fobj.write(contents)
+
+
+def apply(profile='default', root=None, config=None, cwd=None):
+    """Configure Ansible for resources of cgroup mounted at ``root``.
+
+    Writes ``config`` (def: :py:data:`CONFIG`) and, if another
+    configuration file takes precedence, sets environment variables for
+    tuned options missing from it (unless they are already set).
+
+    :returns: the tuned options (see :py:func:`settings`)
+    """
+    options = settings(cpu_limit(root), memory_limit(root), profile)
+    write_config(options, config)
+    project = project_config(cwd)
+    if project:
+        missing = set(ENV) - configured(project)
+        for key in sorted(missing):
+            os.environ.setdefault(ENV[key], options[key])
+    return options
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Runs a batch of programs in one container.
+
+``devops-utils batch FILE`` runs ``docker-init batch`` with ``FILE`` on
+standard input, instead of starting a container for each program.  It
+lists programs with their arguments, one per line (split like shell
+words, ``#`` starts a comment).  :py:func:`devops_utils.init.run_batch`
+then initializes the container and runs them with :py:func:`run`.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+__all__ = ('exit_status', 'parse', 'parse_args', 'run', 'summary')
+
+
+def parse(fobj):
+    """Return commands (lists of program and arguments) listed in ``fobj``."""
+    commands = []
+    for line in fobj:
+        argv = shlex.split(line, comments=True)
+        if argv:
+            commands.append(argv)
+    return commands
+
+
+def run(commands, jobs=1, fail_fast=False, stdout=None):
+    """Run ``commands``, up to ``jobs`` at once.
+
+    Commands get :py:data:`os.devnull` as standard input.  When run
+    concurrently, their output lines are prefixed with their number and
+    program.  With ``fail_fast``, no more commands are started once one
+    fails and the running ones are terminated (with any processes they
+    started, as each one runs in its own process group).
+
+    :param list commands: lists of program and arguments
+    :param stdout: text file object to write output of concurrently run
+                   commands to (def: :py:data:`sys.stdout`)
+    :returns: list of (exit status, duration in seconds) tuples, or
+              None for commands not run, in the same order as
+              ``commands``
+    """
+    stdout = stdout or sys.stdout
+    results = [None] * len(commands)
+    pending = list(enumerate(commands))
+    running = {}
+    lock = threading.Lock()
+
+    def execute(i, argv, devnull):
+        if jobs == 1:
+            return subprocess.Popen(argv, stdin=devnull)
+        proc = subprocess.Popen(argv, stdin=devnull, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True,
+                                preexec_fn=os.setpgrp)
+        with lock:
+            running[i] = proc
+        for line in iter(proc.stdout.readline, ''):
+            if not line.endswith('\n'):
+                line += '\n'
+            with lock:
+                stdout.write('{}:{}: {}'.format(
+                    i + 1, os.path.basename(argv[0]), line))
+                stdout.flush()
+        return proc
+
+    def worker():
+        with open(os.devnull) as devnull:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    i, argv = pending.pop(0)
+                start = time.time()
+                try:
+                    status = execute(i, argv, devnull).wait()
+                except OSError as exc:
+                    print('{}: {}'.format(argv[0], exc), file=sys.stderr)
+                    status = 127
+                results[i] = (status, time.time() - start)
+                if status and fail_fast:
+                    with lock:
+                        del pending[:]
+                        for proc in running.values():
+                            try:
+                                os.killpg(proc.pid, signal.SIGTERM)
+                            except OSError:  # already exited
+                                pass
+                with lock:
+                    running.pop(i, None)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(min(jobs, len(commands)), 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summary(commands, results):
+    """Return table of exit statuses and durations of ``commands``.
+
+    :param list results: as returned by :py:func:`run`
+    """
+    lines = ['{:>3}  {:>6}  {:>8}  {}'.format(
+        '#', 'status', 'seconds', 'command')]
+    for i, (argv, result) in enumerate(zip(commands, results)):
+        status, duration = result or ('-', '-')
+        if result:
+            duration = '{:.2f}'.format(duration)
+        lines.append('{:>3}  {:>6}  {:>8}  {}'.format(
+            i + 1, status, duration, ' '.join(argv)))
+    return '\n'.join(lines)
+
+
+def exit_status(results):
+    """Return exit status of a batch: the highest of its commands."""
+    statuses = [status if status >= 0 else 128 - status
+                for status, _ in filter(None, results)]
+    return max(statuses or [0])
+
+
+def parse_args(args):
+    """Return options of ``docker-init batch`` parsed from ``args``."""
+    parser = argparse.ArgumentParser(
+        prog='batch', description='Run programs listed on standard input.')
+    parser.add_argument('--jobs', type=int, metavar='N',
+                        help='run up to N programs at once (def: %(default)s)')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='stop once a program fails')
+    parser.set_defaults(jobs=1)
+    return parser.parse_args(args)
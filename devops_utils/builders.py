@@ -31,9 +31,56 @@ simple interface to execute them with given parameters.
    have access to the package when installed.
 """
 
+try:
+    from time import perf_counter as wall_clock, process_time as cpu_clock
+except ImportError:  # PY2
+    from time import time as wall_clock, clock as cpu_clock
+
+
+__all__ = ('Builders', 'format_timings')
+
 
 class Builders(list):
-    """A list of callables."""
+    """A list of callables.
+
+    If :py:attr:`timings` is set to a list, each call appends to it a
+    dict with name, source file, wall and CPU time (in seconds) of each
+    callable executed, and the wall clock value it started at.
+    """
+    timings = None
+
     def __call__(self, *args):
         for builder in self:
+            self.call_builder(builder, *args)
+
+    def call_builder(self, builder, *args):
+        """Call a single ``builder``, recording its timing if enabled."""
+        if self.timings is None:
             builder(*args)
+            return
+        wall, cpu = wall_clock(), cpu_clock()
+        builder(*args)
+        self.timings.append({
+            'name': builder.__name__,
+            'file': builder.__code__.co_filename,
+            'wall': wall_clock() - wall,
+            'cpu': cpu_clock() - cpu,
+            'start': wall,
+        })
+
+
+def format_timings(timings, fmt='table'):
+    """Return a report of builder timings, slowest first.
+
+    :param list timings: as recorded in :py:attr:`Builders.timings`
+    :param str fmt: report format, ``table`` or ``json``
+    """
+    timings = sorted(timings, key=lambda t: t['wall'], reverse=True)
+    if fmt == 'json':
+        import json  # only needed when profiling
+        return json.dumps(timings, indent=2)
+    lines = ['{:>10} {:>10}  {}'.format('wall ms', 'cpu ms', 'builder')]
+    for t in timings:
+        lines.append('{:10.3f} {:10.3f}  {} ({})'.format(
+            t['wall'] * 1000, t['cpu'] * 1000, t['name'], t['file']))
+    return '\n'.join(lines)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Maintains the persistent Ansible fact cache.
+
+When the external runner is invoked with ``++fact-cache``, it mounts a
+per-project volume at :py:data:`CACHE_DIR` and the ``fact_cache`` init
+plugin configures Ansible to keep facts there with the ``jsonfile``
+cache plugin (and ``gathering = smart``), so facts gathered by one run
+are reused by the following ones until they expire.
+
+To count cache hits and misses, the init plugin also puts a
+``sitecustomize`` module on ``PYTHONPATH`` which installs
+:py:func:`install_hook` (the zygote installs it itself).  It patches
+Ansible's file cache plugins so that the first lookup of each host in
+the cache by a run is appended to :py:data:`LOOKUPS_FILE`, as a hit if
+the host had valid cached facts and a miss otherwise.
+:py:func:`stats` (as ``docker-init fact-cache stats``) reports them.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from devops_utils.vault import ImportHook
+
+
+__all__ = ('CACHE_DIR', 'TIMEOUT', 'clear', 'install_hook', 'record_run',
+           'scan', 'stats', 'write_site')
+
+CACHE_DIR = '/var/local/ansible_cache'
+"Where the cache volume is mounted in the container."
+FACTS_DIR = 'facts'
+"Subdirectory of :py:data:`CACHE_DIR` holding cached facts."
+STATS_FILE = 'stats.json'
+"File in :py:data:`CACHE_DIR` holding run statistics."
+LOOKUPS_FILE = 'lookups.log'
+"File in :py:data:`CACHE_DIR` the lookups are appended to, one per line."
+TIMEOUT = 86400
+"Default lifetime of cached facts (in seconds)."
+SITE_DIR = '/tmp/devops-utils-fact-cache'
+"Directory of the ``sitecustomize`` module installing the hook."
+TARGET = 'ansible.plugins.cache'
+"Module with the file cache plugin base class patched by the hook."
+
+SITECUSTOMIZE = '''\
+# written by devops-utils, counts fact cache hits and misses
+import os
+import sys
+
+from devops_utils import fact_cache
+
+fact_cache.install_hook()
+
+# also run sitecustomize shadowed by this one, if any
+sys.path.remove(os.path.dirname(os.path.abspath(__file__)))
+_self = sys.modules.pop('sitecustomize')
+try:
+    import sitecustomize  # noqa: F401
+except ImportError:
+    pass
+finally:
+    sys.modules['sitecustomize'] = _self
+'''
+
+lookups = {'pid': None, 'seen': set()}
+"Process recording the lookups and the hosts it has looked up."
+
+
+def load_stats(dir):
+    """Return statistics recorded in cache ``dir``."""
+    data = {'runs': 0, 'timeout': TIMEOUT}
+    try:
+        with open(os.path.join(dir, STATS_FILE)) as fobj:
+            data.update(json.load(fobj))
+    except (IOError, OSError, ValueError):
+        pass
+    return data
+
+
+def save_stats(dir, data):
+    """Atomically replace statistics in cache ``dir`` with ``data``."""
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix='.{}.'.format(STATS_FILE))
+    try:
+        with os.fdopen(fd, 'w') as fobj:
+            json.dump(data, fobj)
+        os.rename(tmp, os.path.join(dir, STATS_FILE))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def scan(dir, timeout, now=None):
+    """Return counts of valid and expired entries and their total size.
+
+    :param str dir: cache directory
+    :param int timeout: lifetime of cached facts (in seconds, 0 means
+                        facts never expire, as in Ansible)
+    :rtype: tuple
+    """
+    if now is None:
+        now = time.time()
+    fresh = expired = size = 0
+    facts_dir = os.path.join(dir, FACTS_DIR)
+    if not os.path.isdir(facts_dir):
+        return fresh, expired, size
+    for entry in os.listdir(facts_dir):
+        try:
+            stat = os.stat(os.path.join(facts_dir, entry))
+        except OSError:  # removed meanwhile
+            continue
+        size += stat.st_size
+        if timeout and now - stat.st_mtime > timeout:
+            expired += 1
+        else:
+            fresh += 1
+    return fresh, expired, size
+
+
+def record_run(dir, timeout):
+    """Record a run using cache ``dir`` in its statistics.
+
+    Concurrent runs may race and lose an update, the statistics are
+    only meant to be indicative.
+    """
+    data = load_stats(dir)
+    data['runs'] += 1
+    data['timeout'] = timeout
+    save_stats(dir, data)
+
+
+def record_lookup(dir, key, hit):
+    """Record the first lookup of host ``key`` in cache ``dir``.
+
+    Only lookups by the process which looked up a host first are
+    recorded, not ones repeated by the Ansible workers it forks.
+    """
+    pid = os.getpid()
+    if lookups['pid'] != pid:
+        if lookups['pid'] is not None and lookups['seen']:
+            return
+        lookups['pid'] = pid
+    if key in lookups['seen']:
+        return
+    lookups['seen'].add(key)
+    try:
+        fd = os.open(os.path.join(dir, LOOKUPS_FILE),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b'hit\n' if hit else b'miss\n')
+        finally:
+            os.close(fd)
+    except OSError:  # counting must not break the run
+        pass
+
+
+def count_lookups(dir):
+    """Return (hits, misses) recorded in cache ``dir``."""
+    hits = misses = 0
+    try:
+        with open(os.path.join(dir, LOOKUPS_FILE)) as fobj:
+            for line in fobj:
+                if line == 'hit\n':
+                    hits += 1
+                elif line == 'miss\n':
+                    misses += 1
+    except (IOError, OSError):
+        pass
+    return hits, misses
+
+
+def patch(module):
+    """Count lookups by file cache plugins of cache plugins ``module``.
+
+    Only plugins keeping facts in :py:data:`CACHE_DIR` are counted.
+    """
+    cls = getattr(module, 'BaseFileCacheModule', None)
+    contains = getattr(cls, 'contains', None)
+    if contains is None or getattr(contains, 'counted', False):
+        return
+    facts_dir = os.path.realpath(os.path.join(CACHE_DIR, FACTS_DIR))
+
+    def counted(self, key):
+        found = contains(self, key)
+        cache_dir = getattr(self, '_cache_dir', None)
+        if cache_dir and os.path.realpath(cache_dir) == facts_dir:
+            record_lookup(CACHE_DIR, key, found)
+        return found
+    counted.counted = True
+    cls.contains = counted
+
+
+def install_hook(name=TARGET):
+    """Count fact cache hits and misses of Ansible.
+
+    Patches the cache plugins module ``name`` now if it's already
+    imported, otherwise when it gets imported.
+    """
+    if name in sys.modules:
+        patch(sys.modules[name])
+    if not any(isinstance(hook, ImportHook) and hook.name == name
+               for hook in sys.meta_path):
+        sys.meta_path.insert(0, ImportHook(name, patch))
+
+
+def write_site(dir=None):
+    """Write ``sitecustomize`` installing the hook into ``dir``.
+
+    :param str dir: directory (def: :py:data:`SITE_DIR`)
+    :return: ``dir``, to be prepended to ``PYTHONPATH``
+    """
+    dir = dir or SITE_DIR
+    path = os.path.join(dir, 'sitecustomize.py')
+    if not os.path.exists(path):
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        with open(path, 'w') as fobj:
+            fobj.write(SITECUSTOMIZE)
+    return dir
+
+
+def stats(args):
+    """Print fact cache statistics.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='fact-cache stats',
+                                     description=stats.__doc__)
+    parser.add_argument('--dir', help='cache directory (def: %(default)s)')
+    parser.set_defaults(dir=CACHE_DIR)
+    args = parser.parse_args(args)
+
+    data = load_stats(args.dir)
+    fresh, expired, size = scan(args.dir, data['timeout'])
+    hits, misses = count_lookups(args.dir)
+    print('hosts:    {} ({} valid, {} expired)'.format(
+        fresh + expired, fresh, expired))
+    print('size:     {} bytes'.format(size))
+    print('timeout:  {}s'.format(data['timeout']))
+    print('runs:     {}'.format(data['runs']))
+    print('hit rate: {} ({} hits, {} misses)'.format(
+        '{:.1%}'.format(float(hits) / (hits + misses))
+        if hits + misses else '-', hits, misses))
+    return 0
+
+
+def clear(args):
+    """Remove all cached facts and statistics.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='fact-cache clear',
+                                     description=clear.__doc__)
+    parser.add_argument('--dir', help='cache directory (def: %(default)s)')
+    parser.set_defaults(dir=CACHE_DIR)
+    args = parser.parse_args(args)
+
+    facts_dir = os.path.join(args.dir, FACTS_DIR)
+    if os.path.isdir(facts_dir):
+        for entry in os.listdir(facts_dir):
+            os.unlink(os.path.join(facts_dir, entry))
+    for name in (STATS_FILE, LOOKUPS_FILE):
+        if os.path.exists(os.path.join(args.dir, name)):
+            os.unlink(os.path.join(args.dir, name))
+    return 0
+
+
+def main(args):
+    """Dispatch ``fact-cache`` subcommands.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='fact-cache',
+                                     description='Manage the fact cache.')
+    parser.add_argument('action', choices=('stats', 'clear'))
+    args, action_args = parser.parse_known_args(args)
+    return {'stats': stats, 'clear': clear}[args.action](action_args)
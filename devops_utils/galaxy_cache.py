@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Maintains the content-addressed cache of Ansible Galaxy requirements.
+
+When the external runner is invoked with ``++galaxy-cache``, it mounts
+a volume at :py:data:`CACHE_DIR` and the ``galaxy_cache`` init plugin
+calls :py:func:`resolve` with the project's requirements file.
+
+Roles and collections installed from a requirements file are kept in
+a cache entry named after the hash of the file's contents, so
+``ansible-galaxy`` only runs when the file changes; on a hit the entry
+is just added to Ansible's roles and collections paths.  Least recently
+used entries are removed when the cache grows over a size limit, except
+for the ones in use: a run holds a shared lock on the entry (see
+:py:func:`lock_entry`) until its program exits.
+"""
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+__all__ = ('CACHE_DIR', 'MAX_SIZE', 'evict', 'install', 'resolve')
+
+CACHE_DIR = '/var/local/galaxy_cache'
+"Where the cache volume is mounted in the container."
+MAX_SIZE = 1024
+"Default size limit of the cache (in MiB)."
+REQUIREMENTS = ('requirements.yml', 'roles/requirements.yml')
+"Requirements files looked for when none is given."
+LOCK_SUFFIX = '.lock'
+"Suffix of the lock file of an entry, next to the entry."
+
+
+def requirements_hash(path):
+    """Return hash of contents of requirements file ``path``."""
+    with open(path, 'rb') as fobj:
+        return hashlib.sha256(fobj.read()).hexdigest()
+
+
+def entry_size(path):
+    """Return total size of files under ``path`` (in bytes)."""
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return size
+
+
+def lock_entry(dir, name, exclusive=False):
+    """Lock cache entry ``name`` (which may not exist yet).
+
+    A shared lock (held while installing or using the entry) blocks
+    until the entry isn't being evicted, an exclusive one (held while
+    evicting it) is only taken if nobody holds the entry.
+
+    :return: file descriptor holding the lock, or ``None`` if an
+             exclusive lock isn't available
+    """
+    path = os.path.join(dir, name + LOCK_SUFFIX)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive else
+                        fcntl.LOCK_SH)
+        except (IOError, OSError) as exc:
+            os.close(fd)
+            if exc.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        try:  # the lock file may have been removed by an eviction
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except OSError:
+            pass
+        os.close(fd)
+
+
+def install(path, requirements, galaxy='ansible-galaxy'):
+    """Install roles and collections from ``requirements`` under ``path``.
+
+    Roles are installed in ``roles`` and collections (if the file has a
+    ``collections`` section) in ``collections`` subdirectory.  Output of
+    ``ansible-galaxy`` goes to stderr to keep stdout to the program.
+    """
+    roles = os.path.join(path, 'roles')
+    os.mkdir(roles)
+    subprocess.check_call(
+        [galaxy, 'install', '-r', requirements, '-p', roles],
+        stdout=sys.stderr)
+    with open(requirements) as fobj:
+        has_collections = re.search(r'^collections:', fobj.read(), re.M)
+    if has_collections:
+        subprocess.check_call(
+            [galaxy, 'collection', 'install', '-r', requirements,
+             '-p', os.path.join(path, 'collections')],
+            stdout=sys.stderr)
+
+
+def remove_entry(dir, name, path=None):
+    """Remove entry ``name`` (or its temporary ``path``) unless in use.
+
+    :return: whether it was removed
+    """
+    fd = lock_entry(dir, name, exclusive=True)
+    if fd is None:
+        return False
+    try:
+        shutil.rmtree(path or os.path.join(dir, name), ignore_errors=True)
+        if not os.path.exists(os.path.join(dir, name)):
+            os.unlink(os.path.join(dir, name + LOCK_SUFFIX))
+    finally:
+        os.close(fd)
+    return True
+
+
+def evict(dir, max_size, keep=()):
+    """Remove least recently used entries until cache fits ``max_size``.
+
+    Entries in use (locked by other runs) are skipped, temporary
+    directories left by interrupted installs are removed.
+
+    :param str dir: cache directory
+    :param int max_size: size limit (in bytes)
+    :param keep: names of entries not to remove (e.g. one being used)
+    :return: names of removed entries
+    :rtype: list
+    """
+    entries = []
+    for name in os.listdir(dir):
+        path = os.path.join(dir, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith('.'):  # .{name}.XXXXXX of install in progress
+            if remove_entry(dir, name.split('.')[1], path):
+                logging.debug('removed stale galaxy cache install %s', name)
+            continue
+        entries.append((os.stat(path).st_mtime, name, entry_size(path)))
+    entries.sort()
+
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for _, name, size in entries:
+        if total <= max_size:
+            break
+        if name in keep or not remove_entry(dir, name):
+            continue
+        logging.debug('evicted galaxy cache entry %s (%d bytes)', name, size)
+        total -= size
+        removed.append(name)
+    return removed
+
+
+def resolve(dir, requirements, max_size, galaxy='ansible-galaxy'):
+    """Return cache entry for ``requirements``, installing it on a miss.
+
+    The entry is installed in a temporary directory and renamed into
+    place, so concurrent runs missing the same entry don't see partial
+    installs (the one renaming second just discards its copy).
+
+    The entry is locked against eviction until the process (and the
+    program it executes, which inherits the lock) exits.
+
+    :param str dir: cache directory
+    :param str requirements: path to requirements file
+    :param int max_size: size limit of the cache (in bytes)
+    :return: path of the cache entry
+    :rtype: str
+    """
+    name = requirements_hash(requirements)
+    entry = os.path.join(dir, name)
+    fd = lock_entry(dir, name)  # left open to keep the lock
+    if hasattr(os, 'set_inheritable'):  # PY3
+        os.set_inheritable(fd, True)
+    if os.path.isdir(entry):
+        logging.debug('galaxy cache hit: %s', name)
+        os.utime(entry, None)
+        return entry
+
+    logging.debug('galaxy cache miss: %s', name)
+    tmp = tempfile.mkdtemp(dir=dir, prefix='.{}.'.format(name))
+    try:
+        install(tmp, requirements, galaxy)
+        os.rename(tmp, entry)
+    except OSError:
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    evict(dir, max_size, keep=(name,))
+    return entry
@@ -22,14 +22,22 @@
 
 The :py:func:`main` here is the entrypoint of the devops-utils image.
 It parses the arguments and delegates execution to appropriate handler
-(either :py:func:`run` or :py:func:`devops_utils.install.install`).
+(either :py:func:`run`, :py:func:`run_batch`,
+:py:func:`devops_utils.install.install`,
+:py:func:`devops_utils.plugin.warm_plugins`,
+:py:func:`devops_utils.pool.keeper`,
+:py:func:`devops_utils.fact_cache.main` or
+:py:func:`devops_utils.zygote.server`).  In standby containers, the
+program to run is read with :py:func:`devops_utils.standby.load_request`.
 
 Function :py:func:`run` handles initializing the environment,
 correspondingly to what the external runner has set up by passing
 appropriate options to docker.
 
 :py:func:`initfunc` is a decorator that registers a function to be
-executed during init (from :py:func:`run`).
+executed during init (from :py:func:`run`).  :py:func:`initdeps` can be
+used to declare what the function provides and requires, so that it
+can be run concurrently with independent initializers.
 """
 
 from __future__ import print_function
@@ -41,11 +49,20 @@ import os
 import pwd
 import shutil
 import sys
+import threading
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # PY2
+    from collections import MutableMapping
 
 from devops_utils import PROGS
-from devops_utils.builders import Builders
+from devops_utils import batch, fact_cache, standby, zygote
+from devops_utils.builders import Builders, format_timings
 from devops_utils.install import install
-from devops_utils.plugin import load_plugins
+from devops_utils.plugin import load_plugins, warm_plugins
+from devops_utils.pool import keeper
+from devops_utils.trace import TRACE_CONTAINER_DIR, Trace
 
 
 def install_file(src, dst, owner, group, mode):
@@ -71,7 +88,211 @@ def install_file_if_exists(src, dst, owner, group, mode):
     install_file(src, dst, owner, group, mode)
 
 
-initializers = Builders()
+class ThreadEnviron(MutableMapping):
+    """Environment mapping giving each thread its own overlay.
+
+    Used in place of :py:data:`os.environ` while initializers run
+    concurrently, so that they don't see each other's changes.  Changes
+    made by a thread between :py:meth:`begin` and :py:meth:`end` are
+    recorded in its overlay, other threads access the base environment.
+
+    :param base: the environment to overlay
+    """
+    def __init__(self, base):
+        self.base = base
+        self.local = threading.local()
+
+    def begin(self):
+        self.local.sets, self.local.dels = {}, set()
+
+    def end(self):
+        """Stop recording changes and return (sets, dels) overlay."""
+        changes = self.local.sets, self.local.dels
+        del self.local.sets, self.local.dels
+        return changes
+
+    def __getitem__(self, key):
+        sets = getattr(self.local, 'sets', {})
+        if key in sets:
+            return sets[key]
+        if key in getattr(self.local, 'dels', ()):
+            raise KeyError(key)
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        if not hasattr(self.local, 'sets'):
+            self.base[key] = value
+            return
+        self.local.sets[key] = value
+        self.local.dels.discard(key)
+
+    def __delitem__(self, key):
+        if not hasattr(self.local, 'sets'):
+            del self.base[key]
+            return
+        self[key]  # raise KeyError if missing
+        self.local.sets.pop(key, None)
+        if key in self.base:
+            self.local.dels.add(key)
+
+    def __iter__(self):
+        sets = getattr(self.local, 'sets', {})
+        dels = getattr(self.local, 'dels', ())
+        for key in self.base:
+            if key not in sets and key not in dels:
+                yield key
+        for key in sets:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self)
+
+
+class Initializers(Builders):
+    """Initializers, run concurrently where their declarations allow.
+
+    Initializers without declarations (see :py:func:`initdeps`) run
+    serially in registration order, after all initializers registered
+    before them and before all registered after them.
+
+    Consecutive declared initializers are ordered only by their
+    dependencies: one requiring a resource runs after those providing
+    it, and ones providing the same resource run in registration order.
+    Others run concurrently, in up to :py:attr:`workers` threads.
+
+    Concurrently run initializers get their own copy of the arguments
+    and their own view of :py:data:`os.environ`.  When they finish,
+    environment changes are applied in registration order and the
+    arguments are taken from the last one (in registration order) that
+    changed them.
+    """
+    workers = 4
+
+    def __call__(self, prog, args):
+        for group in self.groups():
+            for level in self.levels(group):
+                if len(level) == 1:
+                    self.call_builder(level[0], prog, args)
+                else:
+                    self.run_concurrently(level, prog, args)
+
+    def groups(self):
+        """Yield lists of initializers separated by undeclared ones."""
+        group = []
+        for func in self:
+            if hasattr(func, 'provides'):
+                group.append(func)
+                continue
+            if group:
+                yield group
+                group = []
+            yield [func]
+        if group:
+            yield group
+
+    @staticmethod
+    def levels(group):
+        """Return list of lists of initializers from ``group``.
+
+        All initializers in a list can run concurrently, once all the
+        ones in previous lists are done.
+        """
+        provided = [set(getattr(func, 'provides', ())) for func in group]
+        deps = {}
+        for i, func in enumerate(group):
+            requires = set(getattr(func, 'requires', ()))
+            deps[i] = set(j for j in range(len(group)) if j != i and (
+                requires & provided[j] or j < i and provided[i] & provided[j]))
+        levels, done = [], set()
+        while len(done) < len(group):
+            level = [i for i in range(len(group))
+                     if i not in done and deps[i] <= done]
+            if not level:
+                logging.warning('dependency cycle among %s, running them '
+                                'serially', [func.__name__ for func in group])
+                return [[func] for func in group]
+            levels.append([group[i] for i in level])
+            done.update(level)
+        return levels
+
+    def run_concurrently(self, level, prog, args):
+        """Run initializers in ``level`` in threads and merge results."""
+        environ = ThreadEnviron(os.environ)
+        results = [None] * len(level)
+        jobs = list(enumerate(level))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not jobs:
+                        return
+                    i, func = jobs.pop(0)
+                own_args = list(args)
+                environ.begin()
+                try:
+                    self.call_builder(func, prog, own_args)
+                    results[i] = (own_args, environ.end(), None)
+                except Exception:
+                    results[i] = (own_args, environ.end(), sys.exc_info())
+
+        real_environ, os.environ = os.environ, environ
+        try:
+            threads = [threading.Thread(target=worker)
+                       for _ in range(min(self.workers, len(level)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.environ = real_environ
+
+        changed = []
+        for func, (own_args, (sets, dels), exc_info) in zip(level, results):
+            if exc_info:
+                raise exc_info[1]
+            for key in dels:
+                os.environ.pop(key, None)
+            os.environ.update(sets)
+            if own_args != args:
+                changed.append((func.__name__, own_args))
+        if len(changed) > 1:
+            logging.warning('arguments changed by %s concurrently, using '
+                            'ones from %s', [name for name, _ in changed],
+                            changed[-1][0])
+        if changed:
+            args[:] = changed[-1][1]
+
+
+def initdeps(provides=(), requires=()):
+    """Declare resources an initializer provides and requires.
+
+    Resources are arbitrary strings, by convention ``env:NAME`` for
+    environment variables, ``file:PATH`` for files and ``args`` for
+    arguments of the program.  Declared initializers may run
+    concurrently with others they don't depend on (see
+    :py:class:`Initializers`).  Should be applied below
+    :py:func:`initfunc`, e.g.::
+
+        @initfunc
+        @initdeps(provides=['env:SSH_AUTH_SOCK'])
+        def init_ssh_agent(prog, args):
+            ...
+
+    :param provides: resources set up by the initializer
+    :param requires: resources that must be set up before it runs
+    """
+    def decorator(func):
+        func.provides = tuple(provides)
+        func.requires = tuple(requires)
+        return func
+    return decorator
+
+
+initializers = Initializers()
 initfunc = initializers.append
 """Register decorated function as initializer.
 
@@ -87,18 +308,90 @@ setup within the container.  The function signature should be:
 """
 
 
+trace = Trace(None, 'init')
+"""Trace of the current run, see :py:mod:`devops_utils.trace`."""
+
+
 def run(prog, args):
-    """Run the specified program."""
-    load_plugins('init', globals())
+    """Run the specified program.
+
+    The program is handed over to the zygote if one is running in the
+    container (see :py:mod:`devops_utils.zygote`), otherwise it
+    replaces the current process.
+    """
+    with trace.phase('plugins'):
+        load_plugins('init', globals())
     args = list(args)
-    initializers(prog, args)
+    profile = os.environ.get('DEVOPS_UTILS_PROFILE')
+    if profile or trace.id:
+        initializers.timings = []
+    with trace.phase('initializers'):
+        initializers(prog, args)
+    if profile:
+        print(format_timings(initializers.timings, profile), file=sys.stderr)
+    trace.add_timings('init:', initializers.timings)
     logging.debug('%r', {'prog': prog, 'args': args})
     logging.debug('cmd: %s', ' '.join([prog] + args))
+    if os.path.isdir(TRACE_CONTAINER_DIR):
+        trace.info['prog'] = prog
+        trace.write(TRACE_CONTAINER_DIR)
+    status = zygote.request(prog, args)
+    if status is not None:
+        sys.exit(status)
     os.execvp(prog, (prog,) + tuple(args))
 
 
+def rewrite_args(prog, args):
+    """Run initializers providing ``args`` on ``args`` of ``prog`` again.
+
+    Used for further commands of a program already initialized, changes
+    made to :py:data:`os.environ` are discarded.
+    """
+    environ = dict(os.environ)
+    try:
+        for func in initializers:
+            if 'args' in getattr(func, 'provides', ()):
+                initializers.call_builder(func, prog, args)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def run_batch(args):
+    """Run programs listed on standard input in one container.
+
+    See :py:mod:`devops_utils.batch`.  The initializers are run once
+    for each distinct program, before running any of them, with the
+    arguments of its first command.  The arguments of the other commands
+    of the program are then rewritten by the initializers declaring they
+    provide ``args`` (see :py:func:`initdeps`), their environment
+    changes being discarded.
+
+    :param list args: command line arguments
+    :returns: the highest exit status of the programs
+    """
+    options = batch.parse_args(args)
+    commands = batch.parse(sys.stdin)
+    load_plugins('init', globals())
+    initialized = set()
+    for argv in commands:
+        prog_args = argv[1:]
+        if argv[0] not in initialized:
+            initialized.add(argv[0])
+            initializers(argv[0], prog_args)
+        else:
+            rewrite_args(argv[0], prog_args)
+        argv[1:] = prog_args
+    logging.debug('%r', {'commands': commands})
+    results = batch.run(commands, options.jobs, options.fail_fast)
+    print(batch.summary(commands, results), file=sys.stderr)
+    return batch.exit_status(results)
+
+
 def main(args=sys.argv[1:]):
     """Run a program in devops-utils container."""
+    global trace
+    trace = Trace(os.environ.get('DEVOPS_UTILS_TRACE'), 'init')
     logging.basicConfig(
         format='(%(module)s:%(funcName)s:%(lineno)s) %(message)s',
         level=logging.INFO if 'DEVOPS_UTILS_DEBUG' not in os.environ else
@@ -113,6 +406,20 @@ def main(args=sys.argv[1:]):
 
     if args.prog == 'install':
         sys.exit(install(prog_args))
+    elif args.prog == 'pool-keeper':
+        sys.exit(keeper(prog_args))
+    elif args.prog == 'warm-plugins':
+        sys.exit(warm_plugins(prog_args))
+    elif args.prog == 'fact-cache':
+        sys.exit(fact_cache.main(prog_args))
+    elif args.prog == 'zygote':
+        sys.exit(zygote.server(prog_args))
+    elif args.prog == 'batch':
+        sys.exit(run_batch(prog_args))
+    elif args.prog == 'standby':
+        prog, prog_args = standby.load_request()
+        trace.id = os.environ.get('DEVOPS_UTILS_TRACE')
+        run(prog, prog_args)
 
     run(args.prog, prog_args)
 
@@ -32,10 +32,13 @@ directly from source.
 from __future__ import print_function
 
 import argparse
+import hashlib
+import json
 import re
 import os
 import shutil
 import sys
+import tempfile
 import textwrap
 
 from pkgutil import find_loader
@@ -50,6 +53,13 @@ if sys.version_info[0] == 2:
 
 __all__ = ('install', 'Replacer')
 
+TARGET_DIR = '/target'
+"Directory to install the runner and links to."
+RUNNER_SOURCE = '/opt/devops-utils/external_runner.py'
+"Source of the runner to install."
+MANIFEST_NAME = '.devops-utils.manifest'
+"Name of the install manifest file (in :py:data:`TARGET_DIR`)."
+
 
 class InvalidOperator(Exception):
     """Invalid operation passed through Replacer."""
@@ -84,13 +94,16 @@ class Replacer(object):
 
     :param iter input: iterator for input lines
     :param dict context: look up variables to be replaced in this dict
+    :param str plugin_dir: base directory to look up plugins in (def:
+                           :py:data:`devops_utils.PLUGIN_DIR`)
     """
     RE_MARKER = re.compile('##INIT:([^#]+)##$')
     "Regex for matching the marker."
 
-    def __init__(self, input, context):
+    def __init__(self, input, context, plugin_dir=None):
         self.input = input
         self.context = context
+        self.plugin_dir = plugin_dir
 
     def handle_module(self, mod):
         l = find_loader(mod)
@@ -98,7 +111,11 @@ class Replacer(object):
         return l.get_source(n)
 
     def handle_plugins(self, type_):
-        for fn in plugin.get_plugins('runner'):
+        if self.plugin_dir is None:
+            fns = plugin.get_plugins(type_)
+        else:
+            fns = plugin.get_plugins(type_, self.plugin_dir)
+        for fn in fns:
             with open(fn) as fobj:
                 for line in fobj:
                     yield line
@@ -129,6 +146,78 @@ class Replacer(object):
                     yield generated
 
 
+def load_manifest(path):
+    """Return contents of install manifest ``path`` (empty if missing)."""
+    try:
+        with open(path) as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_atomic(path, data, stat_source=None):
+    """Write ``data`` to ``path`` via a temporary file and rename.
+
+    :param str stat_source: copy permissions and times from this file
+    """
+    dir, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix='.{}.'.format(name))
+    try:
+        with os.fdopen(fd, 'w') as fobj:
+            fobj.write(data)
+        if stat_source:
+            shutil.copystat(stat_source, tmp)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def install_links(target_dir, runner_name, progs, manifest):
+    """Reconcile links to the runner in ``target_dir``.
+
+    Creates missing links, repoints links created by previous install
+    to another runner name and removes links created by previous
+    install for programs no longer in ``progs``.  Entries not created
+    by install are left alone.  Only scans the directory once.
+
+    :param dict manifest: manifest of previous install
+    :returns: list of links owned by the install
+    """
+    entries = set(os.listdir(target_dir))
+    owned = set(manifest.get('links', ()))
+    old_runner = manifest.get('runner')
+
+    def is_ours(link):
+        return (os.path.basename(link) in owned and os.path.islink(link) and
+                os.readlink(link) in (old_runner, runner_name))
+
+    print('installing links ... ', end='')
+    links = []
+    for prog in progs:
+        link = os.path.join(target_dir, prog)
+        print(' {}'.format(prog), end='')
+        if prog in entries and not is_ours(link):
+            print(' (skip)', end='')
+            continue
+        links.append(prog)
+        if prog in entries and os.readlink(link) == runner_name:
+            continue
+        tmp = os.path.join(target_dir, '.{}.tmp'.format(prog))
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(runner_name, tmp)
+        os.rename(tmp, link)
+    print('')
+
+    for prog in sorted(owned - set(progs)):
+        link = os.path.join(target_dir, prog)
+        if prog in entries and is_ours(link):
+            print('removing stale link {}'.format(prog))
+            os.unlink(link)
+    return links
+
+
 def install(args):
     """Install a runner and shortcuts to all supported programs.
 
@@ -140,6 +229,10 @@ def install(args):
     The runner will execute the command it's run as (or passed as
     first parameter if executed as ``devops-utils``) via docker run.
 
+    A manifest with hash of the installed runner and list of links is
+    kept next to the runner, so that when nothing changed since the
+    last install, nothing is written.
+
     :param list args: command line arguments
     """
     parser = argparse.ArgumentParser(prog='install',
@@ -157,39 +250,58 @@ def install(args):
     args = parser.parse_args(args)
 
     try:
-        check_call(('mountpoint', '-q', '/target'))
+        check_call(('mountpoint', '-q', TARGET_DIR))
     except CalledProcessError:
         print(textwrap.dedent('''\
-            /target is not a mountpoint
+            {0} is not a mountpoint
 
-            Re-run this image with -v $HOME/.local/bin:/target
-            '''))
+            Re-run this image with -v $HOME/.local/bin:{0}
+            '''.format(TARGET_DIR)))
         return 2
 
-    print("installing runner as `{}'".format(args.runner_name))
     replacements = {
         'DOCKER_IMAGE': args.image_name,
         'PROGS': PROGS,
         'RUNNER_NAME': args.runner_name,
     }
-    source = '/opt/devops-utils/external_runner.py'
-    target = '/target/{}'.format(args.runner_name)
-    with open(source, 'r') as sfobj,\
-            open(target, 'w') as dfobj:
-        for line in Replacer(sfobj, replacements):
-            dfobj.write(line)
-    shutil.copystat(source, target)
+    target = os.path.join(TARGET_DIR, args.runner_name)
+    with open(RUNNER_SOURCE, 'r') as sfobj:
+        content = ''.join(Replacer(sfobj, replacements))
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-    if args.no_links:
-        print('skipping links')
+    manifest_path = os.path.join(TARGET_DIR, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    try:
+        stat = os.stat(target)
+        stat = [stat.st_size, stat.st_mtime]
+    except OSError:
+        stat = None
+    runner_current = (manifest.get('runner') == args.runner_name and
+                      manifest.get('sha256') == digest and
+                      manifest.get('stat') == stat)
+    if runner_current and (args.no_links or
+                           manifest.get('progs') == list(PROGS)):
+        print("runner `{}' is up to date".format(args.runner_name))
         return
 
-    print('installing links ... ', end='')
-    for prog in PROGS:
-        link = os.path.join('/target', prog)
-        print(' {}'.format(prog), end='')
-        if os.path.exists(link):
-            print(' (skip)', end='')
-        else:
-            os.symlink(args.runner_name, link)
-    print('')
+    if runner_current:
+        print("runner `{}' is up to date".format(args.runner_name))
+    else:
+        print("installing runner as `{}'".format(args.runner_name))
+        write_atomic(target, content, RUNNER_SOURCE)
+
+    progs, links = manifest.get('progs', []), manifest.get('links', [])
+    if args.no_links:
+        print('skipping links')
+    else:
+        progs = list(PROGS)
+        links = install_links(TARGET_DIR, args.runner_name, progs, manifest)
+
+    stat = os.stat(target)
+    write_atomic(manifest_path, json.dumps({
+        'runner': args.runner_name,
+        'sha256': digest,
+        'stat': [stat.st_size, stat.st_mtime],
+        'progs': progs,
+        'links': links,
+    }))
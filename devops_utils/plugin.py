@@ -26,26 +26,38 @@ The location of the root plugin directory is defined in main package:
 The function :py:func:`load_plugins` is used to load all plugins of a
 given type, whereas :py:func:`get_plugins` can be used to just get a
 list of paths to the plugin files.
+
+Compiled plugins are cached (similarly to ``.pyc`` files) in
+``__pycache__`` directory next to the plugin files, so that they don't
+need to be compiled on every start.  :py:func:`warm_plugins` can be
+used to populate the cache, e.g. when building an image.
 """
 
+from __future__ import print_function
+
+import argparse
 import glob
+import marshal
 import os
+import sys
+import tempfile
 
 from devops_utils import PLUGIN_DIR
 
-
-# PY3 compat: execfile removed
 try:
-    execfile
-except NameError:
-    import tokenize
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
 
-    def execfile(fn, globals):
-        with tokenize.open(fn) as fobj:
-            exec(fobj.read(), globals)
+# PY3 compat: source encoding detection
+try:
+    from tokenize import open as open_source
+except ImportError:
+    open_source = open
 
 
-__all__ = ('get_plugins', 'load_plugins')
+__all__ = ('get_plugins', 'load_plugins', 'warm_plugins')
 
 
 def get_plugins(type_, basedir=PLUGIN_DIR, pattern='*'):
@@ -61,11 +73,58 @@ def get_plugins(type_, basedir=PLUGIN_DIR, pattern='*'):
     return tuple(sorted(glob.glob(os.path.join(dir, pattern + '.py'))))
 
 
+def cache_path(fn):
+    """Return path to the cached code of plugin ``fn``."""
+    dir, name = os.path.split(fn)
+    tag = getattr(getattr(sys, 'implementation', None), 'cache_tag',
+                  'py{}{}'.format(*sys.version_info[:2]))
+    return os.path.join(dir, '__pycache__', '{}.{}.plugin'.format(
+        os.path.splitext(name)[0], tag))
+
+
+def load_code(fn):
+    """Return code object of plugin ``fn``.
+
+    The code is loaded from cache if it's still valid, i.e. it was
+    compiled by the same interpreter from a file of the same path,
+    modification time and size.  Otherwise the plugin is compiled and
+    the result stored in the cache; failure to write the cache (e.g.
+    read-only plugin directory) is ignored.
+
+    :param str fn: path to the plugin file
+    """
+    stat = os.stat(fn)
+    key = (os.path.abspath(fn), stat.st_mtime, stat.st_size)
+    cfn = cache_path(fn)
+    try:
+        with open(cfn, 'rb') as fobj:
+            if fobj.read(len(MAGIC_NUMBER)) == MAGIC_NUMBER:
+                cached_key, code = marshal.load(fobj)
+                if tuple(cached_key) == key:
+                    return code
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+
+    with open_source(fn) as fobj:
+        code = compile(fobj.read(), fn, 'exec', dont_inherit=True)
+    try:
+        if not os.path.isdir(os.path.dirname(cfn)):
+            os.mkdir(os.path.dirname(cfn))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cfn))
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(MAGIC_NUMBER)
+            marshal.dump((key, code), fobj)
+        os.rename(tmp, cfn)
+    except (IOError, OSError):
+        pass
+    return code
+
+
 def load_plugins(type_, globals, basedir=PLUGIN_DIR, pattern='*'):
     """Load plugins of given type.
 
     The plugin files are looked up in ${type}_plugins directory under
-    PLUGIN_DIR.  They are execfile()d in the global namespace of the
+    PLUGIN_DIR.  They are exec'ed in the global namespace of the
     module.
 
     The reason the plugins are exec'ed and not imported is so that it
@@ -73,7 +132,29 @@ def load_plugins(type_, globals, basedir=PLUGIN_DIR, pattern='*'):
     files into a known directory.
 
     :param str type_: type of plugins, i.e. init or runner
-    :param dict globals: as for execfile()
+    :param dict globals: as for exec()
+    :param str basedir: base directory to look up plugins in
+    :param str pattern: glob pattern to match against plugin names
+    """
+    for fn in get_plugins(type_, basedir, pattern):
+        exec(load_code(fn), globals)
+
+
+def warm_plugins(args):
+    """Compile plugins and store them in the cache.
+
+    Useful to run when building an image, after adding plugins, so that
+    they don't have to be compiled on each container start.
+
+    :param list args: command line arguments
     """
-    for fn in get_plugins(type_, basedir):
-        execfile(fn, globals)
+    parser = argparse.ArgumentParser(prog='warm-plugins',
+                                     description=warm_plugins.__doc__)
+    parser.add_argument('types', nargs='*', metavar='TYPE',
+                        help='types of plugins (def: init runner)')
+    args = parser.parse_args(args)
+
+    for type_ in args.types or ('init', 'runner'):
+        for fn in get_plugins(type_):
+            load_code(fn)
+            print('compiled {}'.format(fn))
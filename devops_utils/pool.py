@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Implements the keeper of a pooled devops-utils container.
+
+When the external runner is invoked with ``++pool``, it starts a
+long-lived container running :py:func:`keeper` (as ``docker-init
+pool-keeper``) and executes programs in it with ``docker exec``.
+
+The keeper just waits until no program has been running in the
+container for a given time (TTL) and exits, which stops (and removes)
+the container.  With ``--zygote`` it also starts the zygote (see
+:py:mod:`devops_utils.zygote`) so programs start with their modules
+already imported.
+"""
+
+import argparse
+import errno
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+__all__ = ('busy_processes', 'keeper', 'reap_children')
+
+
+def busy_processes(proc='/proc'):
+    """Return a list of PIDs of processes keeping the container busy.
+
+    That is all processes except the keeper itself, ``ssh-agent``
+    started by the image entrypoint and zombies (not yet reaped by
+    :py:func:`reap_children`).
+
+    :param str proc: path to the proc filesystem
+    """
+    pids = []
+    for entry in os.listdir(proc):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(proc, entry, 'comm')) as fobj:
+                comm = fobj.read().strip()
+            with open(os.path.join(proc, entry, 'stat')) as fobj:
+                state = fobj.read().rpartition(')')[2].split()[0]
+        except (IOError, OSError, IndexError):  # process exited meanwhile
+            continue
+        if comm != 'ssh-agent' and state != 'Z':
+            pids.append(int(entry))
+    return pids
+
+
+def reap_children():
+    """Wait for exited children of the keeper, without blocking.
+
+    Running as PID 1, the keeper inherits processes orphaned by programs
+    run with ``docker exec`` (e.g. ssh ControlPersist masters), which
+    would otherwise stay as zombies once they exit.
+    """
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError as exc:
+            if exc.errno == errno.ECHILD:
+                return
+            raise
+        if not pid:
+            return
+
+
+def keeper(args):
+    """Keep the container running until it has been idle for TTL seconds.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='pool-keeper',
+                                     description=keeper.__doc__)
+    parser.add_argument('--ttl', type=int,
+                        help='idle time in seconds (def: %(default)s)')
+    parser.add_argument('--interval', type=float,
+                        help='how often to check for running programs '
+                             '(def: %(default)s)')
+    parser.add_argument('--zygote', action='store_true',
+                        help='start zygote preloading programs\' modules')
+    parser.set_defaults(ttl=600, interval=5)
+    args = parser.parse_args(args)
+
+    # running as PID 1, which ignores SIGTERM by default
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    idle = []
+    if args.zygote:
+        idle.append(subprocess.Popen(['docker-init', 'zygote']).pid)
+
+    last_busy = time.time()
+    while True:
+        reap_children()
+        now = time.time()
+        if [pid for pid in busy_processes() if pid not in idle]:
+            last_busy = now
+        elif now - last_busy >= args.ttl:
+            logging.debug('idle for %ds, exiting', now - last_busy)
+            return 0
+        time.sleep(min(args.interval, args.ttl))
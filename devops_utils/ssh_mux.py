@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Implements sharing of SSH master connections between containers.
+
+SSH master connections (``ControlMaster``) normally live in the
+container of the first ``ssh`` using them and die with it.  To reuse
+them across container runs, the external runner (with ``++ssh-mux``)
+starts a long-lived container running :py:func:`server`, with a
+control socket directory shared by all containers of the same user
+using the same SSH credentials.
+
+Each ``ssh`` in the containers for which there is no control socket yet
+runs :py:func:`connect` (configured via ``Match exec`` in SSH config by
+the ssh init plugin), which asks the server to start a master
+connection to the target host (unless one is already running), so that
+the ``ssh`` itself can then use it.
+
+The server exits (stopping its container) once it's idle and no master
+connection is alive for a given time (TTL).  Sockets of dead master
+connections are removed by the server.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from SocketServer import StreamRequestHandler
+except ImportError:
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from socketserver import StreamRequestHandler
+
+
+__all__ = ('cleanup', 'connect', 'control_path', 'server')
+
+MUX_DIR = '/var/local/ssh_mux'
+"Control socket directory shared by all containers."
+SERVER_SOCKET = '.server'
+"Name of the server socket in :py:data:`MUX_DIR`."
+
+
+def control_path(user, host, port, dir=MUX_DIR):
+    """Return path to the control socket for given connection."""
+    return os.path.join(dir, '{}@{}:{}'.format(user, host, port))
+
+
+def is_alive(path):
+    """Return whether something listens on unix socket ``path``."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def cleanup(dir=MUX_DIR):
+    """Remove stale sockets from ``dir``.
+
+    :returns: number of live master connection sockets
+    """
+    alive = 0
+    for name in os.listdir(dir):
+        path = os.path.join(dir, name)
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                continue
+        except OSError:
+            continue
+        if is_alive(path):
+            alive += name != SERVER_SOCKET
+        else:
+            logging.debug('removing stale socket %s', path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    return alive
+
+
+def start_master(user, host, port, persist, dir=MUX_DIR):
+    """Start master connection to the host unless already running.
+
+    :returns: whether the master connection is running
+    """
+    path = control_path(user, host, port, dir)
+    if is_alive(path):
+        return True
+    cmd = ['ssh', '-M', '-N', '-f', '-o', 'BatchMode=yes',
+           '-o', 'ControlPath={}'.format(path),
+           '-o', 'ControlPersist={}'.format(persist),
+           '-p', str(port), '-l', user, host]
+    logging.debug('run: %s', ' '.join(cmd))
+    env = dict(os.environ, SSH_MUX_SERVER='1')
+    with open(os.devnull, 'r+') as devnull:
+        return subprocess.call(cmd, env=env, stdin=devnull,
+                               stdout=devnull) == 0
+
+
+class MuxHandler(StreamRequestHandler):
+    """Handles ``USER HOST PORT`` requests to start master connections."""
+    def handle(self):
+        self.server.last_request = time.time()
+        try:
+            user, host, port = self.rfile.readline().decode('utf-8').split()
+        except ValueError:
+            self.wfile.write(b'error\n')
+            return
+        ok = start_master(user, host, port, self.server.persist,
+                          self.server.dir)
+        self.wfile.write(b'ok\n' if ok else b'error\n')
+
+
+class MuxServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, dir, persist):
+        self.dir = dir
+        self.persist = persist
+        self.last_request = time.time()
+        UnixStreamServer.__init__(self, os.path.join(dir, SERVER_SOCKET),
+                                  MuxHandler)
+
+
+def server(args):
+    """Run the server starting SSH master connections on request.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='server', description=server.__doc__)
+    parser.add_argument('--dir', help='control socket directory '
+                                      '(def: %(default)s)')
+    parser.add_argument('--ttl', type=int,
+                        help=('exit after idle with no master connections '
+                              'for this many seconds, also used as '
+                              'ControlPersist (def: %(default)s)'))
+    parser.add_argument('--interval', type=float,
+                        help='how often to check for idleness and stale '
+                             'sockets (def: %(default)s)')
+    parser.set_defaults(dir=MUX_DIR, ttl=600, interval=5)
+    args = parser.parse_args(args)
+
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir, 0o700)
+    cleanup(args.dir)
+    if is_alive(os.path.join(args.dir, SERVER_SOCKET)):
+        print('ssh-mux server already running', file=sys.stderr)
+        return 1
+    mux = MuxServer(args.dir, args.ttl)
+    thread = threading.Thread(target=mux.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    last_busy = time.time()
+    while True:
+        time.sleep(min(args.interval, args.ttl))
+        now = time.time()
+        if cleanup(args.dir):
+            last_busy = now
+        last_busy = max(last_busy, mux.last_request)
+        if now - last_busy >= args.ttl:
+            mux.shutdown()
+            mux.server_close()
+            os.unlink(os.path.join(args.dir, SERVER_SOCKET))
+            return 0
+
+
+def connect(args):
+    """Make sure a master connection to the host is running.
+
+    Intended for ``Match exec`` in SSH config, exits with 0 if the
+    master connection is running (so the matching block, which should
+    set ``ControlPath`` accordingly, applies).
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='connect',
+                                     description=connect.__doc__)
+    parser.add_argument('user')
+    parser.add_argument('host')
+    parser.add_argument('port')
+    parser.add_argument('--dir', help='control socket directory '
+                                      '(def: %(default)s)')
+    parser.add_argument('--timeout', type=float,
+                        help=('how long to wait for the master connection '
+                              '(def: %(default)s)'))
+    parser.set_defaults(dir=MUX_DIR, timeout=30)
+    args = parser.parse_args(args)
+
+    if os.environ.get('SSH_MUX_SERVER'):  # ssh started by server itself
+        return 1
+    if is_alive(control_path(args.user, args.host, args.port, args.dir)):
+        return 0
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(args.timeout)
+    try:
+        sock.connect(os.path.join(args.dir, SERVER_SOCKET))
+        sock.sendall('{} {} {}\n'.format(
+            args.user, args.host, args.port).encode('utf-8'))
+        reply = sock.makefile('rb').readline()
+    except socket.error as exc:
+        logging.debug('ssh-mux server: %s', exc)
+        return 1
+    finally:
+        sock.close()
+    return 0 if reply.strip() == b'ok' else 1
+
+
+def main(args=sys.argv[1:]):
+    """Share SSH master connections between devops-utils containers."""
+    logging.basicConfig(
+        format='(%(module)s:%(funcName)s:%(lineno)s) %(message)s',
+        level=logging.INFO if 'DEVOPS_UTILS_DEBUG' not in os.environ else
+        logging.DEBUG)
+
+    parser = argparse.ArgumentParser(description=main.__doc__, add_help=False)
+    parser.add_argument('command', choices=('server', 'connect'))
+    args, cmd_args = parser.parse_known_args(args)
+    sys.exit({'server': server, 'connect': connect}[args.command](cmd_args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Runs programs in standby containers.
+
+With ``++standby``, the external runner keeps containers created (but
+not started) with ``docker-init standby`` as the command, so that a
+following run only has to start one.  Before starting a container, the
+runner copies the program to run, its arguments and environment
+variables specific to the run (e.g. ``DEVOPS_UTILS_TRACE``) into it (as
+JSON object at :py:data:`REQUEST`), which :py:func:`load_request` reads.
+"""
+
+import json
+import os
+
+
+__all__ = ('REQUEST', 'load_request')
+
+REQUEST = '/var/run/devops-utils-standby.json'
+"Where the runner puts the program and arguments to run."
+
+
+def load_request(path=None):
+    """Return (prog, args) tuple requested by the runner, removing it.
+
+    Environment variables in the request are set in :py:data:`os.environ`.
+
+    :param str path: request file (def: :py:data:`REQUEST`)
+    :raises SystemExit: if there's no request
+    """
+    path = path or REQUEST
+    try:
+        with open(path) as fobj:
+            request = json.load(fobj)
+    except (IOError, OSError, ValueError):
+        raise SystemExit('no program to run in standby container')
+    os.unlink(path)
+    os.environ.update(request['env'])
+    argv = request['argv']
+    return argv[0], argv[1:]
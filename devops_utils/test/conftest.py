@@ -21,6 +21,8 @@
 """Common fixtures and settings for `devops_utils` tests."""
 
 import os
+import subprocess
+import sys
 
 import pytest
 
@@ -36,6 +38,51 @@ def plugin_dir(monkeypatch, tmpdir):
     return tmpdir
 
 
+@pytest.fixture
+def runner(monkeypatch):
+    """The external runner module, as if invoked as ``devops-utils``."""
+    import external_runner
+    monkeypatch.setattr(sys, 'argv', ['devops-utils'])
+    return external_runner
+
+
+@pytest.fixture
+def fake_docker(monkeypatch, tmpdir):
+    """Put a stub ``docker`` on PATH.
+
+    The stub prints its arguments and exits with status N given in an
+    argument containing ``EXIT=N``, if any.  Returns path to the stub.
+    """
+    bindir = tmpdir.mkdir('fake-bin')
+    docker = bindir.join('docker')
+    docker.write(
+        '#!/bin/sh\n'
+        'echo "$@"\n'
+        'for arg; do\n'
+        '  case "$arg" in *EXIT=*) exit "${arg##*EXIT=}";; esac\n'
+        'done\n')
+    docker.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        bindir, os.pathsep, os.environ['PATH']))
+    return docker
+
+
+@pytest.fixture
+def fake_exec(monkeypatch):
+    """Make :py:func:`os.execvp` run the program in a child process.
+
+    Instead of replacing the test process, the program is run and
+    :py:exc:`SystemExit` with its exit status is raised.
+    """
+    real_execvp, pid = os.execvp, os.getpid()
+
+    def execvp(file, args):
+        if os.getpid() != pid:  # child of subprocess on python 2
+            real_execvp(file, args)
+        sys.exit(subprocess.call(args))
+    monkeypatch.setattr(os, 'execvp', execvp)
+
+
 def create_plugin(type_, name, contents):
     """Create a plugin for tests.
 
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for Ansible tuning (``ansible_tuning`` plugins and module)."""
+
+import os
+
+import pytest
+
+from devops_utils import ansible_tuning, init, plugin
+
+
+@pytest.fixture
+def cgroup(monkeypatch, tmpdir):
+    """Empty cgroup filesystem root, with 8 CPUs on the host."""
+    monkeypatch.setattr(ansible_tuning, 'cpu_count', lambda: 8)
+    return tmpdir.mkdir('cgroup')
+
+
+@pytest.fixture
+def config(monkeypatch, tmpdir):
+    """Isolated environment, returns path of the tuned ansible.cfg."""
+    monkeypatch.setattr(os, 'environ', dict(os.environ))
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.delenv('ANSIBLE_CONFIG', raising=False)
+    for name in ansible_tuning.ENV.values():
+        monkeypatch.delenv(name, raising=False)
+    path = tmpdir.mkdir('etc').join('ansible.cfg')
+    monkeypatch.setattr(ansible_tuning, 'CONFIG', str(path))
+    return path
+
+
+class TestLimits(object):
+    def test_no_limits(self, cgroup):
+        assert ansible_tuning.cpu_limit(str(cgroup)) == 8
+        assert ansible_tuning.memory_limit(str(cgroup)) is None
+
+    def test_cgroup_v2(self, cgroup):
+        cgroup.join('cpu.max').write('150000 100000\n')
+        cgroup.join('memory.max').write('1073741824\n')
+
+        assert ansible_tuning.cpu_limit(str(cgroup)) == 1.5
+        assert ansible_tuning.memory_limit(str(cgroup)) == 2 ** 30
+
+    def test_cgroup_v2_unlimited(self, cgroup):
+        cgroup.join('cpu.max').write('max 100000\n')
+        cgroup.join('memory.max').write('max\n')
+
+        assert ansible_tuning.cpu_limit(str(cgroup)) == 8
+        assert ansible_tuning.memory_limit(str(cgroup)) is None
+
+    def test_cgroup_v1(self, cgroup):
+        cgroup.join('cpu,cpuacct', 'cpu.cfs_quota_us').write(
+            '200000\n', ensure=True)
+        cgroup.join('cpu,cpuacct', 'cpu.cfs_period_us').write('100000\n')
+        cgroup.join('memory', 'memory.limit_in_bytes').write(
+            '9223372036854771712\n', ensure=True)
+
+        assert ansible_tuning.cpu_limit(str(cgroup)) == 2
+        assert ansible_tuning.memory_limit(str(cgroup)) is None
+
+    def test_quota_over_cpus(self, cgroup):
+        cgroup.join('cpu.max').write('1600000 100000\n')
+
+        assert ansible_tuning.cpu_limit(str(cgroup)) == 8
+
+
+class TestSettings(object):
+    @pytest.mark.parametrize('cpus,memory,profile,forks', [
+        (2, None, 'default', '8'),
+        (2, None, 'fast', '20'),
+        (2, None, 'safe', '4'),
+        (64, None, 'default', '50'),
+        (4, 1024 * 2 ** 20, 'default', '8'),
+        (0.5, None, 'safe', '1'),
+        (4, 128 * 2 ** 20, 'default', '1'),
+    ])
+    def test_forks(self, cpus, memory, profile, forks):
+        options = ansible_tuning.settings(cpus, memory, profile)
+
+        assert options[('defaults', 'forks')] == forks
+
+    def test_safe(self):
+        options = ansible_tuning.settings(2, profile='safe')
+
+        assert options[('ssh_connection', 'pipelining')] == 'False'
+        assert options[('defaults', 'internal_poll_interval')] == '0.01'
+
+    def test_render(self):
+        assert ansible_tuning.render({
+            ('ssh_connection', 'pipelining'): 'True',
+            ('defaults', 'forks'): '8',
+            ('defaults', 'internal_poll_interval'): '0.005',
+        }) == (
+            '# generated by devops-utils from container resources\n'
+            '\n[defaults]\nforks = 8\ninternal_poll_interval = 0.005\n'
+            '\n[ssh_connection]\npipelining = True\n')
+
+
+class TestApply(object):
+    def test_writes_config(self, cgroup, config):
+        cgroup.join('cpu.max').write('100000 100000\n')
+
+        options = ansible_tuning.apply('default', str(cgroup))
+
+        assert config.read() == ansible_tuning.render(options)
+        assert options[('defaults', 'forks')] == '4'
+        assert 'ANSIBLE_FORKS' not in os.environ
+
+    def test_unchanged_config_not_rewritten(self, cgroup, config):
+        ansible_tuning.apply('default', str(cgroup))
+        os.utime(str(config), (0, 0))
+
+        ansible_tuning.apply('default', str(cgroup))
+
+        assert config.mtime() == 0
+
+    def test_project_config(self, cgroup, config, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir.mkdir('project'))
+        os.environ['ANSIBLE_SSH_ARGS'] = '-C'
+        with open('ansible.cfg', 'w') as fobj:
+            fobj.write('[defaults]\nforks = 3\n')
+
+        options = ansible_tuning.apply('fast', str(cgroup))
+
+        assert 'ANSIBLE_FORKS' not in os.environ
+        assert os.environ['ANSIBLE_PIPELINING'] == 'True'
+        assert os.environ['ANSIBLE_SSH_ARGS'] == '-C'
+        assert options[('defaults', 'forks')] == '80'
+
+    def test_init(self, cgroup, config, monkeypatch):
+        ctx = {'initfunc': lambda func: func, 'initdeps': init.initdeps}
+        plugin.load_plugins('init', ctx, pattern='ansible_tuning')
+        monkeypatch.setattr(ansible_tuning, 'CGROUP_ROOT', str(cgroup))
+        calls = []
+        monkeypatch.setattr(ansible_tuning, 'apply', calls.append)
+
+        ctx['init_ansible_tuning']('fab', [])
+        os.environ['DEVOPS_UTILS_ANSIBLE_PROFILE'] = 'off'
+        ctx['init_ansible_tuning']('ansible', [])
+        os.environ['DEVOPS_UTILS_ANSIBLE_PROFILE'] = 'safe'
+        ctx['init_ansible_tuning']('/usr/local/bin/ansible-playbook', [])
+
+        assert calls == ['safe']
+
+
+class TestAnsibleTuningRunner(object):
+    def test_builder(self, runner):
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_ansible_tuning')
+        args = runner.argparse.Namespace(
+            ansible_profile='fast', cpus='2', memory='1g')
+        docker_run = runner.DockerRunCommand('ansible-playbook', [], [])
+
+        builder(args, docker_run)
+
+        assert docker_run.docker_args == [
+            '-e', 'DEVOPS_UTILS_ANSIBLE_PROFILE=fast', '--cpus=2',
+            '--memory=1g']
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for batch mode (``batch`` runner plugin and module)."""
+
+import io
+import os
+import sys
+
+import pytest
+
+from devops_utils import batch, init
+
+
+def sh(script):
+    return ['sh', '-c', script]
+
+
+class TestBatch(object):
+    def test_parse(self):
+        fobj = io.StringIO(u'# setup\nansible-galaxy install -r reqs.yml\n'
+                           u'\n  ansible-playbook "site one.yml"  # all\n')
+
+        assert batch.parse(fobj) == [
+            ['ansible-galaxy', 'install', '-r', 'reqs.yml'],
+            ['ansible-playbook', 'site one.yml']]
+
+    def test_run_sequential(self):
+        results = batch.run([['true'], sh('exit 3'), ['true']])
+
+        assert [status for status, _ in results] == [0, 3, 0]
+        assert all(duration >= 0 for _, duration in results)
+
+    def test_fail_fast(self):
+        results = batch.run([sh('exit 2'), ['true']], fail_fast=True)
+
+        assert results[0][0] == 2
+        assert results[1] is None
+
+    def test_missing_program(self):
+        assert batch.run([['devops-utils-no-such-program']])[0][0] == 127
+
+    def test_run_concurrently(self, tmpdir):
+        path = tmpdir.join('out')
+
+        with path.open('w') as out:
+            results = batch.run([sh('echo one'), sh('echo two')], jobs=2,
+                                stdout=out)
+
+        assert sorted(path.read().splitlines()) == [
+            '1:sh: one', '2:sh: two']
+        assert [status for status, _ in results] == [0, 0]
+
+    def test_fail_fast_terminates(self):
+        results = batch.run([sh('sleep 10'), sh('sleep 0.2; exit 1'),
+                             ['true']],
+                            jobs=2, fail_fast=True, stdout=io.StringIO())
+
+        assert results[0][0] == -15
+        assert results[0][1] < 5
+        assert results[1][0] == 1
+        assert results[2] is None
+
+    def test_summary(self):
+        commands = [['ansible-playbook', 'site.yml'], ['fab', 'deploy']]
+
+        assert batch.summary(commands, [(2, 1.5), None]).splitlines() == [
+            '  #  status   seconds  command',
+            '  1       2      1.50  ansible-playbook site.yml',
+            '  2       -         -  fab deploy']
+
+    @pytest.mark.parametrize('results,status', [
+        ([], 0), ([(0, 1), None], 0), ([(0, 1), (3, 1), (1, 1)], 3),
+        ([(-15, 1), (3, 1)], 143),
+    ])
+    def test_exit_status(self, results, status):
+        assert batch.exit_status(results) == status
+
+    def test_run_batch(self, monkeypatch, capfd):
+        monkeypatch.setattr(sys, 'stdin', io.StringIO(
+            u'true\nsh -c "exit 4"\ntrue -x\n'))
+        monkeypatch.setattr(init, 'load_plugins', lambda *args: None)
+        calls = []
+        monkeypatch.setattr(init, 'initializers', init.Initializers(
+            [lambda prog, args: calls.append((prog, args))]))
+
+        assert init.run_batch(['--jobs', '1']) == 4
+
+        assert calls == [('true', []), ('sh', ['-c', 'exit 4'])]
+        assert '  3       0' in capfd.readouterr().err
+
+    def test_run_batch_rewrites_args(self, monkeypatch, capfd):
+        monkeypatch.setattr(sys, 'stdin', io.StringIO(
+            u'echo a\necho b\n'))
+        monkeypatch.setattr(init, 'load_plugins', lambda *args: None)
+        calls = []
+
+        @init.initdeps(provides=['args'])
+        def rewrite(prog, args):
+            args[:] = [arg.upper() for arg in args]
+            os.environ['DEVOPS_UTILS_TEST'] = ' '.join(args)
+
+        monkeypatch.setattr(init, 'initializers', init.Initializers(
+            [lambda prog, args: calls.append(prog), rewrite]))
+        monkeypatch.delenv('DEVOPS_UTILS_TEST', raising=False)
+
+        assert init.run_batch(['--jobs', '1']) == 0
+
+        assert calls == ['echo']
+        assert os.environ['DEVOPS_UTILS_TEST'] == 'A'
+        assert capfd.readouterr().out == 'A\nB\n'
+
+
+class TestBatchRunner(object):
+    def test_command(self, runner, fake_docker, fake_exec, capfd,
+                     monkeypatch, tmpdir):
+        commands = tmpdir.join('commands')
+        commands.write('true\n')
+        dups = []
+        monkeypatch.setattr(os, 'dup2', lambda fd, fd2: dups.append(fd2))
+
+        with pytest.raises(SystemExit):
+            runner.main(['++jobs', '2', '++fail-fast', 'batch', str(commands)])
+
+        assert dups == [0]
+        out = capfd.readouterr().out
+        assert out.startswith('run -i --rm ')
+        assert out.rstrip().endswith('batch --jobs 2 --fail-fast')
+        assert ' -t ' not in out
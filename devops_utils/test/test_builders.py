@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for `devops_utils.builders` module."""
+
+import json
+import os
+
+import pytest
+
+from devops_utils.builders import Builders, format_timings
+
+
+def first(args):
+    args.append('first')
+
+
+def second(args):
+    args.append('second')
+
+
+class TestBuilders(object):
+    def test_call(self):
+        builders = Builders([first, second])
+        args = []
+
+        builders(args)
+
+        assert args == ['first', 'second']
+        assert builders.timings is None
+
+    def test_timings(self):
+        builders = Builders([first, second])
+        builders.timings = []
+
+        builders([])
+
+        assert [t['name'] for t in builders.timings] == ['first', 'second']
+        assert builders.timings[0]['file'] == __file__.replace('.pyc', '.py')
+        assert all(t['wall'] >= 0 and t['cpu'] >= 0
+                   for t in builders.timings)
+
+
+class TestFormatTimings(object):
+    timings = [
+        {'name': 'fast', 'file': 'a.py', 'wall': 0.001, 'cpu': 0.001},
+        {'name': 'slow', 'file': 'b.py', 'wall': 0.3, 'cpu': 0.01},
+    ]
+
+    def test_table(self):
+        lines = format_timings(self.timings).splitlines()
+
+        assert lines[0].split() == ['wall', 'ms', 'cpu', 'ms', 'builder']
+        assert lines[1].split() == ['300.000', '10.000', 'slow', '(b.py)']
+        assert lines[2].split() == ['1.000', '1.000', 'fast', '(a.py)']
+
+    def test_json(self):
+        report = json.loads(format_timings(self.timings, 'json'))
+
+        assert [t['name'] for t in report] == ['slow', 'fast']
+
+
+class TestRunnerProfile(object):
+    def test_profile(self, runner, monkeypatch, capsys):
+        monkeypatch.setattr(runner, 'docker_cli', lambda docker_run: None)
+        monkeypatch.setattr(runner.argparse_builders, 'timings', None)
+        monkeypatch.setattr(runner.docker_run_builders, 'timings', None)
+
+        with pytest.raises(SystemExit) as exc:
+            runner.main(['++profile', '++profile-format=json', 'true'])
+
+        assert exc.value.code == 0
+        report = json.loads(capsys.readouterr().err)
+        names = set(t['name'] for t in report)
+        assert set(['argparse_base', 'docker_run_base']) <= names
+        assert os.path.basename(report[0]['file']).endswith('.py')
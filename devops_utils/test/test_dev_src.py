@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for mounted and synced source (``dev_src`` runner plugin)."""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def fake_rsync(monkeypatch, tmpdir):
+    """Put a stub ``rsync`` on PATH.
+
+    The stub logs its arguments, one per line, to ``rsync.log`` next to
+    it and prints statistics like ``rsync --stats``.
+    """
+    bindir = tmpdir.mkdir('rsync-bin')
+    rsync = bindir.join('rsync')
+    rsync.write(
+        '#!/bin/sh\n'
+        'printf "%s\\n" "$@" > {}\n'
+        'echo "Number of files: 10 (reg: 8, dir: 2)"\n'
+        'echo "Number of regular files transferred: 2"\n'
+        'echo "Total file size: 12,345 bytes"\n'
+        'echo "Total bytes sent: 1,234"\n'
+        'echo "Total bytes received: 56"\n'.format(bindir.join('rsync.log')))
+    rsync.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        bindir, os.pathsep, os.environ['PATH']))
+    rsync.log = bindir.join('rsync.log')
+    return rsync
+
+
+def resolve(runner, args):
+    args, prog_args = runner.parse_args(args)
+    docker_run = runner.DockerRunCommand(args.prog, prog_args)
+    runner.docker_run_builders(args, docker_run)
+    return docker_run
+
+
+class TestDevSrc(object):
+    def test_mount(self, runner, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+
+        docker_run = resolve(runner, ['++dev', 'ansible-playbook', 'x.yml'])
+
+        assert docker_run.prog_args == ['x.yml']
+        assert '{}:/opt/app'.format(tmpdir) in docker_run.docker_args
+
+    def test_volume(self, runner):
+        assert runner.dev_sync_volume('/src/proj') == runner.dev_sync_volume(
+            '/src/proj/')
+        assert runner.dev_sync_volume('/src/proj').startswith(
+            'devops-utils-src-proj-')
+        assert runner.dev_sync_volume('/src/proj') != runner.dev_sync_volume(
+            '/other/proj')
+
+    def test_dockerignore_filters(self, runner, tmpdir):
+        ignore = tmpdir.join('.dockerignore')
+        ignore.write('# comment\n\n.git\n/build/\n*.pyc\n'
+                     '**/__pycache__\n!keep.pyc\n.\n')
+
+        assert runner.dockerignore_filters(str(ignore)) == [
+            '+ /keep.pyc', '- /**/__pycache__', '- /*.pyc', '- /build',
+            '- /.git']
+
+    def test_sync(self, runner, fake_rsync, tmpdir, monkeypatch):
+        project = tmpdir.mkdir('proj')
+        project.join('.dockerignore').write('.git\n')
+        monkeypatch.chdir(project)
+
+        docker_run = resolve(runner, ['++dev=sync', 'ansible-playbook'])
+
+        volume = runner.dev_sync_volume()
+        args = fake_rsync.log.read().splitlines()
+        assert args[-3:] == ['--filter=- /.git', '{}/'.format(project),
+                             'rsync:/opt/app/']
+        assert '--rsh=docker run --rm -i -v {}:/opt/app --entrypoint'.\
+            format(volume) in args
+        assert '--rsync-path={}'.format(runner.DOCKER_IMAGE) in args
+        assert '{}:/opt/app'.format(volume) in docker_run.docker_args
+        assert not docker_run.cacheable
+
+    def test_sync_stats(self, runner, fake_rsync, tmpdir):
+        stats = runner.dev_sync('vol', str(tmpdir))
+
+        assert stats.pop('seconds') >= 0
+        assert stats == {'files': 2, 'size': 12345, 'sent': 1234}
+
+    def test_sync_failure(self, runner, fake_rsync, tmpdir):
+        fake_rsync.write('#!/bin/sh\nexit 12\n')
+
+        with pytest.raises(SystemExit) as exc:
+            runner.dev_sync('vol', str(tmpdir))
+
+        assert 'failed (12)' in str(exc.value.code)
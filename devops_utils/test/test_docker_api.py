@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for ``docker_api`` runner plugin, against a fake docker daemon."""
+
+import io
+import json
+import os
+import struct
+import sys
+import threading
+
+import pytest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """Speaks just enough of the Engine API to run a container."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def frame(self, stream, data):
+        self.wfile.write(struct.pack('>BxxxL', stream, len(data)) + data)
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path, id(self)))
+        length = int(self.headers.get('Content-Length') or 0)
+        if self.path.endswith('/containers/create'):
+            self.server.config = json.loads(self.rfile.read(length).decode())
+            if self.server.pulled is not False:
+                self.reply(201, {'Id': 'c0ffee', 'Warnings': []})
+            else:
+                self.reply(404, {'message': 'No such image: {}'.format(
+                    self.server.config['Image'])})
+        elif '/images/create?' in self.path:
+            self.server.pulled = self.server.pull_error is None
+            message = ({'error': self.server.pull_error}
+                       if self.server.pull_error else {'status': 'Done'})
+            data = json.dumps({'status': 'Pulling'}) + '\r\n' + \
+                json.dumps(message) + '\r\n'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data.encode('utf-8'))
+        elif '/attach?' in self.path:
+            self.wfile.write(
+                b'HTTP/1.1 101 UPGRADED\r\n'
+                b'Content-Type: application/vnd.docker.raw-stream\r\n'
+                b'Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n')
+            if 'stdin=1' in self.path:
+                self.frame(1, b'got: ' + self.rfile.read())
+            self.frame(1, b'hello\n')
+            self.frame(2, b'oops\n')
+            self.close_connection = True
+        elif self.path.endswith('/start'):
+            self.reply(204)
+        elif self.path.endswith('/wait'):
+            self.reply(200, {'StatusCode': self.server.status})
+        else:
+            self.reply(404, {'message': 'not found'})
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path, id(self)))
+        self.reply(204)
+
+
+class FakeDockerDaemon(ThreadingMixIn, UnixStreamServer):
+    """Fake daemon, with the image present unless ``pulled`` is False."""
+    daemon_threads = True
+    status = 0
+    config = None
+    pulled = None
+    pull_error = None
+
+    def __init__(self, path):
+        UnixStreamServer.__init__(self, path, FakeDockerHandler)
+        self.requests = []
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    server = FakeDockerDaemon(str(tmpdir.join('docker.sock')))
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def devnull():
+    fd = os.open(os.devnull, os.O_RDONLY)
+    yield fd
+    os.close(fd)
+
+
+class TestCreateConfig(object):
+    def test_translate(self, runner, monkeypatch):
+        monkeypatch.setenv('BAR', '2')
+        monkeypatch.delenv('BAZ', raising=False)
+        docker_run = runner.DockerRunCommand('fab', ['-l'], [
+            '-i', '-t', '--rm', '-e', 'FOO=1', '-e', 'BAR', '-e', 'BAZ',
+            '-v', '/src:/opt/app', '-w', '/opt/app', '--net=host'])
+
+        config, remove = runner.api_create_config(docker_run)
+
+        assert remove
+        assert config['Cmd'] == ['fab', '-l']
+        assert config['Tty'] and config['OpenStdin']
+        assert config['Env'] == ['FOO=1', 'BAR=2']
+        assert config['WorkingDir'] == '/opt/app'
+        assert config['HostConfig'] == {
+            'Binds': ['/src:/opt/app'], 'NetworkMode': 'host'}
+
+    def test_resources(self, runner):
+        docker_run = runner.DockerRunCommand(
+            'ansible', [], ['--cpus=1.5', '--memory=512m'])
+
+        config, remove = runner.api_create_config(docker_run)
+
+        assert config['HostConfig']['NanoCpus'] == 1500000000
+        assert config['HostConfig']['Memory'] == 512 * 1024 * 1024
+
+    def test_traced(self, runner, monkeypatch, tmpdir):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+        monkeypatch.setattr(runner, 'trace', runner.Trace('abc', 'runner'))
+        docker_run = runner.DockerRunCommand('fab', [], ['-e', 'FOO=1'])
+
+        config, remove = runner.api_create_config(docker_run)
+
+        assert config['Env'] == ['FOO=1', 'DEVOPS_UTILS_TRACE=abc']
+        assert config['HostConfig']['Binds'] == ['{}:{}'.format(
+            runner.trace_dir(), runner.TRACE_CONTAINER_DIR)]
+        assert docker_run.docker_args == ['-e', 'FOO=1']
+
+    def test_unsupported(self, runner):
+        docker_run = runner.DockerRunCommand('fab', [], ['--cap-add=ALL'])
+
+        with pytest.raises(ValueError):
+            runner.api_create_config(docker_run)
+
+    def test_fallback(self, runner, monkeypatch):
+        calls = []
+        monkeypatch.setattr(runner, 'docker_cli', calls.append)
+        monkeypatch.setenv('DOCKER_HOST', 'tcp://127.0.0.1:2376')
+        docker_run = runner.DockerRunCommand('fab', [])
+
+        runner.docker_api(docker_run)
+
+        assert calls == [docker_run]
+
+
+class TestImageTag(object):
+    @pytest.mark.parametrize('image,expected', [
+        ('gimoh/devops-utils', ('gimoh/devops-utils', 'latest')),
+        ('gimoh/devops-utils:1.0', ('gimoh/devops-utils', '1.0')),
+        ('reg:5000/devops-utils', ('reg:5000/devops-utils', 'latest')),
+        ('reg:5000/devops-utils:1.0', ('reg:5000/devops-utils', '1.0')),
+        ('devops-utils@sha256:ab', ('devops-utils', 'sha256:ab')),
+    ])
+    def test_split(self, runner, image, expected):
+        assert runner.api_image_tag(image) == expected
+
+
+class TestRun(object):
+    def test_run(self, runner, daemon, devnull):
+        docker_run = runner.DockerRunCommand(
+            'ansible', ['all'], ['--rm', '-e', 'FOO=1'])
+        stdout, stderr = io.BytesIO(), io.BytesIO()
+
+        runner.api_run(docker_run, daemon.server_address, devnull,
+                       stdout, stderr)
+
+        assert stdout.getvalue() == b'hello\n'
+        assert stderr.getvalue() == b'oops\n'
+        assert daemon.config['Cmd'] == ['ansible', 'all']
+        assert [req[:2] for req in daemon.requests] == [
+            ('POST', '/v1.24/containers/create'),
+            ('POST', '/v1.24/containers/c0ffee/attach'
+                     '?stream=1&stdout=1&stderr=1'),
+            ('POST', '/v1.24/containers/c0ffee/start'),
+            ('POST', '/v1.24/containers/c0ffee/wait'),
+            ('DELETE', '/v1.24/containers/c0ffee?force=1'),
+        ]
+        # all but attach sent over the same connection
+        conns = [req[2] for req in daemon.requests]
+        assert len(set(conns[:1] + conns[2:])) == 1
+        assert conns[1] != conns[0]
+
+    def test_run_stdin(self, runner, daemon):
+        docker_run = runner.DockerRunCommand('cat', [], ['-i'])
+        stdout = io.BytesIO()
+        rfd, wfd = os.pipe()
+        os.write(wfd, b'data\n')
+        os.close(wfd)
+
+        runner.api_run(docker_run, daemon.server_address, rfd,
+                       stdout, io.BytesIO())
+        os.close(rfd)
+
+        assert stdout.getvalue() == b'got: data\nhello\n'
+
+    def test_run_failure(self, runner, daemon, devnull):
+        daemon.status = 3
+        docker_run = runner.DockerRunCommand('false', [])
+
+        status = runner.api_run(docker_run, daemon.server_address, devnull,
+                                io.BytesIO(), io.BytesIO())
+
+        assert status == 3
+
+    def test_run_pulls_missing_image(self, runner, daemon, devnull, capsys):
+        daemon.pulled = False
+        docker_run = runner.DockerRunCommand('ansible', [])
+
+        status = runner.api_run(docker_run, daemon.server_address, devnull,
+                                io.BytesIO(), io.BytesIO())
+
+        assert status == 0
+        assert [req[1] for req in daemon.requests[:3]] == [
+            '/v1.24/containers/create',
+            '/v1.24/images/create?fromImage={}&tag=latest'.format(
+                runner.DOCKER_IMAGE),
+            '/v1.24/containers/create',
+        ]
+        assert "Unable to find image '{}' locally".format(
+            runner.DOCKER_IMAGE) in capsys.readouterr()[1]
+
+    def test_run_pull_error(self, runner, daemon, devnull):
+        daemon.pulled = False
+        daemon.pull_error = 'manifest unknown'
+        docker_run = runner.DockerRunCommand('ansible', [])
+
+        with pytest.raises(runner.DockerAPIError) as excinfo:
+            runner.api_run(docker_run, daemon.server_address, devnull,
+                           io.BytesIO(), io.BytesIO())
+
+        assert 'manifest unknown' in str(excinfo.value)
+        assert [req[1] for req in daemon.requests][-1].startswith(
+            '/v1.24/images/create?')
+
+    def test_api_error_exits(self, runner, daemon, devnull, monkeypatch):
+        daemon.pulled = False
+        daemon.pull_error = 'manifest unknown'
+        monkeypatch.setenv('DOCKER_HOST', 'unix://' + daemon.server_address)
+        monkeypatch.setattr(sys, 'stdin', os.fdopen(os.dup(devnull)))
+
+        with pytest.raises(SystemExit) as excinfo:
+            runner.docker_api(runner.DockerRunCommand('ansible', []))
+
+        assert 'manifest unknown' in str(excinfo.value)
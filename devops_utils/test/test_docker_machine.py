@@ -20,6 +20,8 @@
 
 """Tests for `docker_machine` plugin."""
 
+import json
+import os
 import textwrap
 
 import pytest
@@ -29,11 +31,34 @@ from devops_utils import init, plugin
 
 @pytest.fixture
 def dm_env():
-    ctx = {'initfunc': init.initfunc}
+    ctx = {'initfunc': init.initfunc, 'initdeps': init.initdeps}
     plugin.load_plugins('init', ctx, pattern='docker_machine')
     return ctx['dm_env']
 
 
+@pytest.fixture
+def dm_plugin(monkeypatch, tmpdir):
+    """Context of the plugin with storage path in tmpdir and fake
+    ``docker-machine`` recording its calls in ``ctx['calls']``."""
+    monkeypatch.setenv('MACHINE_STORAGE_PATH', str(tmpdir))
+    monkeypatch.setenv('ACTIVE_DM', 'foo')
+    monkeypatch.delenv('DM_ENV_REFRESH', raising=False)
+    monkeypatch.delenv('DM_ENV_CACHE', raising=False)
+    monkeypatch.delenv('DM_ENV_CACHE_TTL', raising=False)
+    tmpdir.join('machines', 'foo', 'config.json').write('{}', ensure=True)
+
+    ctx = {'initfunc': lambda func: func, 'initdeps': init.initdeps,
+           'os': os, 'calls': []}
+    plugin.load_plugins('init', ctx, pattern='docker_machine')
+
+    def check_output(cmd):
+        ctx['calls'].append(cmd)
+        return b'export DOCKER_HOST="tcp://1.2.3.4:2376"\n'
+    ctx['check_output'] = check_output
+    monkeypatch.setattr(os, 'environ', dict(os.environ))
+    return ctx
+
+
 class TestDockerMachinePlugin(object):
     def test_dm_env_comment(self, dm_env):
         dm_out = '# this is = a comment'
@@ -50,3 +75,149 @@ class TestDockerMachinePlugin(object):
             ('DOCKER_TLS_VERIFY', '1'),
             ('DOCKER_CERT_PATH', '/app=dm/machines/foo'),
             ]
+
+
+class TestDockerMachineEnvCache(object):
+    def test_miss(self, dm_plugin):
+        dm_plugin['init_dm']('docker', [])
+
+        assert dm_plugin['calls'] == [['docker-machine', 'env', 'foo']]
+        assert os.environ['DOCKER_HOST'] == 'tcp://1.2.3.4:2376'
+
+    def test_hit(self, dm_plugin):
+        dm_plugin['init_dm']('docker', [])
+        del os.environ['DOCKER_HOST']
+        dm_plugin['init_dm']('docker', [])
+
+        assert len(dm_plugin['calls']) == 1
+        assert os.environ['DOCKER_HOST'] == 'tcp://1.2.3.4:2376'
+
+    def test_reprovisioned(self, dm_plugin, tmpdir):
+        dm_plugin['init_dm']('docker', [])
+        cert = tmpdir.join('machines', 'foo', 'cert.pem')
+        cert.write('')
+        dm_plugin['init_dm']('docker', [])
+
+        assert len(dm_plugin['calls']) == 2
+
+    def test_expired(self, dm_plugin):
+        dm_plugin['init_dm']('docker', [])
+        os.environ['DM_ENV_CACHE_TTL'] = '-1'
+        dm_plugin['init_dm']('docker', [])
+
+        assert len(dm_plugin['calls']) == 2
+
+    def test_refresh(self, dm_plugin):
+        dm_plugin['init_dm']('docker', [])
+        os.environ['DM_ENV_REFRESH'] = '1'
+        dm_plugin['init_dm']('docker', [])
+
+        assert len(dm_plugin['calls']) == 2
+
+
+def write_machine(tmpdir, name, driver_name, **driver):
+    config = {'Name': name, 'DriverName': driver_name, 'Driver': driver}
+    tmpdir.join('machines', name, 'config.json').write(
+        json.dumps(config), ensure=True)
+
+
+class TestDockerMachineNativeEnv(object):
+    def test_generic(self, dm_plugin, tmpdir):
+        write_machine(tmpdir, 'foo', 'generic', IPAddress='10.0.0.1',
+                      EnginePort=2377)
+
+        dm_plugin['init_dm']('docker', [])
+
+        assert dm_plugin['calls'] == []
+        assert os.environ['DOCKER_HOST'] == 'tcp://10.0.0.1:2377'
+        assert os.environ['DOCKER_TLS_VERIFY'] == '1'
+        assert os.environ['DOCKER_CERT_PATH'] == str(
+            tmpdir.join('machines', 'foo'))
+        assert os.environ['DOCKER_MACHINE_NAME'] == 'foo'
+
+    def test_default_port(self, dm_plugin, tmpdir):
+        write_machine(tmpdir, 'foo', 'amazonec2', IPAddress='10.0.0.1')
+
+        assert dict(dm_plugin['dm_native_env']('foo'))['DOCKER_HOST'] == (
+            'tcp://10.0.0.1:2376')
+
+    def test_none_driver(self, dm_plugin, tmpdir):
+        write_machine(tmpdir, 'foo', 'none', URL='tcp://10.0.0.2:2376')
+
+        assert dict(dm_plugin['dm_native_env']('foo'))['DOCKER_HOST'] == (
+            'tcp://10.0.0.2:2376')
+
+    def test_unsupported_driver(self, dm_plugin, tmpdir):
+        write_machine(tmpdir, 'foo', 'virtualbox', IPAddress='10.0.0.1')
+
+        dm_plugin['init_dm']('docker', [])
+
+        assert dm_plugin['calls'] == [['docker-machine', 'env', 'foo']]
+        assert os.environ['DOCKER_HOST'] == 'tcp://1.2.3.4:2376'
+
+    def test_no_address(self, dm_plugin, tmpdir):
+        write_machine(tmpdir, 'foo', 'generic')
+
+        assert dm_plugin['dm_native_env']('foo') is None
+
+    def test_missing_machine(self, dm_plugin):
+        assert dm_plugin['dm_native_env']('bar') is None
+
+
+def docker_run_dm(runner):
+    return next(builder for builder in runner.docker_run_builders
+                if builder.__name__ == 'docker_run_dm')
+
+
+class TestDockerMachineFanout(object):
+    def test_single(self, runner):
+        args = runner.argparse.Namespace(dm='foo', dm_refresh=False,
+                                         parallel=4)
+        docker_run = runner.DockerRunCommand('docker', ['ps'])
+
+        docker_run_dm(runner)(args, docker_run)
+
+        assert docker_run.docker_args == ['-e', 'ACTIVE_DM=foo']
+        assert docker_run.executor is runner.docker_cli
+
+    def test_machines_list(self, runner):
+        docker_run = runner.DockerRunCommand('docker', ['ps'])
+
+        assert runner.dm_machines(docker_run, 'foo,bar,foo') == [
+            'foo', 'bar']
+
+    def test_machines_glob(self, runner, monkeypatch):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            return b'web1\nweb2\ndb1\n'
+        monkeypatch.setattr(runner.subprocess, 'check_output', check_output)
+        docker_run = runner.DockerRunCommand('docker', ['ps'],
+                                             ['-i', '-t', '--rm', '-v', 'a:b'])
+
+        assert runner.dm_machines(docker_run, 'web*,db1,web1') == [
+            'web1', 'web2', 'db1']
+        assert calls == [[
+            'docker', 'run', '--rm', '-v', 'a:b', runner.DOCKER_IMAGE,
+            'docker-machine', 'ls', '-q']]
+
+    def test_fanout(self, runner, fake_docker, capfd):
+        args = runner.argparse.Namespace(dm='ok,EXIT=2', dm_refresh=False,
+                                         parallel=4)
+        docker_run = runner.DockerRunCommand('docker', ['ps'], ['-i', '-t'])
+        docker_run_dm(runner)(args, docker_run)
+
+        with pytest.raises(SystemExit) as exc:
+            docker_run.executor(docker_run)
+
+        assert exc.value.code == 2
+        out, err = capfd.readouterr()
+        assert sorted(out.splitlines()) == [
+            'EXIT=2: run -e ACTIVE_DM=EXIT=2 {} docker ps'.format(
+                runner.DOCKER_IMAGE),
+            'ok: run -e ACTIVE_DM=ok {} docker ps'.format(
+                runner.DOCKER_IMAGE),
+        ]
+        assert [line.split()[:2] for line in err.splitlines()] == [
+            ['machine', 'status'], ['ok', '0'], ['EXIT=2', '2']]
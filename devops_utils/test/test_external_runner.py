@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for `external_runner` module."""
+
+import fcntl
+import functools
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def cache_home(runner, fake_docker, fake_exec, monkeypatch, tmpdir):
+    """Invocation cache in tmpdir, run from a clean home directory."""
+    home = tmpdir.mkdir('home')
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    monkeypatch.delenv('SSH_AUTH_SOCK', raising=False)
+    for name in ('DEVOPS_UTILS_BACKEND', 'DEVOPS_UTILS_MAX_STARTS',
+                 'DEVOPS_UTILS_MAX_USER_STARTS', 'DEVOPS_UTILS_START_WAIT',
+                 'DEVOPS_UTILS_TRACE'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.chdir(home)
+    return home
+
+
+@pytest.fixture
+def log_level():
+    """Restore the root logger level changed by ``++debug``."""
+    level = logging.getLogger().level
+    yield
+    logging.getLogger().setLevel(level)
+
+
+def no_builders(*args):
+    raise AssertionError('builders should not run')
+
+
+def run_main(runner, args):
+    """Run the runner's main and return its exit status."""
+    with pytest.raises(SystemExit) as exc:
+        runner.main(args)
+    return exc.value.code
+
+
+class TestRunParallel(object):
+    def test_run_parallel(self, runner, fake_docker, capfd):
+        runs = [
+            (name, runner.DockerRunCommand('true', [], ['-i', '-e', env]))
+            for name, env in (('a', 'EXIT=0'), ('b', 'EXIT=3'),
+                              ('c', 'EXIT=0'))]
+
+        results = runner.run_parallel(runs, 2)
+
+        assert [(name, status) for name, status, _ in results] == [
+            ('a', 0), ('b', 3), ('c', 0)]
+        assert all(duration >= 0 for _, _, duration in results)
+        out = sorted(capfd.readouterr().out.splitlines())
+        assert out == [
+            'a: run -e EXIT=0 {} true'.format(runner.DOCKER_IMAGE),
+            'b: run -e EXIT=3 {} true'.format(runner.DOCKER_IMAGE),
+            'c: run -e EXIT=0 {} true'.format(runner.DOCKER_IMAGE),
+        ]
+
+
+class TestInvocationCache(object):
+    def test_reuses_command(self, runner, cache_home, capfd, monkeypatch):
+        assert run_main(runner, ['true', '-x']) == 0
+        first = capfd.readouterr().out
+        monkeypatch.setattr(runner, 'docker_run_builders', no_builders)
+
+        assert run_main(runner, ['true', '-x']) == 0
+
+        assert capfd.readouterr().out == first
+        assert first.startswith('run -i -t --rm ')
+
+    def test_key(self, runner, cache_home, monkeypatch, tmpdir):
+        key = runner.invocation_key(['true'])
+
+        assert runner.invocation_key(['true']) == key
+        assert runner.invocation_key(['true', '-x']) != key
+        monkeypatch.setenv('SSH_AUTH_SOCK', '/tmp/agent')
+        assert runner.invocation_key(['true']) != key
+        monkeypatch.delenv('SSH_AUTH_SOCK')
+        monkeypatch.chdir(tmpdir)
+        assert runner.invocation_key(['true']) != key
+        key = runner.invocation_key(['true'])
+        monkeypatch.setattr(runner.sys, 'version', '2.7.18 (default)')
+        assert runner.invocation_key(['true']) != key
+
+    def test_debug_bypasses_cache(self, runner, cache_home, monkeypatch,
+                                  log_level):
+        run_main(runner, ['true'])
+        calls = []
+        monkeypatch.setattr(runner, 'docker_run_builders',
+                            lambda args, docker_run: calls.append(args))
+
+        run_main(runner, ['++debug', 'true'])
+
+        assert len(calls) == 1
+
+    def test_not_cacheable(self, runner, cache_home):
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.cacheable = False
+
+        runner.invocation_cache_put('key', docker_run)
+
+        assert runner.invocation_cache_get('key') is None
+
+    def test_partial_executor(self, runner, cache_home):
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.executor = functools.partial(runner.docker_cli)
+
+        runner.invocation_cache_put('key', docker_run)
+
+        assert runner.invocation_cache_get('key') is None
+
+    def test_cache_paths(self, runner, cache_home):
+        docker_run = runner.DockerRunCommand('true', ['-x'], ['-i'])
+        docker_run.cache_paths.append(str(cache_home.join('config')))
+        runner.invocation_cache_put('key', docker_run)
+
+        cached = runner.invocation_cache_get('key')
+        assert repr(cached) == repr(docker_run)
+        assert cached.executor is runner.docker_cli
+
+        cache_home.join('config').write('')
+        assert runner.invocation_cache_get('key') is None
+
+    def test_post_run_hooks(self, runner, cache_home):
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.post_run_hooks.append(runner.run_post_run_hooks)
+        runner.invocation_cache_put('key', docker_run)
+        docker_run.post_run_hooks.append(lambda docker_run, status: None)
+        runner.invocation_cache_put('lambda', docker_run)
+
+        assert runner.invocation_cache_get('key').post_run_hooks == [
+            runner.run_post_run_hooks]
+        assert runner.invocation_cache_get('lambda') is None
+
+    def test_admission(self, runner, cache_home):
+        assert run_main(runner, ['++max-starts', '2', 'true']) == 0
+
+        cached = runner.invocation_cache_get(
+            runner.invocation_key(['++max-starts', '2', 'true']))
+        assert cached.admission == {'host': 2, 'user': 0, 'wait': 600}
+
+    def test_expired_entries_removed(self, runner, cache_home):
+        docker_run = runner.DockerRunCommand('true', [])
+        runner.invocation_cache_put('old', docker_run)
+        path = os.path.join(runner.invocation_cache_dir(), 'old')
+        os.utime(path, (0, 0))
+
+        runner.invocation_cache_put('new', docker_run)
+
+        assert os.listdir(runner.invocation_cache_dir()) == ['new']
+
+
+def resolve(runner, args, fast):
+    """Return options, command and executor the runner resolves."""
+    opts, prog_args = runner.parse_args(args, fast)
+    docker_run = runner.DockerRunCommand(opts.prog, prog_args)
+    runner.docker_run_builders(opts, docker_run)
+    return vars(opts), repr(docker_run), docker_run.executor
+
+
+class TestFastPath(object):
+    @pytest.mark.parametrize('name', ['devops-utils', 'ansible-playbook'])
+    @pytest.mark.parametrize('args', [
+        [], ['site.yml'], ['ansible', '-m', 'ping', 'all'],
+        ['-i', 'hosts', 'site.yml', '-e', 'a=b'], ['-', '-x=1', ''],
+    ])
+    @pytest.mark.parametrize('env', [
+        {}, {'SSH_AUTH_SOCK': '/tmp/agent', 'DEVOPS_UTILS_BACKEND': 'api'},
+    ])
+    def test_same_as_full_path(self, runner, cache_home, monkeypatch,
+                               name, args, env):
+        monkeypatch.setattr(runner.sys, 'argv', [name])
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        if name == 'devops-utils' and not args:
+            with pytest.raises(SystemExit):
+                runner.parse_args(args)
+            return
+
+        full = resolve(runner, args, fast=False)
+        monkeypatch.setattr(runner, 'argparse', None)
+        fast = resolve(runner, args, fast=True)
+
+        assert fast == full
+
+    @pytest.mark.parametrize('args', [
+        ['++dev', 'ansible'], ['ansible', '--', '-x'], ['ansible', '+x'],
+    ])
+    def test_full_path(self, runner, args):
+        assert isinstance(runner.parse_args(args)[0],
+                          runner.argparse.Namespace)
+
+    def test_defaults_parser(self, runner):
+        parser = runner.DefaultsParser()
+        parser.add_argument('prog')
+        parser.add_argument('+O', '++docker-opt', action='append')
+        parser.add_argument('++flag', action='store_true')
+        parser.add_argument('++late', default='a')
+        parser.set_defaults(docker_opt=[], late='b', extra=1)
+        parser.add_argument('++ttl', type=int, default='10')
+        parser.add_argument('++other', dest='renamed')
+
+        opts, prog_args = parser.parse_known_args(['prog', '-x', 'y'])
+
+        assert vars(opts) == {
+            'prog': 'prog', 'docker_opt': [], 'flag': False, 'late': 'b',
+            'extra': 1, 'ttl': 10, 'renamed': None}
+        assert prog_args == ['-x', 'y']
+
+    @pytest.mark.parametrize('kwargs,message', [
+        ({'required': True}, 'required option ++opt'),
+        ({'nargs': '*'}, 'nargs of ++opt not supported'),
+    ])
+    def test_defaults_parser_unsupported(self, runner, kwargs, message):
+        parser = runner.DefaultsParser()
+
+        with pytest.raises(runner.NeedsArgparse) as exc:
+            parser.add_argument('++opt', **kwargs)
+
+        assert str(exc.value) == message
+
+    def test_defaults_parser_method(self, runner):
+        parser = runner.DefaultsParser()
+
+        with pytest.raises(runner.NeedsArgparse):
+            parser.add_mutually_exclusive_group()
+
+    def test_defaults_parser_missing_positional(self, runner):
+        parser = runner.DefaultsParser()
+        parser.add_argument('prog')
+
+        with pytest.raises(runner.NeedsArgparse) as exc:
+            parser.parse_known_args([])
+
+        assert str(exc.value) == 'missing positional argument prog'
+
+
+class TestRunCommand(object):
+    def test_exec(self, runner, monkeypatch):
+        calls = []
+
+        def execvp(file, args):
+            calls.append((file, args))
+            sys.exit(0)
+        monkeypatch.setattr(os, 'execvp', execvp)
+        docker_run = runner.DockerRunCommand('true', [])
+
+        with pytest.raises(SystemExit):
+            runner.run_command(['docker', 'run', 'x'], docker_run)
+
+        assert calls == [('docker', ['docker', 'run', 'x'])]
+
+    def test_supervise(self, runner, fake_docker):
+        calls = []
+        docker_run = runner.DockerRunCommand('true', [], ['-e', 'EXIT=3'])
+        docker_run.post_run_hooks.append(
+            lambda docker_run, status: calls.append(status))
+
+        assert runner.docker_cli(docker_run) == 3
+        assert calls == [3]
+
+    def test_forwards_signals(self, runner):
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.post_run_hooks.append(lambda docker_run, status: None)
+        timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+
+        status = runner.run_command(
+            ['sh', '-c', 'trap "exit 42" TERM; while :; do sleep 0.05; done'],
+            docker_run)
+
+        timer.join()
+        assert status == 42
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+    def test_killed(self, runner):
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.post_run_hooks.append(lambda docker_run, status: None)
+
+        assert runner.run_command(['sh', '-c', 'kill -TERM $$'],
+                                  docker_run) == -signal.SIGTERM
+
+    @pytest.mark.parametrize('status,returncode', [
+        (None, 0), (0, 0), (3, 3), (-signal.SIGTERM, -signal.SIGTERM),
+    ])
+    def test_exit_with(self, runner, status, returncode):
+        proc = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys, external_runner; external_runner.exit_with({})'
+             .format(status)],
+            cwd=os.path.dirname(runner.__file__))
+
+        assert proc.wait() == returncode
+
+
+@pytest.fixture
+def admission(runner, cache_home, monkeypatch, tmpdir):
+    """Host-wide start semaphore in tmpdir, returns its directory."""
+    monkeypatch.setattr(runner, 'ADMISSION_DIR', str(tmpdir.join('starts')))
+    return tmpdir.join('starts')
+
+
+def admission_run(runner, host=1, user=0, wait=5):
+    docker_run = runner.DockerRunCommand('true', [])
+    docker_run.admission = {'host': host, 'user': user, 'wait': wait}
+    return docker_run
+
+
+def is_locked(path):
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+class TestAdmission(object):
+    def test_acquire(self, runner, admission):
+        docker_run = admission_run(runner, host=2, user=1)
+
+        runner.admission_acquire(docker_run)
+
+        assert len(docker_run.admission_fds) == 2
+        assert is_locked(admission.join('slot.0'))
+        assert not admission.join('slot.1').exists()
+        assert admission.join('queue').listdir() == []
+        runner.admission_release(docker_run)
+        assert not is_locked(admission.join('slot.0'))
+
+    def test_waits_for_slot(self, runner, admission):
+        first = admission_run(runner)
+        runner.admission_acquire(first)
+        second = admission_run(runner)
+        thread = threading.Thread(target=runner.admission_acquire,
+                                  args=(second,))
+        thread.start()
+
+        time.sleep(0.3)
+        assert thread.is_alive()
+        assert len(admission.join('queue').listdir()) == 1
+        runner.admission_release(first)
+        thread.join(5)
+
+        assert len(second.admission_fds) == 1
+        runner.admission_release(second)
+
+    def test_fifo(self, runner, admission):
+        admission.join('queue').ensure(dir=True)
+        ahead = admission.join('queue', '1.1')
+        ahead.write('')
+        fd = os.open(str(ahead), os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        try:
+            with pytest.raises(SystemExit) as exc:
+                runner.admission_acquire(admission_run(runner, wait=0.2))
+        finally:
+            os.close(fd)
+
+        assert 'timed out' in str(exc.value.code)
+        assert not admission.join('slot.0').exists()
+
+    def test_stale_ticket_removed(self, runner, admission):
+        admission.join('queue').ensure(dir=True)
+        admission.join('queue', '1.1').write('')
+        docker_run = admission_run(runner, wait=0)
+
+        runner.admission_acquire(docker_run)
+
+        assert admission.join('queue').listdir() == []
+        runner.admission_release(docker_run)
+
+    def test_hand_over(self, runner, admission):
+        docker_run = admission_run(runner)
+        runner.admission_acquire(docker_run)
+
+        runner.admission_hand_over(docker_run)
+
+        assert docker_run.admission_fds == []
+        assert is_locked(admission.join('slot.0'))
+        cidfile = docker_run.docker_args[-1].partition('=')[2]
+        with open(cidfile, 'w') as fobj:
+            fobj.write('0123456789ab\n')
+        for _ in range(100):
+            if not is_locked(admission.join('slot.0')):
+                break
+            time.sleep(0.05)
+        assert not is_locked(admission.join('slot.0'))
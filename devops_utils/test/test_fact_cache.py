@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for persistent fact cache (``fact_cache`` plugins and module)."""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from devops_utils import fact_cache, init, plugin
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    """Cache with a valid (``web1``) and an expired (``db1``) entry."""
+    facts = tmpdir.mkdir(fact_cache.FACTS_DIR)
+    facts.join('web1').write('{"a": 1}')
+    facts.join('db1').write('{}')
+    old = time.time() - 7200
+    os.utime(str(facts.join('db1')), (old, old))
+    return tmpdir
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Fresh lookups state of this process."""
+    monkeypatch.setattr(fact_cache, 'lookups', {'pid': None, 'seen': set()})
+    return fact_cache.lookups
+
+
+class FakeFileCache(object):
+    """File cache plugin with ``db1`` and ``web1`` cached."""
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def contains(self, key):
+        return key in ('db1', 'web1')
+
+
+@pytest.fixture
+def init_fact_cache(cache_dir, monkeypatch):
+    monkeypatch.setattr(fact_cache, 'CACHE_DIR', str(cache_dir))
+    monkeypatch.setattr(fact_cache, 'SITE_DIR', str(cache_dir.join('site')))
+    monkeypatch.setattr(os, 'environ', dict(os.environ))
+    for name in ('FACT_CACHE_TIMEOUT', 'ANSIBLE_GATHERING',
+                 'ANSIBLE_CACHE_PLUGIN', 'ANSIBLE_CACHE_PLUGIN_CONNECTION',
+                 'ANSIBLE_CACHE_PLUGIN_TIMEOUT', 'PYTHONPATH'):
+        os.environ.pop(name, None)
+    ctx = {'initfunc': lambda func: func, 'initdeps': init.initdeps}
+    plugin.load_plugins('init', ctx, pattern='fact_cache')
+    return ctx['init_fact_cache']
+
+
+class TestFactCache(object):
+    def test_scan(self, cache_dir):
+        assert fact_cache.scan(str(cache_dir), 3600) == (1, 1, 10)
+
+    def test_scan_no_timeout(self, cache_dir):
+        assert fact_cache.scan(str(cache_dir), 0) == (2, 0, 10)
+
+    def test_record_run(self, cache_dir):
+        fact_cache.record_run(str(cache_dir), 3600)
+        fact_cache.record_run(str(cache_dir), 3600)
+
+        assert fact_cache.load_stats(str(cache_dir)) == {
+            'runs': 2, 'timeout': 3600}
+
+    def test_record_lookup(self, cache_dir, lookups):
+        for key, hit in (('web1', True), ('db1', False), ('web1', True)):
+            fact_cache.record_lookup(str(cache_dir), key, hit)
+
+        assert fact_cache.count_lookups(str(cache_dir)) == (1, 1)
+
+    def test_record_lookup_forked(self, cache_dir, lookups):
+        fact_cache.record_lookup(str(cache_dir), 'web1', True)
+        lookups['pid'] -= 1  # as in a worker forked by the run
+
+        fact_cache.record_lookup(str(cache_dir), 'db1', False)
+
+        assert fact_cache.count_lookups(str(cache_dir)) == (1, 0)
+
+    def test_patch(self, cache_dir, lookups, monkeypatch):
+        monkeypatch.setattr(fact_cache, 'CACHE_DIR', str(cache_dir))
+        monkeypatch.setattr(FakeFileCache, 'contains',
+                            FakeFileCache.__dict__['contains'])
+        module = type(sys)('fake_cache')
+        module.BaseFileCacheModule = FakeFileCache
+
+        fact_cache.patch(module)
+        fact_cache.patch(module)
+        cache = FakeFileCache(str(cache_dir.join(fact_cache.FACTS_DIR)))
+        found = [cache.contains(key) for key in ('web1', 'app1', 'web1')]
+        FakeFileCache(str(cache_dir)).contains('app2')
+
+        assert found == [True, False, True]
+        assert fact_cache.count_lookups(str(cache_dir)) == (1, 1)
+
+    def test_stats(self, cache_dir, lookups, capsys):
+        fact_cache.record_run(str(cache_dir), 3600)
+        for key, hit in (('web1', True), ('db1', True), ('app1', False)):
+            fact_cache.record_lookup(str(cache_dir), key, hit)
+
+        assert fact_cache.main(['stats', '--dir', str(cache_dir)]) == 0
+        out = capsys.readouterr()[0]
+        assert 'hosts:    2 (1 valid, 1 expired)' in out
+        assert 'hit rate: 66.7% (2 hits, 1 misses)' in out
+
+    def test_stats_no_lookups(self, cache_dir, capsys):
+        assert fact_cache.main(['stats', '--dir', str(cache_dir)]) == 0
+        assert 'hit rate: - (0 hits, 0 misses)' in capsys.readouterr()[0]
+
+    def test_sitecustomize(self, tmpdir):
+        site = fact_cache.write_site(str(tmpdir.join('site')))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [site, os.path.dirname(os.path.dirname(fact_cache.__file__))]))
+
+        out = subprocess.check_output(
+            [sys.executable, '-c', 'import sys; print([hook.name for hook '
+             'in sys.meta_path if hasattr(hook, "callback")])'], env=env,
+            stderr=subprocess.STDOUT)
+
+        assert out.decode('utf-8').strip() == "['ansible.plugins.cache']"
+
+    def test_clear(self, cache_dir, lookups):
+        fact_cache.record_run(str(cache_dir), 3600)
+        fact_cache.record_lookup(str(cache_dir), 'web1', True)
+
+        assert fact_cache.main(['clear', '--dir', str(cache_dir)]) == 0
+        assert os.listdir(str(cache_dir)) == [fact_cache.FACTS_DIR]
+        assert fact_cache.scan(str(cache_dir), 3600) == (0, 0, 0)
+
+    def test_init(self, init_fact_cache, cache_dir):
+        os.environ['FACT_CACHE_TIMEOUT'] = '3600'
+
+        init_fact_cache('ansible-playbook', [])
+
+        assert os.environ['ANSIBLE_GATHERING'] == 'smart'
+        assert os.environ['ANSIBLE_CACHE_PLUGIN'] == 'jsonfile'
+        assert os.environ['ANSIBLE_CACHE_PLUGIN_CONNECTION'] == str(
+            cache_dir.join(fact_cache.FACTS_DIR))
+        assert os.environ['ANSIBLE_CACHE_PLUGIN_TIMEOUT'] == '3600'
+        assert fact_cache.load_stats(str(cache_dir))['runs'] == 1
+        assert os.environ['PYTHONPATH'] == str(cache_dir.join('site'))
+        assert cache_dir.join('site', 'sitecustomize.py').check()
+
+    def test_init_no_cache(self, init_fact_cache, monkeypatch, tmpdir):
+        monkeypatch.setattr(fact_cache, 'CACHE_DIR', str(tmpdir.join('no')))
+
+        init_fact_cache('ansible-playbook', [])
+
+        assert 'ANSIBLE_CACHE_PLUGIN' not in os.environ
+
+
+class TestFactCacheRunner(object):
+    def test_volume_per_project(self, runner):
+        assert (runner.fact_cache_volume('/src/a') !=
+                runner.fact_cache_volume('/src/b/a'))
+        assert runner.fact_cache_volume('/src/a').startswith(
+            'devops-utils-facts-a-')
+
+    def test_builder(self, runner, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_fact_cache')
+        args = runner.argparse.Namespace(
+            fact_cache=True, fact_cache_volume=None, fact_cache_timeout=60)
+        docker_run = runner.DockerRunCommand('ansible', [], [])
+
+        builder(args, docker_run)
+
+        assert docker_run.docker_args == [
+            '-v', '{}:/var/local/ansible_cache'.format(
+                runner.fact_cache_volume(str(tmpdir))),
+            '-e', 'FACT_CACHE_TIMEOUT=60']
+
+    def test_command(self, runner, fake_docker, capfd):
+        status = runner.runner_commands['cache'](
+            None, ['stats', '--volume', 'facts'])
+
+        assert status == 0
+        assert capfd.readouterr()[0].splitlines()[-1] == (
+            'run --rm -v facts:/var/local/ansible_cache {} '
+            'fact-cache stats'.format(runner.DOCKER_IMAGE))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for Ansible Galaxy cache (``galaxy_cache`` plugins and module)."""
+
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from devops_utils import galaxy_cache, init, plugin
+
+
+@pytest.fixture
+def galaxy(monkeypatch, tmpdir):
+    """Stub ``ansible-galaxy`` installing local tarballs.
+
+    It extracts tarballs given as ``src: file://PATH`` in requirements
+    file and logs its arguments in ``galaxy.log`` next to it.
+    """
+    log = tmpdir.join('galaxy.log')
+    stub = tmpdir.join('ansible-galaxy')
+    stub.write(
+        '#!/bin/sh\n'
+        '[ "$1" = collection ] && shift\n'
+        'echo "$@" >> {}\n'
+        'mkdir -p "$5"\n'
+        'grep "src: *file://" "$3" | sed "s|.*file://||" |\n'
+        '  while read tarball; do tar -xzf "$tarball" -C "$5" || exit 1; done'
+        '\n'.format(log))
+    stub.chmod(0o755)
+    stub.log = log
+    return stub
+
+
+def role_tarball(path, name):
+    src = path.dirpath().join('{}-src'.format(name))
+    src.join(name, 'tasks', 'main.yml').write('- ping:\n', ensure=True)
+    with tarfile.open(str(path), 'w:gz') as tar:
+        tar.add(str(src.join(name)), arcname=name)
+    return path
+
+
+@pytest.fixture
+def requirements(tmpdir):
+    tarball = role_tarball(tmpdir.join('myrole.tar.gz'), 'myrole')
+    reqs = tmpdir.join('requirements.yml')
+    reqs.write('- src: file://{}\n  name: myrole\n'.format(tarball))
+    return reqs
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    return tmpdir.mkdir('cache')
+
+
+def make_entry(cache_dir, name, size, mtime):
+    entry = cache_dir.mkdir(name)
+    entry.join('roles', 'r', 'file').write('x' * size, ensure=True)
+    os.utime(str(entry), (mtime, mtime))
+
+
+class TestGalaxyCache(object):
+    def test_miss(self, cache_dir, requirements, galaxy):
+        entry = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                     2 ** 20, galaxy=str(galaxy))
+
+        assert os.path.basename(entry) == galaxy_cache.requirements_hash(
+            str(requirements))
+        assert os.path.exists(
+            os.path.join(entry, 'roles', 'myrole', 'tasks', 'main.yml'))
+        assert not os.path.exists(os.path.join(entry, 'collections'))
+        assert sorted(os.listdir(str(cache_dir))) == [
+            os.path.basename(entry),
+            os.path.basename(entry) + galaxy_cache.LOCK_SUFFIX]
+
+    def test_hit(self, cache_dir, requirements, galaxy):
+        first = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                     2 ** 20, galaxy=str(galaxy))
+        os.utime(first, (0, 0))
+        second = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                      2 ** 20, galaxy=str(galaxy))
+
+        assert first == second
+        assert os.stat(second).st_mtime > 0
+        assert len(galaxy.log.readlines()) == 1
+
+    def test_changed_requirements(self, cache_dir, requirements, galaxy):
+        first = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                     2 ** 20, galaxy=str(galaxy))
+        requirements.write('# pinned\n', mode='a')
+        second = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                      2 ** 20, galaxy=str(galaxy))
+
+        assert first != second
+        assert len(galaxy.log.readlines()) == 2
+
+    def test_collections(self, cache_dir, requirements, galaxy, tmpdir):
+        tarball = role_tarball(tmpdir.join('coll.tar.gz'), 'ns')
+        requirements.write(
+            'roles: []\ncollections:\n- src: file://{}\n'.format(tarball))
+
+        entry = galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                     2 ** 20, galaxy=str(galaxy))
+
+        assert os.path.isdir(os.path.join(entry, 'collections', 'ns'))
+
+    def test_failed_install(self, cache_dir, requirements, galaxy, tmpdir):
+        requirements.write('- src: file://{}\n'.format(tmpdir.join('no')))
+
+        with pytest.raises(subprocess.CalledProcessError):
+            galaxy_cache.resolve(str(cache_dir), str(requirements),
+                                 2 ** 20, galaxy=str(galaxy))
+        assert [path.basename for path in cache_dir.listdir()] == [
+            galaxy_cache.requirements_hash(str(requirements)) +
+            galaxy_cache.LOCK_SUFFIX]
+
+    def test_evict_lru(self, cache_dir):
+        make_entry(cache_dir, 'old', 100, 1000)
+        make_entry(cache_dir, 'mid', 100, 2000)
+        make_entry(cache_dir, 'new', 100, 3000)
+
+        assert galaxy_cache.evict(str(cache_dir), 150) == ['old', 'mid']
+        assert os.listdir(str(cache_dir)) == ['new']
+
+    def test_evict_keep(self, cache_dir):
+        make_entry(cache_dir, 'old', 100, 1000)
+        make_entry(cache_dir, 'new', 100, 3000)
+
+        assert galaxy_cache.evict(str(cache_dir), 150, keep=['old']) == [
+            'new']
+
+    def test_evict_in_use(self, cache_dir):
+        make_entry(cache_dir, 'old', 100, 1000)
+        make_entry(cache_dir, 'new', 100, 3000)
+        fd = galaxy_cache.lock_entry(str(cache_dir), 'old')
+
+        try:
+            assert galaxy_cache.evict(str(cache_dir), 150) == ['new']
+        finally:
+            os.close(fd)
+        assert sorted(os.listdir(str(cache_dir))) == [
+            'old', 'old' + galaxy_cache.LOCK_SUFFIX]
+
+    def test_evict_stale_install(self, cache_dir):
+        cache_dir.mkdir('.stale.abc123').join('roles').write('x')
+        cache_dir.mkdir('.busy.def456')
+        fd = galaxy_cache.lock_entry(str(cache_dir), 'busy')
+
+        try:
+            assert galaxy_cache.evict(str(cache_dir), 150) == []
+        finally:
+            os.close(fd)
+        assert sorted(os.listdir(str(cache_dir))) == [
+            '.busy.def456', 'busy' + galaxy_cache.LOCK_SUFFIX]
+
+    def test_init(self, cache_dir, requirements, galaxy, monkeypatch):
+        monkeypatch.setattr(galaxy_cache, 'CACHE_DIR', str(cache_dir))
+        monkeypatch.setattr(os, 'environ', dict(os.environ))
+        monkeypatch.setenv('PATH', '{}{}{}'.format(
+            galaxy.dirname, os.pathsep, os.environ['PATH']))
+        monkeypatch.setenv('ANSIBLE_ROLES_PATH', '/etc/ansible/roles')
+        monkeypatch.delenv('GALAXY_REQUIREMENTS', raising=False)
+        ctx = {'initfunc': lambda func: func, 'initdeps': init.initdeps}
+        plugin.load_plugins('init', ctx, pattern='galaxy_cache')
+        monkeypatch.chdir(requirements.dirname)
+
+        ctx['init_galaxy_cache']('ansible-playbook', [])
+
+        entry = cache_dir.join(
+            galaxy_cache.requirements_hash(str(requirements)))
+        assert os.environ['ANSIBLE_ROLES_PATH'] == '{}:/etc/ansible/roles'.\
+            format(entry.join('roles'))
+
+
+class TestGalaxyCacheRunner(object):
+    def test_builder(self, runner):
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_galaxy_cache')
+        args = runner.argparse.Namespace(
+            galaxy_cache=True, galaxy_cache_volume='galaxy',
+            galaxy_cache_size=10, galaxy_requirements='reqs.yml')
+        docker_run = runner.DockerRunCommand('ansible-playbook', [], [])
+
+        builder(args, docker_run)
+
+        assert docker_run.docker_args == [
+            '-v', 'galaxy:/var/local/galaxy_cache',
+            '-e', 'GALAXY_CACHE_SIZE=10', '-e', 'GALAXY_REQUIREMENTS=reqs.yml']
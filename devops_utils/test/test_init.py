@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for `devops_utils.init` module."""
+
+import os
+import threading
+
+import pytest
+
+from devops_utils import init
+
+
+@pytest.fixture
+def environ(monkeypatch):
+    monkeypatch.setattr(os, 'environ', dict(os.environ, KEEP='1', GONE='1'))
+    return os.environ
+
+
+def names(levels):
+    return [[func.__name__ for func in level] for level in levels]
+
+
+def make_init(name, provides=None, requires=(), body=None):
+    def func(prog, args):
+        if body:
+            body(prog, args)
+    func.__name__ = name
+    if provides is not None:
+        func = init.initdeps(provides, requires)(func)
+    return func
+
+
+class TestInitializers(object):
+    def test_undeclared_serial(self):
+        calls = []
+        inits = init.Initializers([
+            make_init('a', body=lambda prog, args: calls.append('a')),
+            make_init('b', body=lambda prog, args: calls.append('b')),
+        ])
+
+        inits('prog', [])
+
+        assert calls == ['a', 'b']
+        assert [len(group) for group in inits.groups()] == [1, 1]
+
+    def test_groups(self):
+        inits = init.Initializers([
+            make_init('a', []), make_init('b', []), make_init('c'),
+            make_init('d', []),
+        ])
+
+        assert [[func.__name__ for func in group]
+                for group in inits.groups()] == [['a', 'b'], ['c'], ['d']]
+
+    def test_levels(self):
+        group = [
+            make_init('a', ['env:A'], ['env:B']),
+            make_init('b', ['env:B']),
+            make_init('c', ['file:/c']),
+            make_init('d', ['file:/c']),
+        ]
+
+        assert names(init.Initializers.levels(group)) == [
+            ['b', 'c'], ['a', 'd']]
+
+    def test_levels_cycle(self):
+        group = [
+            make_init('a', ['env:A'], ['env:B']),
+            make_init('b', ['env:B'], ['env:A']),
+        ]
+
+        assert names(init.Initializers.levels(group)) == [['a'], ['b']]
+
+    def test_concurrent(self):
+        events = [threading.Event(), threading.Event()]
+
+        def wait_other(i):
+            def body(prog, args):
+                events[i].set()
+                assert events[1 - i].wait(5)
+            return body
+
+        inits = init.Initializers([
+            make_init('a', [], body=wait_other(0)),
+            make_init('b', [], body=wait_other(1)),
+        ])
+
+        inits('prog', [])
+
+    def test_merge_environ(self, environ):
+        def set_a(prog, args):
+            os.environ['VAR'] = 'a'
+            os.environ['A'] = '1'
+            del os.environ['GONE']
+
+        def set_b(prog, args):
+            assert 'A' not in os.environ
+            assert 'GONE' in os.environ
+            os.environ['VAR'] = 'b'
+
+        inits = init.Initializers([
+            make_init('a', [], body=set_a), make_init('b', [], body=set_b)])
+
+        inits('prog', [])
+
+        assert os.environ is environ
+        assert environ['VAR'] == 'b'
+        assert environ['A'] == '1'
+        assert environ['KEEP'] == '1'
+        assert 'GONE' not in environ
+
+    def test_merge_args(self):
+        inits = init.Initializers([
+            make_init('a', ['args'], body=lambda p, a: a.append('-v')),
+            make_init('b', [], body=lambda p, a: None),
+        ])
+        args = ['site.yml']
+
+        inits('prog', args)
+
+        assert args == ['site.yml', '-v']
+
+    def test_error(self, environ):
+        def fail(prog, args):
+            raise ValueError('failed')
+
+        inits = init.Initializers([
+            make_init('a', [], body=fail), make_init('b', [])])
+
+        with pytest.raises(ValueError):
+            inits('prog', [])
+        assert os.environ is environ
@@ -20,6 +20,8 @@
 
 """Tests for `devops_utils.install` module."""
 
+import json
+import os
 import sys
 
 import pytest
@@ -97,3 +99,86 @@ class TestReplacer(object):
         expected = 'FOO = 2\nBAR = 1\n'
         output = ''.join(list(install.Replacer(input, {})))
         assert output == expected
+
+
+@pytest.fixture
+def target(monkeypatch, tmpdir):
+    """Target directory with the runner source in a separate directory."""
+    source = tmpdir.join('src', 'external_runner.py')
+    source.write("IMAGE = ''  ##INIT:VAR:DOCKER_IMAGE##\n", ensure=True)
+    target = tmpdir.mkdir('target')
+    monkeypatch.setattr(install, 'TARGET_DIR', str(target))
+    monkeypatch.setattr(install, 'RUNNER_SOURCE', str(source))
+    monkeypatch.setattr(install, 'PROGS', ('ansible', 'fab'))
+    monkeypatch.setattr(install, 'check_call', lambda cmd: None)
+    target.source = source
+    return target
+
+
+class TestInstall(object):
+    def test_install(self, target):
+        install.install([])
+
+        assert target.join('devops-utils').read() == (
+            "DOCKER_IMAGE = 'gimoh/devops-utils'\n")
+        assert target.join('ansible').readlink() == 'devops-utils'
+        assert target.join('fab').readlink() == 'devops-utils'
+        manifest = json.loads(target.join(install.MANIFEST_NAME).read())
+        assert manifest['links'] == ['ansible', 'fab']
+
+    def test_unchanged(self, target, monkeypatch, capsys):
+        install.install([])
+
+        def write_atomic(*args):
+            raise AssertionError('written despite no changes')
+        monkeypatch.setattr(install, 'write_atomic', write_atomic)
+        monkeypatch.setattr(install, 'install_links', write_atomic)
+        install.install([])
+
+        assert 'up to date' in capsys.readouterr().out
+
+    def test_changed_source(self, target):
+        install.install([])
+        install.install(['--image-name', 'test/image'])
+
+        assert target.join('devops-utils').read() == (
+            "DOCKER_IMAGE = 'test/image'\n")
+
+    def test_changed_runner(self, target):
+        install.install([])
+        target.join('devops-utils').write('garbage\n')
+        install.install([])
+
+        assert target.join('devops-utils').read() == (
+            "DOCKER_IMAGE = 'gimoh/devops-utils'\n")
+
+    def test_foreign_file_skipped(self, target):
+        target.join('fab').write('mine')
+
+        install.install([])
+
+        assert target.join('fab').read() == 'mine'
+        manifest = json.loads(target.join(install.MANIFEST_NAME).read())
+        assert manifest['links'] == ['ansible']
+
+    def test_stale_link(self, target, monkeypatch):
+        install.install([])
+        monkeypatch.setattr(install, 'PROGS', ('ansible',))
+
+        install.install([])
+
+        assert sorted(os.listdir(str(target))) == [
+            install.MANIFEST_NAME, 'ansible', 'devops-utils']
+
+    def test_rename_runner(self, target):
+        install.install([])
+        install.install(['--runner-name', 'du'])
+
+        assert target.join('ansible').readlink() == 'du'
+        assert target.join('fab').readlink() == 'du'
+
+    def test_no_links(self, target):
+        install.install(['--no-links'])
+
+        assert sorted(os.listdir(str(target))) == [
+            install.MANIFEST_NAME, 'devops-utils']
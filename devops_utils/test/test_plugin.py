@@ -59,3 +59,62 @@ class TestLoadPlugins(object):
 
         assert ctx['FOO'] == 2
         assert 'BAR' in ctx and ctx['BAR'] == 1
+
+
+class TestPluginCache(object):
+    def test_cache_written(self, plugin_dir):
+        create_plugin('init', 'test', 'FOO = 2\n')
+
+        plugin.load_plugins('init', {})
+
+        assert os.path.exists(plugin.cache_path('./init_plugins/test.py'))
+
+    def test_cache_hit(self, plugin_dir, monkeypatch):
+        create_plugin('init', 'test', 'FOO = 2\n')
+        plugin.load_plugins('init', {})
+
+        def compile(*args, **kwargs):
+            raise AssertionError('compiled despite cache')
+        monkeypatch.setattr(plugin, 'compile', compile, raising=False)
+        ctx = {}
+        plugin.load_plugins('init', ctx)
+
+        assert ctx['FOO'] == 2
+
+    def test_cache_invalidated(self, plugin_dir):
+        create_plugin('init', 'test', 'FOO = 2\n')
+        plugin.load_plugins('init', {})
+        create_plugin('init', 'test', 'FOO = 42\n')
+
+        ctx = {}
+        plugin.load_plugins('init', ctx)
+
+        assert ctx['FOO'] == 42
+
+    def test_cache_other_interpreter(self, plugin_dir, monkeypatch):
+        create_plugin('init', 'test', 'FOO = 2\n')
+        plugin.load_plugins('init', {})
+        monkeypatch.setattr(plugin, 'MAGIC_NUMBER', b'\0\0\0\0')
+
+        ctx = {}
+        plugin.load_plugins('init', ctx)
+
+        assert ctx['FOO'] == 2
+
+    def test_cache_unwritable(self, plugin_dir):
+        create_plugin('init', 'test', 'FOO = 2\n')
+        plugin_dir.join('init_plugins', '__pycache__').write('')
+
+        ctx = {}
+        plugin.load_plugins('init', ctx)
+
+        assert ctx['FOO'] == 2
+
+    def test_warm_plugins(self, plugin_dir):
+        create_plugin('init', 'test1', 'FOO = 1\n')
+        create_plugin('runner', 'test2', 'BAR = 2\n')
+
+        plugin.warm_plugins([])
+
+        assert os.path.exists(plugin.cache_path('./init_plugins/test1.py'))
+        assert os.path.exists(plugin.cache_path('./runner_plugins/test2.py'))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for container pool (``pool`` runner plugin and keeper)."""
+
+import os
+import time
+
+import pytest
+
+from devops_utils import pool
+
+
+@pytest.fixture
+def docker_run(runner, monkeypatch, tmpdir):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    return runner.DockerRunCommand(
+        'ansible', ['-m', 'ping', 'all'],
+        ['-i', '-t', '--rm', '-e', 'FOO=1', '-v', '/src:/opt/app'])
+
+
+class TestPoolRunner(object):
+    def test_pool_docker_args(self, runner, docker_run):
+        assert runner.pool_docker_args(docker_run) == [
+            '-e', 'FOO=1', '-v', '/src:/opt/app']
+
+    def test_fingerprint_ignores_interactive_opts(self, runner, docker_run):
+        other = runner.DockerRunCommand(
+            'fab', [], ['-e', 'FOO=1', '-v', '/src:/opt/app'])
+
+        assert (runner.pool_fingerprint(docker_run) ==
+                runner.pool_fingerprint(other))
+
+    def test_fingerprint_mounts(self, runner, docker_run):
+        other = runner.DockerRunCommand(
+            'ansible', [], ['-e', 'FOO=1', '-v', '/other:/opt/app'])
+
+        assert (runner.pool_fingerprint(docker_run) !=
+                runner.pool_fingerprint(other))
+
+    def test_exec_cmd(self, runner, docker_run):
+        assert runner.pool_exec_cmd('c0ffee', docker_run) == [
+            'docker', 'exec', '-i', '-t', 'c0ffee',
+            'docker-init', 'ansible', '-m', 'ping', 'all']
+
+    def test_exec_cmd_traced(self, runner, docker_run, monkeypatch):
+        fingerprint = runner.pool_fingerprint(docker_run)
+        monkeypatch.setattr(runner, 'trace', runner.Trace('abc', 'runner'))
+        runner.trace_docker_run(docker_run)
+
+        assert runner.pool_exec_cmd('c0ffee', docker_run)[2:6] == [
+            '-i', '-t', '-e', 'DEVOPS_UTILS_TRACE=abc']
+        assert runner.pool_fingerprint(docker_run) == fingerprint
+
+    def test_exec_starts_container(self, runner, docker_run, monkeypatch):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            return b'' if cmd[1] == 'ps' else b'c0ffee\n'
+
+        monkeypatch.setattr(runner.subprocess, 'check_output', check_output)
+        monkeypatch.setattr(runner, 'run_command',
+                            lambda cmd, docker_run: calls.append(cmd))
+
+        runner.pool_exec(docker_run, ttl=60)
+
+        assert calls[1][:4] == ['docker', 'run', '-d', '--rm']
+        assert calls[1][-4:] == [
+            runner.DOCKER_IMAGE, 'pool-keeper', '--ttl', '60']
+        assert '{}:{}'.format(runner.trace_dir(),
+                              runner.TRACE_CONTAINER_DIR) in calls[1]
+        assert calls[2][:5] == ['docker', 'exec', '-i', '-t', 'c0ffee']
+
+    def test_exec_reuses_container(self, runner, docker_run, monkeypatch):
+        calls = []
+        monkeypatch.setattr(runner.subprocess, 'check_output',
+                            lambda cmd: b'c0ffee\n')
+        monkeypatch.setattr(runner, 'run_command',
+                            lambda cmd, docker_run: calls.append(cmd))
+
+        runner.pool_exec(docker_run, ttl=60)
+
+        assert calls == [runner.pool_exec_cmd('c0ffee', docker_run)]
+
+    def test_exec_zygote(self, runner, docker_run, monkeypatch):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            return b'' if cmd[1] == 'ps' else b'c0ffee\n'
+
+        monkeypatch.setattr(runner.subprocess, 'check_output', check_output)
+        monkeypatch.setattr(runner, 'run_command',
+                            lambda cmd, docker_run: calls.append(cmd))
+
+        runner.pool_exec(docker_run, ttl=60, zygote=True)
+
+        assert calls[0][-2] == 'label={}={}'.format(
+            runner.POOL_LABEL, runner.pool_fingerprint(docker_run, True))
+        assert calls[1][-1] == '--zygote'
+
+
+def make_proc(root, pid, comm, state='S'):
+    os.mkdir(os.path.join(str(root), str(pid)))
+    with open(os.path.join(str(root), str(pid), 'comm'), 'w') as fobj:
+        fobj.write(comm + '\n')
+    with open(os.path.join(str(root), str(pid), 'stat'), 'w') as fobj:
+        fobj.write('{} ({}) {} 1 1 1\n'.format(pid, comm, state))
+
+
+class TestKeeper(object):
+    def test_busy_processes(self, tmpdir):
+        make_proc(tmpdir, os.getpid(), 'docker-init')
+        make_proc(tmpdir, 7, 'ssh-agent')
+        make_proc(tmpdir, 42, 'ansible')
+        tmpdir.mkdir('self')
+
+        assert pool.busy_processes(str(tmpdir)) == [42]
+
+    def test_busy_processes_skips_zombies(self, tmpdir):
+        make_proc(tmpdir, 42, 'ansible')
+        make_proc(tmpdir, 43, 'ssh (mux)', state='Z')
+
+        assert pool.busy_processes(str(tmpdir)) == [42]
+
+    def test_reap_children(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        time.sleep(0.1)  # let it become a zombie
+
+        pool.reap_children()
+
+        with pytest.raises(OSError):
+            os.waitpid(pid, os.WNOHANG)
+
+    def test_keeper_exits_when_idle(self, monkeypatch):
+        busy = [[42], [42], []]
+        clock = iter([0, 10, 20, 25, 30])
+        monkeypatch.setattr(pool, 'busy_processes',
+                            lambda: busy.pop(0) if busy else [])
+        monkeypatch.setattr(pool.time, 'time', lambda: next(clock))
+        monkeypatch.setattr(pool.time, 'sleep', lambda secs: None)
+        monkeypatch.setattr(pool.signal, 'signal', lambda *args: None)
+
+        assert pool.keeper(['--ttl', '10']) == 0
+        assert busy == []
+
+    def test_keeper_ignores_zygote(self, monkeypatch):
+        class Popen(object):
+            def __init__(self, cmd):
+                assert cmd == ['docker-init', 'zygote']
+                self.pid = 7
+        clock = iter([0, 10, 20])
+        monkeypatch.setattr(pool.subprocess, 'Popen', Popen)
+        monkeypatch.setattr(pool, 'busy_processes', lambda: [7])
+        monkeypatch.setattr(pool.time, 'time', lambda: next(clock))
+        monkeypatch.setattr(pool.time, 'sleep', lambda secs: None)
+        monkeypatch.setattr(pool.signal, 'signal', lambda *args: None)
+
+        assert pool.keeper(['--ttl', '10', '--zygote']) == 0
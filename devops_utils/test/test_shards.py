@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `shards` runner plugin."""
+
+import io
+import os
+import sys
+import textwrap
+
+import pytest
+
+
+INVENTORY = textwrap.dedent(u'''\
+    # local hosts, so the playbook can run anywhere
+    localhost ansible_connection=local
+
+    [web]
+    web[01:03] ansible_connection=local
+    bad ansible_connection=local
+
+    [db]
+    db-[a:b]:2222 ansible_connection=local
+    web01
+
+    [all:children]
+    web
+
+    [web:vars]
+    http_port=80
+    ''')
+
+RECAP = [
+    'PLAY [all] *****\n',
+    'ok: [web01]\n',
+    '\n',
+    'PLAY RECAP *****\n',
+    '\x1b[0;32mweb01\x1b[0m : ok=2 changed=1 unreachable=0 failed=0\n',
+    'bad                        : ok=0    changed=0    unreachable=0    '
+    'failed=1   \n',
+    '\n',
+    'Playbook run took 0 days, 0 hours, 0 minutes, 1 seconds\n',
+]
+
+
+@pytest.fixture
+def playbook(runner, monkeypatch, tmpdir):
+    """Inventory in tmpdir and stub ``docker`` acting as ansible-playbook.
+
+    The stub prints a recap for hosts given with ``--limit``, failing
+    (exit status 2) on host ``bad``.
+    """
+    bindir = tmpdir.mkdir('fake-bin')
+    docker = bindir.join('docker')
+    docker.write(textwrap.dedent('''\
+        #!{}
+        import sys
+        hosts = sys.argv[sys.argv.index('--limit') + 1].split(',')
+        print('PLAY [all] ***')
+        print('PLAY RECAP ***')
+        for host in hosts:
+            print('{{:26}} : ok=1 changed=0 unreachable=0 failed={{}}'.format(
+                host, int(host == 'bad')))
+        sys.exit(2 if 'bad' in hosts else 0)
+        ''').format(sys.executable))
+    docker.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        bindir, os.pathsep, os.environ['PATH']))
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('hosts').write(INVENTORY)
+    return tmpdir
+
+
+def docker_run_shards(runner):
+    return next(builder for builder in runner.docker_run_builders
+                if builder.__name__ == 'docker_run_shards')
+
+
+class TestShards(object):
+    def test_option(self, runner):
+        prog_args = ['-i', 'a', '--inventory=b', '-ic', '--inventory-file',
+                     'd', '-v', '--', '-i', 'e']
+
+        assert runner.shard_option(
+            prog_args, '-i', ('--inventory', '--inventory-file')) == [
+                'a', 'b', 'c', 'd']
+
+    def test_expand(self, runner):
+        assert runner.shard_expand('web[08:10:2].example.com') == [
+            'web08.example.com', 'web10.example.com']
+        assert runner.shard_expand('db-[a:b][1:2]') == [
+            'db-a1', 'db-a2', 'db-b1', 'db-b2']
+
+    def test_parse_ini(self, runner):
+        hosts = runner.shard_parse_ini(io.StringIO(INVENTORY))
+
+        assert hosts == ['localhost', 'web01', 'web02', 'web03', 'bad',
+                         'db-a', 'db-b']
+
+    def test_is_ini(self, runner, tmpdir):
+        tmpdir.join('hosts').write(INVENTORY)
+        tmpdir.join('hosts.yml').write(u'all: {}\n')
+        tmpdir.join('yaml').write(u'# comment\n---\nall: {}\n')
+
+        assert runner.shard_is_ini(str(tmpdir.join('hosts')))
+        assert not runner.shard_is_ini(str(tmpdir.join('hosts.yml')))
+        assert not runner.shard_is_ini(str(tmpdir.join('yaml')))
+        assert not runner.shard_is_ini(str(tmpdir))
+
+    def test_split(self, runner):
+        shards = runner.shard_split(list('abcdefg'), 3)
+
+        assert shards == [['a', 'd', 'g'], ['b', 'e'], ['c', 'f']]
+        assert runner.shard_split(['a', 'b'], 3) == [['a'], ['b']]
+
+    def test_recap(self, runner):
+        assert runner.shard_recap(RECAP) == {
+            'web01': [('ok', 2), ('changed', 1), ('unreachable', 0),
+                      ('failed', 0)],
+            'bad': [('ok', 0), ('changed', 0), ('unreachable', 0),
+                    ('failed', 1)],
+        }
+        assert runner.shard_recap(RECAP[:3]) == {}
+
+    def test_inventory_hosts(self, runner, playbook, monkeypatch):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            return (b'{"_meta": {"hostvars": {}}, "all": {"children": '
+                    b'["yml"]}, "yml": {"hosts": ["bad", "y1"]}}')
+        monkeypatch.setattr(runner.subprocess, 'check_output', check_output)
+        playbook.join('hosts.yml').write(u'yml: {hosts: {y1: {}}}\n')
+        docker_run = runner.DockerRunCommand(
+            'ansible-playbook', ['-i', 'hosts', '-i', 'x,localhost',
+                                 '-i', 'hosts.yml', 'site.yml'],
+            ['-i', '-t', '--rm', '-v', 'a:b'])
+
+        hosts = runner.shard_inventory_hosts(docker_run)
+
+        assert hosts == ['localhost', 'web01', 'web02', 'web03', 'bad',
+                         'db-a', 'db-b', 'x', 'y1']
+        assert calls == [['docker', 'run', '--rm', '-v', 'a:b',
+                          runner.DOCKER_IMAGE, 'ansible-inventory', '--list',
+                          '-i', 'hosts.yml']]
+
+    def test_inventory_missing(self, runner, playbook):
+        docker_run = runner.DockerRunCommand(
+            'ansible-playbook', ['-i', 'nosuch', 'site.yml'])
+
+        with pytest.raises(SystemExit) as exc:
+            runner.shard_inventory_hosts(docker_run)
+
+        assert exc.value.code == 'inventory nosuch not found'
+
+    def test_exec(self, runner, playbook, capfd):
+        docker_run = runner.DockerRunCommand(
+            'ansible-playbook', ['-i', 'hosts', 'site.yml'], ['-i', '-t'])
+
+        with pytest.raises(SystemExit) as exc:
+            runner.shard_exec(docker_run, shards=3)
+
+        assert exc.value.code == 2
+        out, err = capfd.readouterr()
+        recap = out[out.index('PLAY RECAP (3 shards)'):].splitlines()[1:]
+        assert [line.split()[0] for line in recap] == [
+            'bad', 'db-a', 'db-b', 'localhost', 'web01', 'web02', 'web03']
+        assert recap[0].split(' : ')[1] == (
+            'ok=1    changed=0    unreachable=0    failed=1')
+        assert 'shard2: PLAY RECAP ***' in out
+        rows = [line.split()[:3] for line in err.splitlines()[1:]]
+        assert rows == [['shard1', '3', '0'], ['shard2', '2', '2'],
+                        ['shard3', '2', '0']]
+
+    def test_exec_success(self, runner, playbook, capfd):
+        docker_run = runner.DockerRunCommand(
+            'ansible-playbook', ['-i', 'web01,web02', 'site.yml'])
+
+        assert runner.shard_exec(docker_run, shards=4) is None
+        assert len(capfd.readouterr().err.splitlines()) == 3
+
+    def test_builder(self, runner):
+        args = runner.argparse.Namespace(shards=2)
+        docker_run = runner.DockerRunCommand('ansible-playbook',
+                                             ['site.yml'])
+
+        docker_run_shards(runner)(args, docker_run)
+
+        assert docker_run.executor.func is runner.shard_exec
+        assert docker_run.executor.keywords == {'shards': 2}
+
+    @pytest.mark.parametrize('prog,prog_args,pool,message', [
+        ('ansible', ['all'], False, 'only works with ansible-playbook'),
+        ('ansible-playbook', ['-l', 'web', 'site.yml'], False,
+         'cannot be used with --limit'),
+        ('ansible-playbook', ['--limit=web', 'site.yml'], False,
+         'cannot be used with --limit'),
+        ('ansible-playbook', ['site.yml'], True, 'cannot be used with ++pool'),
+    ])
+    def test_builder_conflicts(self, runner, prog, prog_args, pool,
+                               message):
+        args = runner.argparse.Namespace(shards=2)
+        docker_run = runner.DockerRunCommand(prog, prog_args)
+        if pool:
+            docker_run.executor = runner.functools.partial(runner.pool_exec)
+
+        with pytest.raises(SystemExit) as exc:
+            docker_run_shards(runner)(args, docker_run)
+
+        assert message in exc.value.code
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for `devops_utils.ssh_mux` module and ``++ssh-mux`` option."""
+
+import os
+import socket
+import threading
+
+import pytest
+
+from devops_utils import ssh_mux
+
+
+def listening_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    sock.listen(1)
+    return sock
+
+
+def stale_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    sock.close()
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    """Running server, with masters "started" by creating sockets."""
+    masters = []
+
+    def start_master(user, host, port, persist, dir):
+        masters.append((user, host, port, persist))
+        return host != 'fail'
+    monkeypatch.setattr(ssh_mux, 'start_master', start_master)
+    monkeypatch.delenv('SSH_MUX_SERVER', raising=False)
+
+    mux = ssh_mux.MuxServer(str(tmpdir), 60)
+    thread = threading.Thread(target=mux.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    mux.masters = masters
+    yield mux
+    mux.shutdown()
+    mux.server_close()
+
+
+class TestSSHMux(object):
+    def test_control_path(self):
+        assert ssh_mux.control_path('root', 'web1', '22', '/mux') == (
+            '/mux/root@web1:22')
+
+    def test_cleanup(self, tmpdir):
+        stale_socket(tmpdir.join('root@old:22'))
+        live = listening_socket(tmpdir.join('root@web1:22'))
+        server = listening_socket(tmpdir.join(ssh_mux.SERVER_SOCKET))
+        tmpdir.join('other').write('')
+
+        try:
+            assert ssh_mux.cleanup(str(tmpdir)) == 1
+        finally:
+            live.close()
+            server.close()
+
+        assert sorted(os.listdir(str(tmpdir))) == [
+            ssh_mux.SERVER_SOCKET, 'other', 'root@web1:22']
+
+    def test_connect(self, server, tmpdir):
+        status = ssh_mux.connect(['root', 'web1', '22', '--dir', str(tmpdir)])
+
+        assert status == 0
+        assert server.masters == [('root', 'web1', '22', 60)]
+
+    def test_connect_failed(self, server, tmpdir):
+        status = ssh_mux.connect(['root', 'fail', '22', '--dir', str(tmpdir)])
+
+        assert status == 1
+
+    def test_connect_master_alive(self, server, tmpdir):
+        live = listening_socket(tmpdir.join('root@web1:22'))
+        try:
+            status = ssh_mux.connect(
+                ['root', 'web1', '22', '--dir', str(tmpdir)])
+        finally:
+            live.close()
+
+        assert status == 0
+        assert server.masters == []
+
+    def test_connect_no_server(self, tmpdir, monkeypatch):
+        monkeypatch.delenv('SSH_MUX_SERVER', raising=False)
+
+        assert ssh_mux.connect(
+            ['root', 'web1', '22', '--dir', str(tmpdir)]) == 1
+
+    def test_connect_from_server(self, server, tmpdir, monkeypatch):
+        monkeypatch.setenv('SSH_MUX_SERVER', '1')
+
+        assert ssh_mux.connect(
+            ['root', 'web1', '22', '--dir', str(tmpdir)]) == 1
+        assert server.masters == []
+
+
+class TestSSHMuxRunner(object):
+    def test_builder(self, runner, monkeypatch):
+        calls = []
+
+        def check_output(cmd):
+            calls.append(cmd)
+            return b''
+        monkeypatch.setattr(runner.subprocess, 'check_output', check_output)
+        monkeypatch.setenv('SSH_AUTH_SOCK', '/tmp/agent')
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_ssh_mux')
+        args = runner.argparse.Namespace(
+            ssh_mux=True, ssh_mux_volume='mux', ssh_mux_ttl=60, key=None)
+        docker_run = runner.DockerRunCommand('ansible', [], ['-i', '-t'])
+        scope = runner.ssh_mux_scope(None)
+
+        builder(args, docker_run)
+
+        assert docker_run.docker_args == [
+            '-i', '-t', '-v', 'mux:/var/local/ssh_mux',
+            '-e', 'DEVOPS_UTILS_SSH_MUX_DIR=/var/local/ssh_mux/' + scope]
+        assert calls[0][-1] == 'label=devops-utils.ssh-mux=mux/' + scope
+        assert calls[1] == [
+            'docker', 'run', '-d', '--rm', '--label',
+            'devops-utils.ssh-mux=mux/' + scope,
+            '-v', 'mux:/var/local/ssh_mux',
+            '-e', 'DEVOPS_UTILS_SSH_MUX_DIR=/var/local/ssh_mux/' + scope,
+            runner.DOCKER_IMAGE, 'devops-utils-ssh-mux', 'server',
+            '--dir', '/var/local/ssh_mux/' + scope, '--ttl', '60']
+
+    def test_default_volume(self, runner, monkeypatch):
+        monkeypatch.setattr(runner, 'ssh_mux_server', lambda *args: None)
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_ssh_mux')
+        args = runner.argparse.Namespace(
+            ssh_mux=True, ssh_mux_volume=None, ssh_mux_ttl=60, key=None)
+        docker_run = runner.DockerRunCommand('ansible', [])
+
+        builder(args, docker_run)
+
+        assert docker_run.docker_args[1] == (
+            'devops-utils-ssh-mux-{}:/var/local/ssh_mux'.format(os.getuid()))
+
+    def test_scope(self, runner, monkeypatch):
+        monkeypatch.setenv('SSH_AUTH_SOCK', '/tmp/agent1')
+        scopes = set([runner.ssh_mux_scope(None),
+                      runner.ssh_mux_scope('/home/u/.ssh/deploy')])
+        monkeypatch.setenv('SSH_AUTH_SOCK', '/tmp/agent2')
+        scopes.add(runner.ssh_mux_scope(None))
+
+        assert len(scopes) == 3
+        assert runner.ssh_mux_scope(None) in scopes
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for standby containers (``standby`` runner plugin and module)."""
+
+import functools
+import json
+import os
+import sys
+
+import pytest
+
+from devops_utils import standby
+
+
+FAKE_DOCKER = r'''#!{python}
+"""Stub docker keeping standby containers in a JSON file."""
+import json, os, re, sys
+
+path = {state!r}
+containers = json.load(open(path)) if os.path.exists(path) else {{}}
+cmd, args = sys.argv[1], sys.argv[2:]
+with open(path + '.log', 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\n')
+
+def fmt(template, name):
+    container = containers[name]
+    out = template.replace('{{{{.Names}}}}', name)
+    out = out.replace('{{{{.Image}}}}', container['image'])
+    out = out.replace('{{{{.CreatedAt}}}}', 'now')
+    return re.sub(r'{{{{\.Label "([^"]*)"}}}}',
+                  lambda m: container['labels'].get(m.group(1), ''), out)
+
+if cmd == 'ps':
+    filters = [args[i + 1] for i, arg in enumerate(args) if arg == '--filter']
+    template = args[args.index('--format') + 1]
+    for name in sorted(containers):
+        labels = containers[name]['labels']
+        for f in filters:
+            key, _, value = f.partition('=')
+            if key == 'label':
+                label, eq, label_value = value.partition('=')
+                if label not in labels or eq and labels[label] != label_value:
+                    break
+            elif key == 'name' and not re.match(value, '/' + name):
+                break
+        else:
+            print(fmt(template, name))
+elif cmd == 'rename':
+    if args[0] not in containers:
+        sys.exit(1)
+    containers[args[1]] = containers.pop(args[0])
+elif cmd == 'create':
+    name = args[args.index('--name') + 1]
+    labels = dict(args[i + 1].split('=', 1) for i, arg in enumerate(args)
+                  if arg == '--label')
+    containers[name] = {{'labels': labels, 'image': args[-2]}}
+elif cmd == 'cp':
+    name = args[1].split(':')[0]
+    containers[name]['request'] = json.load(open(args[0]))
+elif cmd == 'start':
+    request = containers.pop(args[-1])['request']
+    print('started ' + ' '.join(request['argv']) +
+          ' env=' + ','.join(sorted(request['env'])))
+elif cmd == 'inspect':
+    if args[-1] not in containers:
+        sys.exit(1)
+    print('created')
+elif cmd == 'rm':
+    for name in args:
+        containers.pop(name, None)
+elif cmd == 'run':
+    print('run ' + ' '.join(args))
+json.dump(containers, open(path, 'w'))
+'''
+
+
+@pytest.fixture
+def docker(runner, monkeypatch, tmpdir):
+    """Put a stub ``docker`` keeping containers in a JSON file on PATH.
+
+    Returns a function returning the containers, and makes standbys
+    fill in the foreground.
+    """
+    bindir = tmpdir.mkdir('docker-bin')
+    state = tmpdir.join('containers.json')
+    stub = bindir.join('docker')
+    stub.write(FAKE_DOCKER.format(python=sys.executable, state=str(state)))
+    stub.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        bindir, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    monkeypatch.setattr(runner, 'run_detached',
+                        lambda func, *args: func(*args))
+    monkeypatch.chdir(tmpdir)
+
+    def containers():
+        return json.loads(state.read()) if state.exists() else {}
+    containers.log = tmpdir.join('containers.json.log')
+    return containers
+
+
+class TestStandbyRunner(object):
+    def test_docker_args(self, runner, monkeypatch):
+        monkeypatch.setenv('FOO', 'foo')
+        docker_run = runner.DockerRunCommand(
+            'true', [], ['-i', '-e', 'FOO', '-e', 'BAR=1', '-v', 'x:/x'])
+
+        assert runner.standby_docker_args(docker_run) == [
+            '-i', '-e', 'FOO=foo', '-e', 'BAR=1', '-v', 'x:/x']
+
+    def test_fingerprint(self, runner):
+        assert runner.standby_fingerprint(['-i']) == \
+            runner.standby_fingerprint(['-i'])
+        assert runner.standby_fingerprint(['-i']) != \
+            runner.standby_fingerprint(['-i', '-v', 'x:/x'])
+
+    def test_exec_fills(self, runner, docker, capfd):
+        docker_run = runner.DockerRunCommand('true', ['-x'], ['-i', '--rm'])
+
+        assert runner.standby_exec(docker_run, 2) == 0
+
+        assert 'run -i --rm' in capfd.readouterr().out
+        standbys = docker()
+        assert len(standbys) == 2
+        assert all(name.startswith('devops-utils-standby-')
+                   for name in standbys)
+
+    def test_exec_starts_standby(self, runner, docker, capfd):
+        runner.standby_exec(runner.DockerRunCommand('true', [], ['-i']), 2)
+        capfd.readouterr()
+        docker_run = runner.DockerRunCommand('ansible', ['-m', 'ping'],
+                                             ['-i'])
+
+        assert runner.standby_exec(docker_run, 2) == 0
+
+        out = capfd.readouterr().out
+        assert 'started ansible -m ping env=\n' in out
+        assert 'start -a -i devops-utils-run-' in docker.log.read()
+        assert len(docker()) == 2
+
+    def test_traced_run_starts_standby(self, runner, docker, capfd,
+                                       monkeypatch):
+        runner.standby_exec(runner.DockerRunCommand('true', [], ['-i']), 2)
+        capfd.readouterr()
+        monkeypatch.setattr(runner, 'trace', runner.Trace('abc', 'runner'))
+
+        assert runner.standby_exec(
+            runner.DockerRunCommand('true', [], ['-i']), 2) == 0
+
+        assert 'started true env=DEVOPS_UTILS_TRACE\n' in \
+            capfd.readouterr().out
+        assert '{}:{}'.format(runner.trace_dir(), runner.TRACE_CONTAINER_DIR) \
+            in docker.log.read()
+
+    def test_exec_admission(self, runner, docker, monkeypatch, tmpdir):
+        runner.standby_exec(runner.DockerRunCommand('true', [], ['-i']), 2)
+        monkeypatch.setattr(runner, 'ADMISSION_DIR', str(tmpdir.join('st')))
+        docker_run = runner.DockerRunCommand('true', [], ['-i'])
+        docker_run.admission = {'host': 1, 'user': 0, 'wait': 5}
+        handed_over = []
+
+        def run_detached(func, *args):
+            if func is runner.standby_wait_started:
+                handed_over.append((args, len(docker_run.admission_fds)))
+            else:
+                func(*args)
+        monkeypatch.setattr(runner, 'run_detached', run_detached)
+
+        assert runner.standby_exec(docker_run, 2) == 0
+
+        (container, pid), held = handed_over[0]
+        assert container.startswith('devops-utils-run-')
+        assert pid == os.getpid() and held == 1
+        assert docker_run.admission_fds == []
+        assert 'start -a -i {}'.format(container) in docker.log.read()
+
+    def test_wait_started(self, runner, docker):
+        runner.standby_wait_started('devops-utils-run-gone', os.getpid())
+
+        assert 'inspect --format {{.State.Status}} devops-utils-run-gone' \
+            in docker.log.read()
+
+    def test_gc(self, runner, docker, monkeypatch, tmpdir):
+        runner.standby_create(['-i'], 'old')
+        runner.standby_create(['-i'], 'current')
+        monkeypatch.chdir(tmpdir.mkdir('other'))
+        runner.standby_create(['-i'], 'other-project')
+        monkeypatch.chdir(tmpdir)
+        with monkeypatch.context() as patch:
+            patch.setattr(runner, 'DOCKER_IMAGE', 'other/image')
+            runner.standby_create(['-i'], 'other-image')
+
+        runner.standby_gc('current')
+
+        assert sorted(container['labels']['devops-utils.standby']
+                      for container in docker().values()) == [
+            'current', 'other-project']
+
+    def test_builder_conflicts(self, runner):
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_standby')
+        docker_run = runner.DockerRunCommand('true', [])
+        docker_run.executor = functools.partial(runner.pool_exec, ttl=1)
+
+        with pytest.raises(SystemExit):
+            builder(runner.argparse.Namespace(standby=2), docker_run)
+
+
+class TestStandbyInit(object):
+    def test_load_request(self, tmpdir, monkeypatch):
+        monkeypatch.delenv('DEVOPS_UTILS_TRACE', raising=False)
+        request = tmpdir.join('request.json')
+        request.write('{"argv": ["ansible", "-m", "ping"], '
+                      '"env": {"DEVOPS_UTILS_TRACE": "abc"}}')
+
+        assert standby.load_request(str(request)) == ('ansible',
+                                                      ['-m', 'ping'])
+        assert not request.exists()
+        assert os.environ['DEVOPS_UTILS_TRACE'] == 'abc'
+
+    def test_no_request(self, tmpdir):
+        with pytest.raises(SystemExit):
+            standby.load_request(str(tmpdir.join('none.json')))
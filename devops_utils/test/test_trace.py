@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `devops_utils.trace` module and ``++trace``."""
+
+import json
+import os
+
+import pytest
+
+from devops_utils import init, trace
+from devops_utils.trace import Trace
+
+
+def record(id, side, time, exec_offset, *phases):
+    return {'trace': id, 'side': side, 'time': time,
+            'exec_offset': exec_offset,
+            'phases': [{'name': name, 'start': 0, 'duration': duration}
+                       for name, duration in phases]}
+
+
+@pytest.fixture
+def traced(runner, fake_docker, fake_exec, monkeypatch, tmpdir):
+    """Runner with traces under ``XDG_CACHE_HOME`` in tmpdir."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    monkeypatch.delenv('DEVOPS_UTILS_TRACE', raising=False)
+    monkeypatch.delenv('DEVOPS_UTILS_BACKEND', raising=False)
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(runner, 'trace', runner.trace)
+    return runner
+
+
+class TestTrace(object):
+    def test_write(self, tmpdir):
+        trace_ = Trace('abc', 'runner')
+        with trace_.phase('argparse'):
+            pass
+        trace_.add_timings('builder:', [{'name': 'base', 'start': 1.0,
+                                         'wall': 0.5}])
+
+        trace_.write(str(tmpdir.join('traces')))
+        trace_.write(str(tmpdir.join('traces')))
+        tmpdir.join('traces', trace.TRACE_FILE).write('{"cut', mode='a')
+
+        records = trace.load_traces(str(tmpdir.join('traces')))
+        assert len(records) == 1
+        assert (records[0]['trace'], records[0]['side']) == ('abc', 'runner')
+        assert [phase['name'] for phase in records[0]['phases']] == [
+            'argparse', 'builder:base']
+        assert records[0]['phases'][1]['duration'] == 0.5
+        assert records[0]['exec_offset'] >= records[0]['phases'][0]['start']
+
+    def test_write_error(self, tmpdir):
+        tmpdir.mkdir(trace.TRACE_FILE)  # can't be opened for writing
+        trace_ = Trace('abc', 'runner')
+
+        trace_.write(str(tmpdir))
+
+        assert trace_.written
+
+    def test_disabled(self, tmpdir):
+        trace_ = Trace(None, 'runner')
+        with trace_.phase('argparse'):
+            pass
+
+        trace_.write(str(tmpdir))
+
+        assert trace_.phases == []
+        assert trace.load_traces(str(tmpdir)) == []
+
+    def test_hand_over(self):
+        trace_ = Trace('abc', 'runner')
+        trace_.hand_over()
+        exec_offset = trace_.exec_offset
+        trace_.hand_over()
+
+        assert trace_.record()['exec_offset'] == exec_offset
+
+
+class TestReport(object):
+    def test_phases(self):
+        records = [
+            record('a', 'runner', 100.0, 0.1, ('argparse', 0.01)),
+            record('a', 'init', 100.5, 0.2, ('plugins', 0.05)),
+            record('b', 'runner', 200.0, 0.1, ('argparse', 0.03)),
+            record('c', 'init', 300.0, 0.2, ('plugins', 0.07)),
+        ]
+
+        phases = trace.trace_phases(records)
+
+        assert [name for name, _ in phases] == [
+            'argparse', 'docker', 'plugins', 'total']
+        assert dict(phases)['argparse'] == [0.01, 0.03]
+        assert dict(phases)['docker'] == [pytest.approx(0.4)]
+        assert dict(phases)['total'] == [pytest.approx(0.7)]
+        assert dict(trace.trace_phases(records, last=1)) == {
+            'plugins': [0.07]}
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+
+        assert trace.percentile(values, 50) == 50
+        assert trace.percentile(values, 95) == 95
+        assert trace.percentile([3.0], 95) == 3
+
+    def test_format(self):
+        phases = [('argparse', [0.001, 0.002, 0.010]), ('docker', [0.5])]
+
+        assert trace.format_trace_report(phases).splitlines() == [
+            'phase      runs      p50 ms      p95 ms',
+            'argparse      3       2.000      10.000',
+            'docker        1     500.000     500.000',
+        ]
+        assert json.loads(trace.format_trace_report(phases, 'json'))[1] == {
+            'phase': 'docker', 'runs': 1, 'p50': 0.5, 'p95': 0.5}
+
+
+class TestRunnerTrace(object):
+    def test_main(self, traced, capfd):
+        for _ in range(2):
+            with pytest.raises(SystemExit):
+                traced.main(['++trace', 'true'])
+            traced.trace = traced.Trace(None, 'runner')
+
+        records = trace.load_traces(traced.trace_dir())
+        out = capfd.readouterr().out.splitlines()
+        assert len(records) == 2 and records[0]['prog'] == 'true'
+        assert 'builders' in [phase['name'] for phase in records[0]['phases']]
+        assert 'builder:docker_run_base' in [
+            phase['name'] for phase in records[0]['phases']]
+        assert records[1]['cached']
+        for line, record_ in zip(out, records):
+            assert 'DEVOPS_UTILS_TRACE={}'.format(record_['trace']) in line
+            assert '{}:{}'.format(traced.trace_dir(),
+                                  trace.TRACE_CONTAINER_DIR) in line
+
+    def test_docker_run(self, traced, monkeypatch):
+        monkeypatch.setattr(traced, 'trace', traced.Trace('abc', 'runner'))
+        docker_run = traced.DockerRunCommand('true', [], ['-i'])
+
+        traced.trace_docker_run(docker_run)
+
+        assert docker_run.docker_args == ['-i']
+        assert 'DEVOPS_UTILS_TRACE=abc' in docker_run.cmd
+        # created by the runner, before root in the container can
+        assert os.path.exists(os.path.join(traced.trace_dir(),
+                                           trace.TRACE_FILE))
+
+    def test_untraced(self, traced, capfd):
+        with pytest.raises(SystemExit):
+            traced.main(['true'])
+
+        assert 'DEVOPS_UTILS_TRACE' not in capfd.readouterr().out
+        assert not os.path.exists(traced.trace_dir())
+
+    def test_command(self, traced, capfd):
+        assert traced.trace_command(None, ['report']) == 0
+        assert 'no traces' in capfd.readouterr().out
+        with pytest.raises(SystemExit):
+            traced.main(['++trace', 'true'])
+
+        capfd.readouterr()  # docker command
+        assert traced.trace_command(None, ['report', '--last', '1']) == 0
+        assert capfd.readouterr().out.splitlines()[1].split()[:2] == [
+            'invocation-cache', '1']
+        assert traced.trace_command(None, ['clear']) == 0
+        assert trace.load_traces(traced.trace_dir()) == []
+
+
+class TestInitTrace(object):
+    def test_run(self, monkeypatch, tmpdir):
+        calls = []
+        monkeypatch.setattr(init, 'TRACE_CONTAINER_DIR', str(tmpdir))
+        monkeypatch.setattr(init, 'trace', Trace('abc', 'init'))
+        monkeypatch.setattr(init, 'load_plugins', lambda *args: None)
+        monkeypatch.setattr(init, 'initializers', init.Initializers())
+        monkeypatch.setattr(init.zygote, 'request', lambda prog, args: None)
+        monkeypatch.setattr(os, 'execvp', lambda *args: calls.append(args))
+        init.initializers.append(lambda prog, args: args.append('-v'))
+
+        init.run('ansible', ['all'])
+
+        assert calls == [('ansible', ('ansible', 'all', '-v'))]
+        records = trace.load_traces(str(tmpdir))
+        assert (records[0]['trace'], records[0]['prog']) == ('abc', 'ansible')
+        assert [phase['name'] for phase in records[0]['phases']] == [
+            'plugins', 'initializers', 'init:<lambda>']
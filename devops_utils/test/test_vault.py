@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the vault key cache agent (``vault`` plugins and module)."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from devops_utils import init, plugin, vault
+
+
+@pytest.fixture
+def agent(runner, monkeypatch, tmpdir):
+    """Vault agent (with TTL of 60s) served by a thread.
+
+    The socket is in a directory under ``XDG_CACHE_HOME`` in tmpdir
+    (unix socket paths are short), the runner starts the agent in the
+    thread instead of a detached process (with a duplicate of the
+    socket, which the runner closes).
+    """
+    monkeypatch.setattr(runner, 'VAULT_POLL', 0.05)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('c')))
+    threads = []
+
+    def run_detached(func, listener, ttl):
+        thread = threading.Thread(target=func, args=(listener.dup(), ttl))
+        thread.start()
+        threads.append(thread)
+    monkeypatch.setattr(runner, 'run_detached', run_detached)
+
+    path = runner.vault_agent_start(runner.vault_dir(), 60)
+    monkeypatch.setenv('DEVOPS_UTILS_VAULT_SOCK', path)
+    yield path
+    runner.vault_request(path, 'stop')
+    for thread in threads:
+        thread.join()
+
+
+class FakeVaultAES256(object):
+    """Stands in for Ansible's ``VaultAES256``, counting derivations."""
+    derived = []
+
+    @classmethod
+    def _gen_key_initctr(cls, b_password, b_salt):
+        cls.derived.append(b_salt)
+        return b_password + b_salt, b'\x00\xff', b'iv'
+
+
+class TestVaultAgent(object):
+    def test_get_put(self, runner, agent):
+        assert runner.vault_request(agent, 'get', key='a') == {'value': None}
+
+        runner.vault_request(agent, 'put', key='a', value='1', cost=0.5)
+
+        assert runner.vault_request(agent, 'get', key='a') == {'value': '1'}
+        stats = runner.vault_request(agent, 'stats')
+        assert (stats['hits'], stats['misses'], stats['saved']) == (1, 1, 0.5)
+
+    def test_single_agent(self, runner, agent):
+        runner.vault_request(agent, 'put', key='a', value='1')
+
+        assert runner.vault_agent_start(runner.vault_dir(), 60) == agent
+        assert runner.vault_request(agent, 'get', key='a') == {'value': '1'}
+        assert oct(os.stat(agent).st_mode & 0o777) == oct(0o600)
+
+    def test_expiry(self, runner, monkeypatch, tmpdir):
+        monkeypatch.setattr(runner, 'VAULT_POLL', 0.05)
+        path = str(tmpdir.join('s'))
+        listener = runner.socket.socket(runner.socket.AF_UNIX,
+                                        runner.socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        thread = threading.Thread(target=runner.vault_agent,
+                                  args=(listener, 0.5))
+        thread.start()
+        runner.vault_request(path, 'put', key='a', value='1')
+        time.sleep(0.3)
+        runner.vault_request(path, 'ping')
+        time.sleep(0.3)
+
+        assert runner.vault_request(path, 'get', key='a') == {'value': None}
+        thread.join(5)
+        assert not thread.is_alive()
+        assert not os.path.exists(path)
+
+    def test_command(self, runner, agent, capfd):
+        runner.vault_request(agent, 'put', key='key:x', value='1', cost=2)
+        runner.vault_request(agent, 'put', key='password:p', value='1')
+        runner.vault_request(agent, 'get', key='key:x')
+
+        assert runner.vault_command(None, ['stats']) == 0
+        assert capfd.readouterr().out.splitlines() == [
+            'entries:  2 (1 passwords, 1 keys)',
+            'ttl:      60s',
+            'hit rate: 100.0% (1 hits, 0 misses)',
+            'saved:    2.00s of key derivation',
+        ]
+
+        assert runner.vault_command(None, ['clear']) == 0
+        assert runner.vault_request(agent, 'stats')['entries'] == 0
+
+    def test_builder(self, runner, agent, monkeypatch, tmpdir):
+        monkeypatch.delenv('DOCKER_HOST', raising=False)
+        monkeypatch.chdir(tmpdir)
+        builder = next(builder for builder in runner.docker_run_builders
+                       if builder.__name__ == 'docker_run_vault')
+        args = runner.argparse.Namespace(vault_cache=True,
+                                         vault_cache_ttl=60)
+        docker_run = runner.DockerRunCommand('ansible-playbook', [])
+
+        builder(args, docker_run)
+
+        assert not docker_run.cacheable
+        assert docker_run.docker_args[:3] == [
+            '-v', '{}:/tmp/vault_agent'.format(os.path.dirname(agent)), '-e']
+        assert docker_run.docker_args[3].startswith(
+            'DEVOPS_UTILS_VAULT_SCOPE=')
+
+        monkeypatch.setenv('DOCKER_HOST', 'tcp://10.0.0.1:2376')
+        with pytest.raises(SystemExit):
+            builder(args, runner.DockerRunCommand('ansible-playbook', []))
+
+
+class TestVaultClient(object):
+    def test_client_args(self):
+        args = ['--ask-vault-pass', '--vault-id', 'dev@prompt',
+                '--vault-id=prompt', '--vault-id', 'prod@secret.txt',
+                '-J', 'site.yml']
+
+        assert vault.client_args(args, '/bin/c') == [
+            '--vault-password-file', '/bin/c', '--vault-id', 'dev@/bin/c',
+            '--vault-id', '/bin/c', '--vault-id', 'prod@secret.txt',
+            '--vault-password-file', '/bin/c', 'site.yml']
+
+    def test_password(self, agent, monkeypatch, capsys):
+        prompts = []
+        monkeypatch.setattr(vault, 'prompt',
+                            lambda vault_id: prompts.append(vault_id) or 'pw')
+        monkeypatch.setenv('DEVOPS_UTILS_VAULT_SCOPE', 'project')
+
+        assert vault.client(['--vault-id', 'dev']) == 0
+        assert vault.client(['--vault-id', 'dev']) == 0
+
+        assert capsys.readouterr().out == 'pw\npw\n'
+        assert prompts == ['dev']
+
+    def test_no_agent(self, monkeypatch, tmpdir, capsys):
+        monkeypatch.setenv('DEVOPS_UTILS_VAULT_SOCK', str(tmpdir.join('s')))
+        monkeypatch.setattr(vault, 'prompt', lambda vault_id: None)
+
+        assert vault.client([]) == 1
+        assert 'no terminal' in capsys.readouterr().err
+
+    def test_cached_keys(self, agent, monkeypatch):
+        monkeypatch.setattr(FakeVaultAES256, 'derived', [])
+        module = type(sys)('fake_vault')
+        module.VaultAES256 = FakeVaultAES256
+        monkeypatch.setattr(FakeVaultAES256, '_gen_key_initctr',
+                            FakeVaultAES256.__dict__['_gen_key_initctr'])
+
+        vault.patch(module)
+        vault.patch(module)
+        keys = [FakeVaultAES256._gen_key_initctr(b'pw', salt)
+                for salt in (b'a', b'b', b'a')]
+
+        assert FakeVaultAES256.derived == [b'a', b'b']
+        assert keys == [(b'pwa', b'\x00\xff', b'iv'),
+                        (b'pwb', b'\x00\xff', b'iv'),
+                        (b'pwa', b'\x00\xff', b'iv')]
+        assert vault.request('stats')['keys'] == 2
+
+    def test_hook_on_import(self, monkeypatch, tmpdir):
+        tmpdir.join('fake_vault_mod.py').write(
+            'class VaultAES256(object):\n'
+            '    @staticmethod\n'
+            '    def _gen_key_initctr(b_password, b_salt):\n'
+            '        return b_password, b_salt\n')
+        monkeypatch.syspath_prepend(str(tmpdir))
+        monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+        monkeypatch.delitem(sys.modules, 'fake_vault_mod', raising=False)
+
+        vault.install_hook('fake_vault_mod')
+        import fake_vault_mod
+
+        assert fake_vault_mod.VaultAES256._gen_key_initctr.vault_cached
+        del sys.modules['fake_vault_mod']
+
+    def test_sitecustomize(self, tmpdir):
+        site = vault.write_site(str(tmpdir.join('site')))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [site, os.path.dirname(os.path.dirname(vault.__file__))]))
+
+        out = subprocess.check_output(
+            [sys.executable, '-c', 'import sys; print([hook.name for hook '
+             'in sys.meta_path if hasattr(hook, "callback")])'], env=env,
+            stderr=subprocess.STDOUT)
+
+        assert out.decode('utf-8').strip() == "['ansible.parsing.vault']"
+
+    def test_init_plugin(self, monkeypatch, tmpdir):
+        ctx = {'initfunc': lambda func: func, 'initdeps': init.initdeps}
+        plugin.load_plugins('init', ctx, pattern='vault')
+        monkeypatch.setattr(vault, 'AGENT_DIR', str(tmpdir))
+        monkeypatch.setattr(vault, 'SITE_DIR', str(tmpdir.join('site')))
+        monkeypatch.setitem(ctx, 'which', lambda name: '/bin/' + name)
+        monkeypatch.setenv('PYTHONPATH', '/opt/lib')
+        monkeypatch.delenv('DEVOPS_UTILS_VAULT_SOCK', raising=False)
+        args = ['--ask-vault-pass', 'site.yml']
+
+        ctx['init_vault']('ansible-playbook', args)
+
+        assert args == ['--vault-password-file',
+                        '/bin/devops-utils-vault-client', 'site.yml']
+        assert os.environ['PYTHONPATH'] == os.pathsep.join(
+            [str(tmpdir.join('site')), '/opt/lib'])
+        assert tmpdir.join('site', 'sitecustomize.py').check()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for `devops_utils.zygote` module."""
+
+import fcntl
+import os
+import pty
+import signal
+import subprocess
+import sys
+import termios
+import textwrap
+import time
+
+import pytest
+
+from devops_utils import zygote
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+CLIENT = textwrap.dedent('''
+    import sys
+    from devops_utils import zygote
+    sys.exit(zygote.request(sys.argv[2], sys.argv[3:], sys.argv[1]))
+    ''')
+
+
+@pytest.fixture
+def bindir(tmpdir, monkeypatch):
+    """Directory on PATH with test programs and a fake ``ansible``."""
+    bindir = tmpdir.mkdir('bin')
+    bindir.join('ansible', '__init__.py').write(
+        'import os\nPID = os.getpid()\n', ensure=True)
+    bindir.join('prog').write(textwrap.dedent('''\
+        #!/usr/bin/env python
+        from __future__ import print_function
+        import os, sys
+        import ansible
+        print(' '.join(sys.argv[1:]), os.environ.get('FOO'), os.getcwd(),
+              'preloaded' if ansible.PID != os.getpid() else 'imported')
+        if sys.argv[1:] == ['sleep']:
+            print('sleeping')
+            sys.stdout.flush()
+            import time
+            time.sleep(10)
+        sys.exit(int(os.environ.get('STATUS', 0)))
+        '''))
+    bindir.join('shprog').write('#!/bin/sh\necho "sh $1"\nexit 4\n')
+    for prog in ('prog', 'shprog'):
+        bindir.join(prog).chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        bindir, os.pathsep, os.environ['PATH']))
+    monkeypatch.setenv('PYTHONPATH', '{}{}{}'.format(
+        bindir, os.pathsep, PACKAGE_DIR))
+    monkeypatch.delenv('ANSIBLE_FOO', raising=False)
+    return bindir
+
+
+@pytest.fixture
+def server(bindir, tmpdir):
+    path = str(tmpdir.join('zygote.sock'))
+    proc = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys; from devops_utils import zygote; '
+         'sys.exit(zygote.server(sys.argv[1:]))',
+         '--socket', path, '--preload', 'ansible'], cwd=str(tmpdir))
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    proc.terminate()
+    proc.wait()
+
+
+def client(server, *args, **kwargs):
+    return subprocess.Popen(
+        [sys.executable, '-c', CLIENT, server] + list(args),
+        stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+
+
+class TestZygote(object):
+    def test_config_key(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(zygote.ansible_tuning, 'CONFIG',
+                            str(tmpdir.join('tuned.cfg')))
+        key = zygote.config_key({'ANSIBLE_X': '1', 'HOME': '/'}, str(tmpdir))
+
+        assert key == [str(tmpdir), [None, None], [('ANSIBLE_X', '1')]]
+        assert key != zygote.config_key({'ANSIBLE_X': '2'}, str(tmpdir))
+        tmpdir.join('ansible.cfg').write('')
+        key = zygote.config_key({'ANSIBLE_X': '1'}, str(tmpdir))
+        assert key[1][0] is not None
+        tmpdir.join('tuned.cfg').write('')
+        assert key != zygote.config_key({'ANSIBLE_X': '1'}, str(tmpdir))
+
+    def test_no_zygote(self, tmpdir):
+        assert zygote.request('true', [], str(tmpdir.join('none'))) is None
+
+    def test_run(self, server, tmpdir):
+        proc = client(server, 'prog', 'a', 'b', cwd=str(tmpdir),
+                      env=dict(os.environ, FOO='foo', STATUS='3'))
+
+        assert proc.communicate()[0] == 'a b foo {} preloaded\n'.format(
+            tmpdir)
+        assert proc.returncode == 3
+
+    def test_changed_config_reimports(self, server, tmpdir):
+        client(server, 'prog', cwd=str(tmpdir)).communicate()
+        proc = client(server, 'prog', cwd=str(tmpdir),
+                      env=dict(os.environ, ANSIBLE_FOO='1'))
+
+        assert proc.communicate()[0].endswith(' imported\n')
+
+    def test_project_config(self, server, tmpdir):
+        # initializers set ANSIBLE_* when there's a project ansible.cfg
+        project = tmpdir.mkdir('project')
+        project.join('ansible.cfg').write('[defaults]\n')
+        env = dict(os.environ, ANSIBLE_FORKS='8', ANSIBLE_PIPELINING='True')
+
+        for _ in range(2):
+            proc = client(server, 'prog', cwd=str(project), env=env)
+
+            assert proc.communicate()[0].endswith(' preloaded\n')
+
+    def test_run_non_python(self, server):
+        proc = client(server, 'shprog', 'x')
+
+        assert proc.communicate()[0] == 'sh x\n'
+        assert proc.returncode == 4
+
+    def test_controlling_tty(self, server, bindir):
+        bindir.join('ttyprog').write(
+            '#!/bin/sh\n(: </dev/tty) 2>/dev/null && echo tty || echo none\n')
+        bindir.join('ttyprog').chmod(0o755)
+        master, slave = pty.openpty()
+
+        def session():
+            os.setsid()
+            fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+        proc = client(server, 'ttyprog', stdin=slave, preexec_fn=session)
+        os.close(slave)
+
+        assert proc.communicate()[0] == 'tty\n'
+        os.close(master)
+
+    def test_forwards_signals(self, server):
+        proc = client(server, 'prog', 'sleep')
+        proc.stdout.readline()
+        assert proc.stdout.readline() == 'sleeping\n'
+
+        proc.send_signal(signal.SIGTERM)
+
+        assert proc.wait() == 128 + signal.SIGTERM
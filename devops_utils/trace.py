@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Implements tracing of the phases of a run, from runner to program.
+
+With ``++trace``, the external runner generates a trace ID and passes
+it into the container in ``DEVOPS_UTILS_TRACE`` environment variable,
+with the trace directory mounted as :py:data:`TRACE_CONTAINER_DIR`
+(pooled and standby containers always have it mounted and get the ID
+when a run is executed in them).
+The runner and :py:func:`devops_utils.init.run` each record the phases
+they go through in a :py:class:`Trace` and append it as a line of JSON
+to :py:data:`TRACE_FILE` in the directory right before handing over to
+docker and the program respectively.
+
+:py:func:`trace_phases` combines the records of both sides and
+:py:func:`format_trace_report` reports percentiles of phase durations
+across runs (as ``devops-utils trace report``).
+
+.. sidebar:: NOTE
+
+   like :py:mod:`devops_utils.builders`, this module is included in the
+   runner, so it should only use the standard library (and import
+   modules not needed by every run lazily).
+"""
+
+import os
+import time
+
+try:
+    from time import perf_counter as wall_clock
+except ImportError:  # PY2
+    from time import time as wall_clock
+
+
+__all__ = ('TRACE_CONTAINER_DIR', 'TRACE_FILE', 'Trace',
+           'format_trace_report', 'load_traces', 'trace_phases')
+
+TRACE_CONTAINER_DIR = '/var/local/devops-utils-trace'
+"Trace directory in the container."
+TRACE_FILE = 'traces.jsonl'
+"Name of the file in the trace directory the records are appended to."
+
+
+class TracePhase(object):
+    """Context manager recording a phase of :py:class:`Trace`."""
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = wall_clock()
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, self.start, wall_clock())
+
+
+class Trace(object):
+    """Phases of one side (runner or init) of a traced run.
+
+    Phases are recorded with a monotonic clock, as offsets from the
+    creation of the trace (whose wall clock time is recorded too, to
+    line up the records of both sides).  A trace without ID is
+    disabled: it records nothing and isn't written.
+
+    :param str id: trace ID shared by both sides, or ``None``
+    :param str side: ``runner`` or ``init``
+    """
+
+    def __init__(self, id, side):
+        self.id = id
+        self.side = side
+        self.origin = wall_clock()
+        self.time = time.time()
+        self.phases = []
+        self.info = {}
+        self.exec_offset = None
+        self.written = False
+
+    @staticmethod
+    def new_id():
+        """Return a new random trace ID."""
+        import binascii  # only needed when tracing
+        return binascii.hexlify(os.urandom(8)).decode('ascii')
+
+    def phase(self, name):
+        """Return context manager recording phase ``name``, e.g.::
+
+            with trace.phase('argparse'):
+                args = parse_args(argv)
+        """
+        return TracePhase(self, name)
+
+    def add(self, name, start, end):
+        """Record phase ``name`` from clock value ``start`` to ``end``."""
+        if self.id:
+            self.phases.append({'name': name, 'start': start - self.origin,
+                                'duration': end - start})
+
+    def add_timings(self, prefix, timings):
+        """Record builder ``timings`` as phases.
+
+        :param str prefix: prefixed to builder names to get phase names
+        :param list timings: as recorded in
+            :py:attr:`devops_utils.builders.Builders.timings`
+        """
+        for timing in timings or ():
+            self.add(prefix + timing['name'], timing['start'],
+                     timing['start'] + timing['wall'])
+
+    def hand_over(self):
+        """Mark handing over to docker or the program as happening now.
+
+        Only needed when phases are recorded after handing over (e.g.
+        creating and starting the container over the API), otherwise
+        :py:meth:`write` marks it.
+        """
+        if self.exec_offset is None:
+            self.exec_offset = wall_clock() - self.origin
+
+    def record(self):
+        """Return the trace as a dict.
+
+        ``exec_offset`` is the offset of handing over (see
+        :py:meth:`hand_over`).
+        """
+        self.hand_over()
+        return dict(self.info, trace=self.id, side=self.side,
+                    time=self.time, phases=self.phases,
+                    exec_offset=self.exec_offset)
+
+    def write(self, dir):
+        """Append the trace as a line of JSON to file in ``dir``.
+
+        Does nothing if the trace is disabled or already written.  Errors
+        writing it (e.g. the file isn't writable) are ignored, tracing
+        must not break the run.
+        """
+        if not self.id or self.written:
+            return
+        import json  # only needed when tracing
+        self.written = True
+        line = json.dumps(self.record(), sort_keys=True) + '\n'
+        try:
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            fd = os.open(os.path.join(dir, TRACE_FILE),
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))  # one write, one line
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
+def load_traces(dir):
+    """Return the trace records written to ``dir``, oldest first.
+
+    Lines which can't be parsed (e.g. cut short) are skipped.
+    """
+    import json
+    records = []
+    try:
+        fobj = open(os.path.join(dir, TRACE_FILE))
+    except IOError:
+        return records
+    with fobj:
+        for line in fobj:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def trace_phases(records, last=None):
+    """Return durations of each phase across traced runs.
+
+    Besides the recorded phases, ``docker`` is the time from the runner
+    handing over to docker to init starting in the container, and
+    ``total`` the time from the start of the runner to executing the
+    program.
+
+    :param list records: trace records as returned by
+                         :py:func:`load_traces`
+    :param int last: only use the last this many runs
+    :returns: list of (phase, list of durations in seconds) tuples, in
+              the order the phases run
+    """
+    runs = {}
+    order = []
+    for record in records:
+        if record.get('trace') not in runs:
+            order.append(record.get('trace'))
+        runs.setdefault(record.get('trace'), {})[record.get('side')] = record
+    if last:
+        order = order[-last:]
+
+    names, durations = [], {}
+
+    def add(name, duration):
+        if name not in durations:
+            names.append(name)
+            durations[name] = []
+        durations[name].append(duration)
+
+    for id in order:
+        runner, init = runs[id].get('runner'), runs[id].get('init')
+        for phase in (runner or {}).get('phases', ()):
+            add(phase['name'], phase['duration'])
+        if runner and init:
+            add('docker', init['time'] - runner['time'] -
+                runner['exec_offset'])
+        for phase in (init or {}).get('phases', ()):
+            add(phase['name'], phase['duration'])
+        if runner and init:
+            add('total', init['time'] + init['exec_offset'] -
+                runner['time'])
+    return [(name, durations[name]) for name in names]
+
+
+def percentile(values, percent):
+    """Return the ``percent`` percentile of ``values`` (nearest rank)."""
+    values = sorted(values)
+    rank = -(-len(values) * percent // 100)
+    return values[max(rank, 1) - 1]
+
+
+def format_trace_report(phases, fmt='table'):
+    """Return a report of p50 and p95 of phase durations.
+
+    :param list phases: as returned by :py:func:`trace_phases`
+    :param str fmt: report format, ``table`` or ``json``
+    """
+    rows = [{'phase': name, 'runs': len(values),
+             'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+            for name, values in phases]
+    if fmt == 'json':
+        import json
+        return json.dumps(rows, indent=2)
+    width = max([len(row['phase']) for row in rows] + [len('phase')])
+    lines = ['{:{}}  {:>5}  {:>10}  {:>10}'.format(
+        'phase', width, 'runs', 'p50 ms', 'p95 ms')]
+    for row in rows:
+        lines.append('{:{}}  {:5}  {:10.3f}  {:10.3f}'.format(
+            row['phase'], width, row['runs'], row['p50'] * 1000,
+            row['p95'] * 1000))
+    return '\n'.join(lines)
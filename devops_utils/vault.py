@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Container side of the vault key cache agent.
+
+With ``++vault-cache``, the external runner starts an agent on the host
+which keeps vault passwords and keys derived from them in memory, and
+mounts the directory of its socket into the container (like the SSH
+agent socket).  The requests are single lines of JSON, answered with a
+line of JSON, see :py:func:`request`.
+
+Two things use the agent:
+
+* :py:func:`client`, installed as ``devops-utils-vault-client``, is
+  passed to Ansible as vault password file instead of prompting; it
+  prompts only when the agent doesn't have the password yet,
+* :py:func:`install_hook` makes Ansible look up the keys it derives
+  from the password and salt of each vaulted file (with PBKDF2, which
+  is slow on purpose) in the agent first; it's installed in Ansible
+  programs with a ``sitecustomize`` module written by
+  :py:func:`write_site`.
+
+The vault init plugin sets this up when the agent directory is
+mounted.
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import getpass
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+from importlib import import_module
+
+try:
+    from importlib.util import find_spec
+except ImportError:  # python 2
+    find_spec = None
+
+
+__all__ = ('AGENT_DIR', 'CLIENT', 'ImportHook', 'client', 'client_args',
+           'install_hook', 'request', 'write_site')
+
+AGENT_DIR = '/tmp/vault_agent'
+"Directory with the agent socket, mounted by the runner."
+SOCKET = os.path.join(AGENT_DIR, 'agent.sock')
+"Default path of the agent socket."
+SITE_DIR = '/tmp/devops-utils-vault'
+"Directory of the ``sitecustomize`` module installing the hook."
+CLIENT = 'devops-utils-vault-client'
+"Name of the vault password client script."
+TIMEOUT = 5
+"Timeout (in seconds) of requests to the agent."
+TARGET = 'ansible.parsing.vault'
+"Module with the key derivation cached by :py:func:`install_hook`."
+
+SITECUSTOMIZE = '''\
+# written by devops-utils, caches vault keys in the agent
+import os
+import sys
+
+from devops_utils import vault
+
+vault.install_hook()
+
+# also run sitecustomize shadowed by this one, if any
+sys.path.remove(os.path.dirname(os.path.abspath(__file__)))
+_self = sys.modules.pop('sitecustomize')
+try:
+    import sitecustomize  # noqa: F401
+except ImportError:
+    pass
+finally:
+    sys.modules['sitecustomize'] = _self
+'''
+
+
+def request(op, path=None, **params):
+    """Send request ``op`` with ``params`` to the agent.
+
+    :param str path: agent socket (def: ``DEVOPS_UTILS_VAULT_SOCK``
+                     environment variable or :py:data:`SOCKET`)
+    :return: the response (dict) or ``None`` if the agent isn't
+             reachable
+    """
+    path = path or os.environ.get('DEVOPS_UTILS_VAULT_SOCK', SOCKET)
+    params['op'] = op
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(params).encode('utf-8') + b'\n')
+        fobj = sock.makefile('rb')
+        try:
+            return json.loads(fobj.readline().decode('utf-8'))
+        finally:
+            fobj.close()
+    except (socket.error, ValueError) as exc:
+        logging.debug('vault agent request failed: %s', exc)
+        return None
+    finally:
+        sock.close()
+
+
+def cached_keys(func):
+    """Wrap key derivation ``func`` to look up derived keys in the agent.
+
+    ``func`` is called with password and salt (bytes) as its last two
+    arguments and returns a tuple of bytes.  Keys are cached under a
+    hash of the salt and password, with the time deriving them took.
+    """
+    def wrapper(*args):
+        b_password, b_salt = args[-2:]
+        key = 'key:' + hashlib.sha256(
+            b_salt + b'\0' + b_password).hexdigest()
+        response = request('get', key=key)
+        if response and response.get('value'):
+            return tuple(binascii.unhexlify(part.encode('ascii'))
+                         for part in response['value'].split(':'))
+        start = time.time()
+        result = func(*args)
+        if response is not None:
+            request('put', key=key, cost=time.time() - start, value=':'.join(
+                binascii.hexlify(part).decode('ascii') for part in result))
+        return result
+    wrapper.vault_cached = True
+    return wrapper
+
+
+def patch(module):
+    """Cache keys derived by ``VaultAES256`` of vault ``module``."""
+    cls = getattr(module, 'VaultAES256', None)
+    attr = getattr(cls, '__dict__', {}).get('_gen_key_initctr')
+    if attr is None:
+        logging.debug('no key derivation to cache in %s', module.__name__)
+        return
+    if isinstance(attr, (classmethod, staticmethod)):
+        if not getattr(attr.__func__, 'vault_cached', False):
+            setattr(cls, '_gen_key_initctr',
+                    type(attr)(cached_keys(attr.__func__)))
+    elif not getattr(attr, 'vault_cached', False):
+        setattr(cls, '_gen_key_initctr', cached_keys(attr))
+
+
+class ImportHook(object):
+    """Meta path finder calling ``callback`` once module ``name`` loads.
+
+    It stays installed, so the callback is also called when the module
+    is imported again (e.g. in zygote children after the preloaded
+    Ansible modules were discarded).
+    """
+
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+        self.loading = False
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name or self.loading:
+            return None
+        self.loading = True
+        try:
+            spec = find_spec(fullname)
+        finally:
+            self.loading = False
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_call(module):
+            exec_module(module)
+            self.callback(module)
+        spec.loader.exec_module = exec_and_call
+        return spec
+
+    def find_module(self, fullname, path=None):  # python 2
+        if fullname == self.name and not self.loading:
+            return self
+
+    def load_module(self, fullname):  # python 2
+        self.loading = True
+        try:
+            module = import_module(fullname)
+        finally:
+            self.loading = False
+        self.callback(module)
+        return module
+
+
+def install_hook(name=TARGET):
+    """Cache vault keys derived by Ansible in the agent.
+
+    Patches the vault module ``name`` now if it's already imported,
+    otherwise when it gets imported.
+    """
+    if name in sys.modules:
+        patch(sys.modules[name])
+    if not any(isinstance(hook, ImportHook) and hook.name == name
+               for hook in sys.meta_path):
+        sys.meta_path.insert(0, ImportHook(name, patch))
+
+
+def write_site(dir=None):
+    """Write ``sitecustomize`` installing the hook into ``dir``.
+
+    :param str dir: directory (def: :py:data:`SITE_DIR`)
+    :return: ``dir``, to be prepended to ``PYTHONPATH``
+    """
+    dir = dir or SITE_DIR
+    path = os.path.join(dir, 'sitecustomize.py')
+    if not os.path.exists(path):
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        with open(path, 'w') as fobj:
+            fobj.write(SITECUSTOMIZE)
+    return dir
+
+
+def client_args(args, client):
+    """Return Ansible ``args`` with vault password prompts replaced.
+
+    ``--ask-vault-pass`` and ``--vault-id ID@prompt`` are replaced with
+    the password ``client`` script.
+    """
+    result = []
+    args = iter(args)
+    for arg in args:
+        if arg in ('-J', '--ask-vault-pass', '--ask-vault-password'):
+            result.extend(['--vault-password-file', client])
+            continue
+        if arg == '--vault-id':
+            result.append(arg)
+            arg = next(args, '')
+        elif arg.startswith('--vault-id='):
+            result.append('--vault-id')
+            arg = arg[len('--vault-id='):]
+        else:
+            result.append(arg)
+            continue
+        if arg == 'prompt':
+            arg = client
+        elif arg.endswith('@prompt'):
+            arg = '{}@{}'.format(arg[:-len('@prompt')], client)
+        result.append(arg)
+    return result
+
+
+def prompt(vault_id):
+    """Read vault password from the terminal, ``None`` if there is none."""
+    try:
+        with open('/dev/tty'):
+            pass
+    except (IOError, OSError):
+        return None
+    return getpass.getpass('Vault password ({}): '.format(vault_id))
+
+
+def client(args=None):
+    """Print vault password, asking the agent for it first.
+
+    Ansible runs this as vault password client script (passing
+    ``--vault-id``).  If the agent doesn't have the password, it's read
+    from the terminal and stored in the agent.
+
+    :param list args: command line arguments (def: ``sys.argv[1:]``,
+                      ``sys.argv`` doesn't exist yet when this module is
+                      imported by ``sitecustomize`` on python 2)
+    """
+    parser = argparse.ArgumentParser(prog=CLIENT, description=client.__doc__)
+    parser.add_argument('--vault-id', help='vault ID (def: %(default)s)')
+    parser.set_defaults(vault_id='default')
+    args = parser.parse_args(args)
+
+    key = 'password:{}:{}'.format(
+        os.environ.get('DEVOPS_UTILS_VAULT_SCOPE', ''), args.vault_id)
+    response = request('get', key=key)
+    if response and response.get('value'):
+        print(response['value'])
+        return 0
+    password = prompt(args.vault_id)
+    if password is None:
+        print('no terminal to ask for vault password', file=sys.stderr)
+        return 1
+    if not password:
+        return 1
+    if response is not None:
+        request('put', key=key, value=password, cost=0)
+    print(password)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(client())
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Implements the zygote, a server running programs in forked children.
+
+Importing Ansible or Fabric takes a significant part of their run time.
+The zygote (``docker-init zygote``) imports them once and then, for
+each request received on its unix socket, forks a child which runs the
+requested program with the modules already loaded.
+
+:py:func:`devops_utils.init.run` uses :py:func:`request` to hand the
+program over to the zygote if one is running, with the program's
+arguments, environment, working directory and standard input and output
+(the file descriptors are passed over the socket).  It then waits for
+the program to exit, forwarding signals to it.
+
+Ansible reads its configuration when imported, and the initializers
+run by :py:func:`devops_utils.init.run` before the request set some of
+it in the environment.  So the zygote only imports Ansible when it gets
+the first request, with the Ansible environment and working directory
+of that request, and a child discards the preloaded Ansible modules if
+the configuration could differ from that (see :py:func:`config_key`).
+
+When the program's standard input is a terminal, :py:func:`request`
+gives up its controlling terminal and the child takes it, so that the
+program can prompt on ``/dev/tty``.
+
+File descriptors are passed one per message, with
+``socket.sendmsg()`` or, on Python 2, ``_multiprocessing.sendfd()``,
+which use the same format.
+"""
+
+from __future__ import print_function
+
+import argparse
+import array
+import errno
+import fcntl
+import io
+import json
+import logging
+import os
+import runpy
+import select
+import signal
+import socket
+import sys
+import termios
+import traceback
+
+from importlib import import_module
+
+from devops_utils import ansible_tuning, fact_cache, vault
+
+try:
+    from _multiprocessing import recvfd, sendfd
+except ImportError:  # python 3
+    recvfd = sendfd = None
+
+try:
+    from shutil import which
+except ImportError:  # python 2
+    from distutils.spawn import find_executable as which
+
+
+__all__ = ('PRELOAD', 'SOCKET', 'config_key', 'request', 'server')
+
+SOCKET = os.environ.get('DEVOPS_UTILS_ZYGOTE',
+                        '/var/run/devops-utils-zygote.sock')
+"Path of the zygote socket."
+PRELOAD = ('ansible.cli', 'ansible.executor.playbook_executor',
+           'ansible.playbook', 'fabric.main', 'jinja2', 'paramiko', 'yaml')
+"Modules imported by the zygote (missing ones are skipped)."
+FORWARD_SIGNALS = ('SIGHUP', 'SIGINT', 'SIGQUIT', 'SIGTERM', 'SIGUSR1',
+                   'SIGUSR2')
+"Signals forwarded by :py:func:`request` to the program."
+
+
+def config_key(environ, cwd):
+    """Return what Ansible configuration read on import depends on."""
+    mtimes = []
+    for cfg in (os.path.join(cwd, 'ansible.cfg'), ansible_tuning.CONFIG):
+        try:
+            mtimes.append(os.stat(cfg).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return [cwd, mtimes, sorted(
+        (key, value) for key, value in environ.items()
+        if key.startswith('ANSIBLE_'))]
+
+
+def is_ansible(name):
+    return name == 'ansible' or name.startswith('ansible.')
+
+
+def preload(modules):
+    """Import ``modules``, skipping ones which fail to import."""
+    for name in modules:
+        try:
+            import_module(name)
+        except Exception as exc:
+            logging.debug('not preloading %s: %s', name, exc)
+
+
+def preload_ansible(modules, header):
+    """Import Ansible ``modules`` configured as for request ``header``.
+
+    :return: :py:func:`config_key` of the imported configuration
+    """
+    for key in list(os.environ):
+        if key.startswith('ANSIBLE_'):
+            del os.environ[key]
+    os.environ.update((key, value) for key, value in header['env'].items()
+                      if key.startswith('ANSIBLE_'))
+    os.chdir(header['cwd'])
+    preload(modules)
+    return config_key(os.environ, header['cwd'])
+
+
+def set_controlling_tty(fd, take):
+    """Take (or give up) terminal ``fd`` as the controlling terminal.
+
+    Does nothing if ``fd`` isn't a terminal, the terminal can't be
+    taken (it's still controlling another session) or, when giving it
+    up, the current process isn't the session leader.
+    """
+    if not os.isatty(fd) or not take and os.getsid(0) != os.getpid():
+        return
+    try:
+        if take:
+            fcntl.ioctl(fd, termios.TIOCSCTTY, 0)
+            return
+        # giving it up sends SIGHUP to the foreground process group,
+        # i.e. ourselves
+        handler = signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            fcntl.ioctl(fd, termios.TIOCNOTTY)
+        finally:
+            signal.signal(signal.SIGHUP, handler)
+    except (IOError, OSError) as exc:
+        logging.debug('controlling terminal not changed: %s', exc)
+
+
+def is_python_script(path):
+    with open(path, 'rb') as fobj:
+        first = fobj.readline(128)
+    return first.startswith(b'#!') and b'python' in first
+
+
+def native(data):
+    """Encode text in decoded JSON ``data`` to :py:class:`str` on python 2.
+    """
+    if sys.version_info[0] >= 3:
+        return data
+    if isinstance(data, dict):
+        return dict((native(key), native(value))
+                    for key, value in data.items())
+    if isinstance(data, list):
+        return [native(item) for item in data]
+    if isinstance(data, unicode):  # noqa: F821
+        return data.encode('utf-8')
+    return data
+
+
+def run_child(header, key):
+    """Run program described by ``header`` in current (child) process.
+
+    :param dict header: request with ``prog``, ``args``, ``env`` and
+                        ``cwd``
+    :param key: :py:func:`config_key` of the zygote
+    :return: exit status
+    """
+    header = native(header)
+    os.chdir(header['cwd'])
+    os.environ.clear()
+    os.environ.update(header['env'])
+    if sys.version_info[0] < 3:
+        sys.stdin = os.fdopen(0, 'r')
+        sys.stdout = os.fdopen(1, 'w', 1 if os.isatty(1) else -1)
+        sys.stderr = os.fdopen(2, 'w', 0)
+    else:
+        sys.stdin = io.open(0, 'r', closefd=False)
+        sys.stdout = io.open(1, 'w', buffering=1 if os.isatty(1) else -1,
+                             closefd=False)
+        sys.stderr = io.open(2, 'w', buffering=1, closefd=False)
+
+    prog, args = header['prog'], header['args']
+    path = which(prog)
+    if not path or not is_python_script(path):
+        os.execvp(prog, [prog] + args)
+
+    if config_key(os.environ, header['cwd']) != key:
+        for name in list(sys.modules):
+            if name == 'ansible' or name.startswith('ansible.'):
+                del sys.modules[name]
+    sys.argv = [path] + args
+    try:
+        runpy.run_path(path, run_name='__main__')
+        status = 0
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            status = exc.code or 0
+        else:
+            print(exc.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+
+def send_fds(conn, fds):
+    """Send file descriptors ``fds`` over ``conn``, one per message."""
+    for fd in fds:
+        if sendfd is not None:
+            sendfd(conn.fileno(), fd)
+        else:
+            conn.sendmsg([b'F'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                   array.array('i', [fd]))])
+
+
+def recv_fds(conn, count):
+    """Receive ``count`` file descriptors sent with :py:func:`send_fds`."""
+    if recvfd is not None:
+        return [recvfd(conn.fileno()) for _ in range(count)]
+    fds = array.array('i')
+    for _ in range(count):
+        msg, ancdata, flags, addr = conn.recvmsg(
+            1, socket.CMSG_LEN(fds.itemsize))
+        for level, type_, data in ancdata:
+            if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+    return list(fds)
+
+
+def set_nonblocking(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFL,
+                fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+def recv_request(conn):
+    """Receive request (header and standard fds) from ``conn``."""
+    fds = recv_fds(conn, 3)
+    if len(fds) != 3:
+        raise ValueError('expected 3 file descriptors, got {}'.format(
+            len(fds)))
+    line = conn.makefile('rb').readline()
+    return json.loads(line.decode('utf-8')), fds
+
+
+def send_json(conn, data):
+    conn.sendall(json.dumps(data).encode('utf-8') + b'\n')
+
+
+def spawn(conn, header, fds, closefds, key):
+    """Fork a child handling request received on ``conn``.
+
+    :param dict header: request (see :py:func:`run_child`)
+    :param list fds: standard fds of the program
+    :return: PID of the child
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            for fd in closefds:
+                os.close(fd)
+            conn.close()
+            for name in ('SIGCHLD', 'SIGTERM'):
+                signal.signal(getattr(signal, name), signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            os.setsid()
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+            for fd in set(fds) - set((0, 1, 2)):
+                os.close(fd)
+            set_controlling_tty(0, True)
+            status = run_child(header, key)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    for fd in fds:
+        os.close(fd)
+    send_json(conn, {'pid': pid})
+    return pid
+
+
+def exit_status(status):
+    """Convert ``os.waitpid`` status to shell-like exit status."""
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def server(args):
+    """Preload modules and run programs on request in forked children.
+
+    :param list args: command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='zygote',
+                                     description=server.__doc__)
+    parser.add_argument('--socket', help='socket path (def: %(default)s)')
+    parser.add_argument('--preload', action='append', metavar='MODULE',
+                        help=('module to import (may be repeated, def: '
+                              '{})'.format(', '.join(PRELOAD))))
+    parser.set_defaults(socket=SOCKET)
+    args = parser.parse_args(args)
+
+    # the vault and fact cache init plugins install their hooks with
+    # sitecustomize, which isn't run again in the children
+    if os.path.isdir(vault.AGENT_DIR):
+        vault.install_hook()
+    if os.path.isdir(fact_cache.CACHE_DIR):
+        fact_cache.install_hook()
+    modules = args.preload or PRELOAD
+    preload([name for name in modules if not is_ansible(name)])
+    # Ansible is imported once the first request brings its configuration
+    ansible_modules = [name for name in modules if is_ansible(name)]
+    key = None
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(args.socket)
+    os.chmod(args.socket, 0o600)
+    listener.listen(16)
+
+    # wake up select() when a child exits
+    wakeup_r, wakeup_w = os.pipe()
+    for fd in (wakeup_r, wakeup_w):
+        set_nonblocking(fd)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    children = {}
+    closefds = (listener.fileno(), wakeup_r, wakeup_w)
+    logging.debug('zygote listening on %s', args.socket)
+    try:
+        while True:
+            try:
+                ready = select.select([listener, wakeup_r], [], [])[0]
+            except (OSError, select.error) as exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+                continue
+            if wakeup_r in ready:
+                while True:
+                    try:
+                        os.read(wakeup_r, 512)
+                    except OSError:
+                        break
+            if listener in ready:
+                conn = listener.accept()[0]
+                try:
+                    header, fds = recv_request(conn)
+                    if key is None:
+                        key = preload_ansible(ansible_modules, header)
+                    pid = spawn(conn, header, fds, closefds + tuple(
+                        child.fileno() for child in children.values()), key)
+                    children[pid] = conn
+                except Exception:
+                    logging.exception('failed to handle request')
+                    conn.close()
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if not pid:
+                    break
+                conn = children.pop(pid, None)
+                if conn is None:
+                    continue
+                try:
+                    send_json(conn, {'status': exit_status(status)})
+                except socket.error:
+                    pass
+                conn.close()
+    finally:
+        listener.close()
+        os.unlink(args.socket)
+
+
+def request(prog, args, path=SOCKET):
+    """Run program in the zygote listening on ``path``.
+
+    :return: exit status of the program or ``None`` if there is no
+             zygote to run it
+    """
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        set_controlling_tty(0, False)
+        send_fds(sock, [0, 1, 2])
+        send_json(sock, {'prog': prog, 'args': list(args),
+                         'env': dict(os.environ), 'cwd': os.getcwd()})
+        reader = sock.makefile('rb')
+        line = reader.readline()
+    except (OSError, socket.error) as exc:
+        logging.debug('zygote unavailable: %s', exc)
+        sock.close()
+        set_controlling_tty(0, True)
+        return None
+    if not line:  # zygote failed before forking
+        set_controlling_tty(0, True)
+        return None
+
+    pid = json.loads(line.decode('utf-8'))['pid']
+    logging.debug('zygote started %s as %d', prog, pid)
+    for name in FORWARD_SIGNALS:
+        signal.signal(getattr(signal, name),
+                      lambda signum, frame: os.kill(pid, signum))
+    line = reader.readline()
+    sock.close()
+    if not line:
+        logging.error('zygote exited while running %s', prog)
+        return 1
+    return json.loads(line.decode('utf-8'))['status']
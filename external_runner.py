@@ -35,18 +35,78 @@ options, change default values, etc.
 to be executed after argument parsing to modify the final command that
 will be run.
 
+:py:func:`runner_command` is a decorator that registers a function to
+be executed on the host instead of running a program in a container
+(e.g. ``devops-utils pool ls``).
+
 :py:class:`DockerRunCommand` is a helper object encapsulating various
 arguments which can be modified by the functions decorated with
 :py:func:`docker_run_builder`.
+
+The resulting commands are cached (see :py:func:`invocation_cache_get`),
+so that repeated identical invocations skip argument parsing and the
+builders.  Invocations without runner options don't parse arguments
+either (see :py:func:`parse_args`) and modules not needed by every run
+are only imported when used (see :py:class:`LazyModule`).
 """
 
 from __future__ import print_function
 
-import argparse
-import logging
+import errno
+import marshal
 import os
+import signal
 import sys
-import subprocess
+import time
+
+
+class LazyModule(object):
+    """Stand-in for a module which imports it on first attribute access.
+
+    The runner and its plugins should use these for modules only needed
+    by some runs, to keep startup fast.  Once imported, the module
+    replaces this object in the runner's global namespace.
+
+    :param str name: module name
+    :param str alias: global name of the module (def: ``name``)
+    :param callable setup: called with the module once imported
+    """
+    def __init__(self, name, alias=None, setup=None):
+        self.__dict__.update(_name=name, _alias=alias or name, _setup=setup)
+
+    def _import(self):
+        __import__(self._name)
+        module = sys.modules[self._name]
+        if globals().get(self._alias) is self:
+            globals()[self._alias] = module
+            if self._setup:
+                self._setup(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._import(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._import(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._import(), attr)
+
+
+def setup_logging(logging):
+    logging.basicConfig(
+        format='(%(module)s:%(funcName)s:%(lineno)s) %(message)s',
+        level=logging.INFO)
+
+
+argparse = LazyModule('argparse')
+fcntl = LazyModule('fcntl')
+hashlib = LazyModule('hashlib')
+json = LazyModule('json')
+logging = LazyModule('logging', setup=setup_logging)
+subprocess = LazyModule('subprocess')
+tempfile = LazyModule('tempfile')
+threading = LazyModule('threading')
 
 
 DOCKER_IMAGE = 'gimoh/devops-utils'  ##INIT:VAR:DOCKER_IMAGE##
@@ -71,6 +131,40 @@ class DockerRunCommand(object):
     All of the above are also accepted as constructor parameters.  All
     of them can also be modified directly to affect the final command.
 
+    Additionally, the way the command is executed can be changed by
+    replacing the following attribute:
+
+    .. py:attribute:: executor
+       (callable) function executing the command, called with this
+       object as the only argument; defaults to :py:func:`docker_cli`;
+       it should either replace the runner process or return the exit
+       status (negative signal number if the command was killed)
+
+    .. py:attribute:: post_run_hooks
+       (list) functions called with this object and the exit status
+       after the command exits; if there are none, the runner process
+       is replaced with the command (see :py:func:`run_command`)
+
+    .. py:attribute:: admission
+       (dict) limits on containers starting at once, if any (see
+       :py:func:`admission_acquire`)
+
+    Builders whose result doesn't depend only on the runner arguments,
+    environment variables in :py:data:`INVOCATION_CACHE_ENV` and
+    current directory should tell the invocation cache using:
+
+    .. py:attribute:: cacheable
+       (bool) set to ``False`` to not cache the command, e.g. when a
+       builder has side effects or depends on volatile state
+
+    .. py:attribute:: cache_paths
+       (list) paths whose existence the command depends on; cached
+       command is only reused while they (don't) exist as before
+
+    Commands with executors or post-run hooks other than functions
+    defined in this module (e.g. :py:func:`functools.partial` objects)
+    are never cached.
+
     Exposes a property :py:meth:`cmd` which returns a fully assembled
     list of docker command and arguments.
     """
@@ -78,6 +172,12 @@ class DockerRunCommand(object):
         self.docker_args = docker_args if docker_args else []
         self.prog = prog
         self.prog_args = list(prog_args)
+        self.executor = docker_cli
+        self.post_run_hooks = []
+        self.admission = None
+        self.admission_fds = []
+        self.cacheable = True
+        self.cache_paths = []
 
     def __repr__(self):
         return '{}(docker_args={!r}, prog={!r}, prog_args={!r})'.format(
@@ -92,19 +192,525 @@ class DockerRunCommand(object):
     def cmd(self):
         """Return a fully assembled list of docker run command and arguments.
 
+        Includes arguments passing the trace of the current run (see
+        :py:func:`trace_docker_args`).
+
         :returns: docker run command and arguments; list suitable for
                   passing to :py:class:`subprocess.Popen`
         :rtype: list
         """
         cmd = ['docker', 'run']
         cmd.extend(self.docker_args)
+        cmd.extend(trace_docker_args())
         cmd.extend([DOCKER_IMAGE, self.prog])
         cmd.extend(self.prog_args)
         return cmd
 
+
+FORWARD_SIGNALS = ('SIGHUP', 'SIGTERM', 'SIGUSR1', 'SIGUSR2')
+"Signals the runner forwards to the command it waits for."
+
+
+def run_post_run_hooks(docker_run, status):
+    """Call post-run hooks of ``docker_run`` and return ``status``."""
+    for hook in docker_run.post_run_hooks:
+        hook(docker_run, status)
+    return status
+
+
+def run_command(cmd, docker_run):
+    """Run ``cmd``, a docker command executing ``docker_run``.
+
+    If ``docker_run`` has no post-run hooks, the runner process is
+    replaced with ``cmd``, so that no interpreter stays around while it
+    runs.  Otherwise ``cmd`` is run in a child process and the runner
+    waits for it, forwarding :py:data:`FORWARD_SIGNALS` to it.  Like
+    :manpage:`system(3)`, SIGINT and SIGQUIT are ignored meanwhile as
+    the child gets those from the terminal itself.
+
+    :return: exit status, or negative signal number if ``cmd`` was
+             killed by a signal
+    """
+    trace.write(trace_dir())
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if not docker_run.post_run_hooks:
+        os.execvp(cmd[0], cmd)
+
+    proc = subprocess.Popen(cmd)
+    handlers = {}
+    for name in FORWARD_SIGNALS:
+        signum = getattr(signal, name)
+        handlers[signum] = signal.signal(
+            signum, lambda signum, frame: proc.send_signal(signum))
+    for signum in (signal.SIGINT, signal.SIGQUIT):
+        handlers[signum] = signal.signal(signum, signal.SIG_IGN)
+    try:
+        status = proc.wait()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return run_post_run_hooks(docker_run, status)
+
+
+def exit_with(status):
+    """Exit the runner with ``status`` returned by an executor.
+
+    If the command was killed by a signal, the runner kills itself with
+    the same signal, so that its parent sees the same wait status.
+    """
+    if status is not None and status < 0:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            signal.signal(-status, signal.SIG_DFL)
+        except (OSError, RuntimeError, ValueError):  # e.g. SIGKILL
+            pass
+        os.kill(os.getpid(), -status)
+        status = 128 - status
+    sys.exit(status or 0)
+
+
+def run_detached(func, *args):
+    """Call ``func`` with ``args`` in a detached background process.
+
+    The process isn't a child of the runner (which would leave it a
+    zombie once the runner is replaced with docker), runs in its own
+    session and has standard streams redirected to :py:data:`os.devnull`
+    (so that it doesn't keep output pipes of the runner open).
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        if os.fork():
+            os._exit(0)
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        func(*args)
+    finally:
+        os._exit(0)
+
+
+ADMISSION_DIR = '/tmp/devops-utils-starts'
+"""Directory of the host-wide container start semaphore.
+
+Not in :py:func:`tempfile.gettempdir` as CI jobs may each have their own
+``TMPDIR``.
+"""
+ADMISSION_POLL = 0.05
+"Interval (in seconds) of checking for a free container start slot."
+ADMISSION_HOLD = 300
+"Release a container start slot after this long (in seconds) anyway."
+
+
+def admission_dirs(admission):
+    """Return (directory, limit) pairs of semaphores for ``admission``.
+
+    The per-user semaphore comes first, so that waiting for it doesn't
+    take a place in the host-wide queue.
+    """
+    dirs = []
+    if admission.get('user'):
+        dirs.append((os.path.join(os.path.dirname(invocation_cache_dir()),
+                                  'starts'), admission['user']))
+    if admission.get('host'):
+        dirs.append((ADMISSION_DIR, admission['host']))
+    return dirs
+
+
+def admission_open(path):
+    """Return a read-only file descriptor of ``path``, creating it if needed.
+
+    Doesn't open existing files with ``O_CREAT``, which isn't allowed
+    for other users' files in sticky directories on some systems.
+    """
+    while True:
+        try:
+            return os.open(path, os.O_RDONLY)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        try:
+            return os.open(path, os.O_RDONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+
+def admission_trylock(fd):
+    """Return whether an exclusive lock on ``fd`` was acquired."""
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as exc:
+        if exc.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+    return True
+
+
+def admission_queued(queue, ticket, limit):
+    """Return number (up to ``limit``) of live tickets before ``ticket``.
+
+    Tickets are locked by their waiting owners, unlocked ones were left
+    by killed runners and are removed (if they are the user's).
+    """
+    ahead = 0
+    for name in sorted(os.listdir(queue)):
+        if ahead >= limit or name >= ticket:
+            break
+        if name.startswith('.'):  # not queued yet
+            continue
+        try:
+            fd = os.open(os.path.join(queue, name), os.O_RDONLY)
+        except OSError:  # removed meanwhile
+            continue
+        try:
+            if not admission_trylock(fd):
+                ahead += 1
+                continue
+            try:
+                os.unlink(os.path.join(queue, name))
+            except OSError:  # removed meanwhile or someone else's
+                pass
+        finally:
+            os.close(fd)
+    return ahead
+
+
+def admission_wait(dir, limit, deadline):
+    """Wait in the queue of semaphore ``dir`` and take one of its slots.
+
+    Waiting runners are served in the order they came: each one puts a
+    ticket named after its arrival time in the ``queue`` subdirectory,
+    and only tries to lock one of ``limit`` slot files while there are
+    fewer than ``limit`` tickets before its own.
+
+    :returns: (fd, ahead) tuple, where fd is the locked slot file and
+              ahead is the number of runners waiting before this one
+              on arrival, or None if ``deadline`` passed
+    """
+    queue = os.path.join(dir, 'queue')
+    if not os.path.isdir(queue):
+        for path in (dir, queue):
+            try:
+                os.makedirs(path)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            else:
+                os.chmod(path, 0o1777 if dir == ADMISSION_DIR else 0o700)
+
+    fd, tmp = tempfile.mkstemp(dir=queue, prefix='.')
+    os.fchmod(fd, 0o644)  # others check whether it's locked
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    ticket = '{:.6f}.{}'.format(time.time(), os.getpid())
+    os.rename(tmp, os.path.join(queue, ticket))
+    try:
+        arrived = None
+        while True:
+            ahead = admission_queued(queue, ticket, limit)
+            if arrived is None:
+                arrived = ahead
+            if ahead < limit:
+                for slot in range(limit):
+                    slot_fd = admission_open(
+                        os.path.join(dir, 'slot.{}'.format(slot)))
+                    if admission_trylock(slot_fd):
+                        return slot_fd, arrived
+                    os.close(slot_fd)
+            if time.time() >= deadline:
+                return None
+            time.sleep(ADMISSION_POLL)
+    finally:
+        os.unlink(os.path.join(queue, ticket))
+        os.close(fd)
+
+
+def admission_acquire(docker_run):
+    """Wait until ``docker_run`` may start its container.
+
+    Limits the number of containers starting at once on the host (by
+    all users) and by the current user to ``host`` and ``user`` items
+    of :py:attr:`DockerRunCommand.admission`.  Runners wait for a free
+    start slot in arrival order, but no longer than its ``wait`` item
+    (in seconds).  Locked slot files are stored in
+    :py:attr:`DockerRunCommand.admission_fds` and should be closed
+    once the container starts (see :py:func:`admission_release`).
+    """
+    if not docker_run.admission:
+        return
+    deadline = time.time() + docker_run.admission['wait']
+    metrics = {}
+    for dir, limit in admission_dirs(docker_run.admission):
+        start = time.time()
+        slot = admission_wait(dir, limit, deadline)
+        if slot is None:
+            admission_release(docker_run)
+            sys.exit('timed out after {}s waiting to start a container '
+                     '({} started at once at most)'.format(
+                         docker_run.admission['wait'], limit))
+        docker_run.admission_fds.append(slot[0])
+        metrics[dir] = {'ahead': slot[1], 'wait': time.time() - start}
+    # logging is only imported by now if ++debug was given
+    if not isinstance(logging, LazyModule):
+        logging.debug('%r', {'admission': metrics})
+
+
+def admission_release(docker_run):
+    """Release container start slots held by ``docker_run``."""
+    while docker_run.admission_fds:
+        os.close(docker_run.admission_fds.pop())
+
+
+def admission_hand_over(docker_run):
+    """Release start slots of ``docker_run`` once docker CLI creates it.
+
+    The slots are handed over to a detached process, which waits until
+    docker writes the container ID to a ``--cidfile`` (i.e. it has
+    pulled the image and created the container), the runner (or docker
+    which replaced it) exits or :py:data:`ADMISSION_HOLD` passes.
+    """
+    if not docker_run.admission_fds:
+        return
+    tmpdir = tempfile.mkdtemp(prefix='devops-utils-')
+    cidfile = os.path.join(tmpdir, 'cid')
+    docker_run.docker_args.append('--cidfile={}'.format(cidfile))
+    run_detached(admission_wait_created, cidfile, os.getpid())
+    admission_release(docker_run)
+
+
+def admission_wait_created(cidfile, runner):
+    """Wait until docker writes ``cidfile`` or ``runner`` process exits."""
+    deadline = time.time() + ADMISSION_HOLD
+    while time.time() < deadline:
+        if os.path.exists(cidfile) and os.path.getsize(cidfile):
+            break
+        try:
+            os.kill(runner, 0)
+        except OSError:
+            break
+        time.sleep(ADMISSION_POLL)
+    if os.path.exists(cidfile):
+        os.unlink(cidfile)
+    os.rmdir(os.path.dirname(cidfile))
+
+
+def docker_cli(docker_run):
+    """Execute a :py:class:`DockerRunCommand` using the docker CLI."""
+    with trace.phase('admission'):
+        admission_acquire(docker_run)
+    admission_hand_over(docker_run)
+    return run_command(docker_run.cmd, docker_run)
+
+
+INVOCATION_CACHE_ENV = ['HOME', 'SSH_AUTH_SOCK', 'DEVOPS_UTILS_MAX_STARTS',
+                        'DEVOPS_UTILS_MAX_USER_STARTS',
+                        'DEVOPS_UTILS_START_WAIT']
+"""Environment variables the builders depend on.
+
+Plugins whose builders read other variables should append them.
+"""
+INVOCATION_CACHE_TTL = 7 * 24 * 3600
+"Remove cached commands unused for this long (in seconds)."
+RUNNER_SOURCES = [__file__]
+"Source files of the runner and its plugins."
+
+
+def invocation_cache_dir():
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'devops-utils', 'invocations')
+
+
+def trace_dir():
+    """Return the directory traces (see ``++trace``) are written to."""
+    return os.path.join(os.path.dirname(invocation_cache_dir()), 'traces')
+
+
+def trace_docker_run(docker_run):
+    """Prepare tracing ``docker_run`` in the current run.
+
+    Creates the trace file, so that it's owned by the user rather than
+    by root in the container, which may write to it first.
+    """
+    if not trace.id:
+        return
+    trace.info['prog'] = docker_run.prog
+    trace_volume()
+    try:
+        os.close(os.open(os.path.join(trace_dir(), TRACE_FILE),
+                         os.O_WRONLY | os.O_CREAT, 0o644))
+    except OSError:
+        pass
+
+
+def trace_volume():
+    """Return ``docker run`` arguments mounting the trace directory.
+
+    Pooled and standby containers always get it, as the runs they serve
+    may be traced or not.
+    """
+    dir = trace_dir()
+    if not os.path.isdir(dir):
+        os.makedirs(dir, 0o700)
+    return ['-v', '{}:{}'.format(dir, TRACE_CONTAINER_DIR)]
+
+
+def trace_docker_args():
+    """Return ``docker run`` arguments passing the trace ID to init.
+
+    These are added by the executors rather than to
+    :py:attr:`DockerRunCommand.docker_args`, which are cached and
+    identify pooled and standby containers.
+    """
+    if not trace.id:
+        return []
+    return ['-e', 'DEVOPS_UTILS_TRACE={}'.format(trace.id)] + trace_volume()
+
+
+def invocation_key(argv):
+    """Return invocation cache key for runner arguments ``argv``.
+
+    The key covers the runner and plugin sources, the Python version
+    (entries are :py:mod:`marshal` data), the name the runner was
+    invoked as, ``argv``, current directory and environment variables in
+    :py:data:`INVOCATION_CACHE_ENV`.
+    """
+    digest = hashlib.sha1()
+    for path in RUNNER_SOURCES:
+        with open(path, 'rb') as fobj:
+            digest.update(fobj.read())
+    digest.update(repr([
+        sys.version, DOCKER_IMAGE, os.path.basename(sys.argv[0]),
+        list(argv), os.getcwd(), [(name, os.environ.get(name))
+                                  for name in INVOCATION_CACHE_ENV],
+    ]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def invocation_cache_get(key):
+    """Return cached :py:class:`DockerRunCommand` for ``key`` or None."""
+    path = os.path.join(invocation_cache_dir(), key)
+    try:
+        with open(path, 'rb') as fobj:
+            entry = marshal.load(fobj)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    for cache_path, exists in entry['paths']:
+        if os.path.exists(cache_path) != exists:
+            return None
+    funcs = [globals().get(name)
+             for name in [entry['executor']] + entry['hooks']]
+    if not all(callable(func) for func in funcs):
+        return None
+    os.utime(path, None)
+    docker_run = DockerRunCommand(entry['prog'], entry['prog_args'],
+                                  entry['docker_args'])
+    docker_run.executor = funcs[0]
+    docker_run.post_run_hooks = funcs[1:]
+    docker_run.admission = entry['admission']
+    return docker_run
+
+
+def invocation_cache_put(key, docker_run):
+    """Cache ``docker_run`` under ``key`` if it is cacheable.
+
+    Also removes entries unused for :py:data:`INVOCATION_CACHE_TTL`.
+    The cache is only readable by the user, as program arguments may
+    contain secrets.
+    """
+    funcs = [docker_run.executor] + docker_run.post_run_hooks
+    names = [getattr(func, '__name__', None) for func in funcs]
+    if not docker_run.cacheable or [
+            name for name, func in zip(names, funcs)
+            if globals().get(name) is not func]:
+        return
+    dir = invocation_cache_dir()
+    if not os.path.isdir(dir):
+        os.makedirs(dir, 0o700)
+    now = time.time()
+    for name in os.listdir(dir):
+        try:
+            if now - os.stat(os.path.join(dir, name)).st_mtime > \
+                    INVOCATION_CACHE_TTL:
+                os.unlink(os.path.join(dir, name))
+        except OSError:  # removed meanwhile
+            pass
+
+    entry = {
+        'docker_args': docker_run.docker_args, 'prog': docker_run.prog,
+        'prog_args': docker_run.prog_args, 'executor': names[0],
+        'hooks': names[1:], 'admission': docker_run.admission,
+        'paths': [(path, os.path.exists(path))
+                  for path in docker_run.cache_paths],
+    }
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix='.')
+    with os.fdopen(fd, 'wb') as fobj:
+        marshal.dump(entry, fobj)
+    os.rename(tmp, os.path.join(dir, key))
+
+
+def run_parallel(docker_runs, parallel, output=None):
+    """Run several commands concurrently using the docker CLI.
+
+    The containers are run non-interactively, their output lines are
+    prefixed with their names and printed as they come.
+
+    :param list docker_runs: (name, :py:class:`DockerRunCommand`) pairs
+    :param int parallel: maximum number of containers run at once
+    :param dict output: if given, the output lines of each command are
+                        also collected in it in a list under its name
+    :returns: list of (name, exit status, duration in seconds) tuples,
+              in the same order as ``docker_runs``
+    """
+    results = [None] * len(docker_runs)
+    jobs = list(enumerate(docker_runs))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                i, (name, docker_run) = jobs.pop(0)
+            docker_run.docker_args = [arg for arg in docker_run.docker_args
+                                      if arg not in ('-i', '-t')]
+            start = time.time()
+            with open(os.devnull) as devnull:
+                proc = subprocess.Popen(
+                    docker_run.cmd, stdin=devnull, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, universal_newlines=True)
+                for line in iter(proc.stdout.readline, ''):
+                    if not line.endswith('\n'):
+                        line += '\n'
+                    with lock:
+                        sys.stdout.write('{}: {}'.format(name, line))
+                        sys.stdout.flush()
+                        if output is not None:
+                            output.setdefault(name, []).append(line)
+                status = proc.wait()
+            results[i] = (name, status, time.time() - start)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(parallel, len(docker_runs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
 from devops_utils.builders import *  ##INIT:MODULE:devops_utils.builders##
+from devops_utils.trace import *  ##INIT:MODULE:devops_utils.trace##
 argparse_builders = Builders()
 docker_run_builders = Builders()
+trace = Trace(None, 'runner')
+"Trace of the current run, disabled unless ``++trace`` is given."
 
 argparse_builder = argparse_builders.append
 """Register decorated function as :py:class:`ArgumentParser` instance builder.
@@ -140,6 +746,30 @@ The function signature should be:
        to run inside the container
 """
 
+runner_commands = {}
+
+
+def runner_command(name):
+    """Register decorated function as runner command ``name``.
+
+    Runner commands are executed on the host by the runner itself
+    instead of running a program in a container, e.g. ``devops-utils
+    pool ls`` executes the function registered as ``pool``.
+
+    The function signature should be:
+
+    .. py:function:: func(args : argparse.Namespace, cmd_args : list) -> int
+
+       :param argparse.Namespace args:
+           arguments and options passed to the runner itself
+       :param list cmd_args: arguments to the command
+       :returns: exit status
+    """
+    def decorator(func):
+        runner_commands[name] = func
+        return func
+    return decorator
+
 @argparse_builder
 def argparse_base(parser):
     self_name = os.path.basename(sys.argv[0])
@@ -151,6 +781,32 @@ def argparse_base(parser):
 
     parser.add_argument('++debug', action='store_true',
                         help='enable debugging output')
+    parser.add_argument('++profile', action='store_true',
+                        help=('report time spent in each builder of the '
+                              'runner and init'))
+    parser.add_argument('++profile-format', choices=('table', 'json'),
+                        help='format of the above report (def: %(default)s)')
+    parser.set_defaults(profile_format='table')
+    parser.add_argument('++trace', action='store_true',
+                        help=('record how long each phase of the run takes, '
+                              'from the runner to the program (see the '
+                              'trace command)'))
+    parser.add_argument('++no-invocation-cache', action='store_true',
+                        help=('don\'t reuse or cache the docker command '
+                              'resolved from the same arguments'))
+    parser.add_argument('++max-starts', type=int, metavar='N',
+                        help=('wait while N containers are starting on '
+                              'this host (def: no limit)'))
+    parser.add_argument('++max-user-starts', type=int, metavar='N',
+                        help=('wait while N containers of the current user '
+                              'are starting (def: no limit)'))
+    parser.add_argument('++start-wait', type=float, metavar='SECONDS',
+                        help=('give up if container can\'t start after '
+                              'waiting this long (def: %(default)s)'))
+    parser.set_defaults(
+        max_starts=int(os.environ.get('DEVOPS_UTILS_MAX_STARTS', 0)),
+        max_user_starts=int(os.environ.get('DEVOPS_UTILS_MAX_USER_STARTS', 0)),
+        start_wait=float(os.environ.get('DEVOPS_UTILS_START_WAIT', 600)))
     parser.add_argument('+O', '++docker-opt', action='append',
                         help='pass specified long-style option to docker run')
     parser.set_defaults(docker_opt=[])
@@ -160,39 +816,187 @@ def docker_run_base(args, docker_run):
     docker_run.docker_args.extend('-i -t --rm'.split())
     if args.debug:
         docker_run.docker_args.extend(('-e', 'DEVOPS_UTILS_DEBUG=true'))
+    if args.profile:
+        docker_run.docker_args.extend(
+            ('-e', 'DEVOPS_UTILS_PROFILE={}'.format(args.profile_format)))
+    if args.max_starts or args.max_user_starts:
+        docker_run.admission = {'host': args.max_starts,
+                                'user': args.max_user_starts,
+                                'wait': args.start_wait}
 
 @docker_run_builder
 def docker_run_opts(args, docker_run):
     docker_run.docker_args.extend(['--%s' % opt for opt in args.docker_opt])
 
+class Namespace(object):
+    """Runner options, like :py:class:`argparse.Namespace`."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return 'Namespace({})'.format(', '.join(
+            '{}={!r}'.format(key, value)
+            for key, value in sorted(self.__dict__.items())))
+
+
+class NeedsArgparse(Exception):
+    """Arguments can't be parsed without :py:mod:`argparse`."""
+
+
+class DefaultsParser(object):
+    """Stand-in for :py:class:`argparse.ArgumentParser` collecting defaults.
+
+    Used by :py:func:`parse_args` when no runner options are given, in
+    which case the options are just their defaults.  Supports only the
+    parser methods used to add options and set their defaults, raises
+    :py:exc:`NeedsArgparse` for other methods and arguments it can't
+    handle exactly as :py:mod:`argparse` would.
+    """
+    DEFAULTS = {'store_true': False, 'store_false': True}
+
+    def __init__(self, prefix_chars='+'):
+        self.prefix_chars = prefix_chars
+        self.actions = []
+        self.positionals = []
+        self.defaults = {}
+
+    def __getattr__(self, name):
+        raise NeedsArgparse('parser method {} not supported'.format(name))
+
+    def add_argument(self, *names, **kwargs):
+        if kwargs.get('required'):
+            raise NeedsArgparse('required option {}'.format(names[0]))
+        if kwargs.get('nargs') is not None:
+            raise NeedsArgparse('nargs of {} not supported'.format(names[0]))
+        if names[0][0] not in self.prefix_chars:
+            dest = kwargs.get('dest', names[0])
+            self.positionals.append(dest)
+        else:
+            longs = [name for name in names
+                     if name[1:2] and name[1] in self.prefix_chars]
+            dest = kwargs.get('dest') or (longs or names)[0].lstrip(
+                self.prefix_chars).replace('-', '_')
+        default = kwargs.get('default', self.defaults.get(
+            dest, self.DEFAULTS.get(kwargs.get('action'))))
+        self.actions.append([dest, default, kwargs.get('type')])
+
+    def set_defaults(self, **kwargs):
+        self.defaults.update(kwargs)
+        for action in self.actions:
+            if action[0] in kwargs:
+                action[1] = kwargs[action[0]]
+
+    def get_default(self, dest):
+        for action in self.actions:
+            if action[0] == dest:
+                return action[1]
+        return self.defaults.get(dest)
+
+    def parse_known_args(self, args):
+        """Return defaults and program arguments, like argparse would."""
+        if len(args) < len(self.positionals):
+            raise NeedsArgparse('missing positional argument {}'.format(
+                self.positionals[len(args)]))
+        namespace = Namespace()
+        for dest, default, type_ in self.actions:
+            if default == '==SUPPRESS==' or hasattr(namespace, dest):
+                continue
+            if isinstance(default, str) and type_ is not None:
+                default = type_(default)
+            setattr(namespace, dest, default)
+        for dest, value in self.defaults.items():
+            if not hasattr(namespace, dest):
+                setattr(namespace, dest, value)
+        for dest, value in zip(self.positionals, args):
+            setattr(namespace, dest, value)
+        return namespace, list(args[len(self.positionals):])
+
+
+def parse_args(args, fast=True):
+    """Return runner options and program arguments parsed from ``args``.
+
+    If there are no runner options in ``args`` (i.e. no arguments
+    starting with ``+``, nor ``--`` which argparse treats specially),
+    options are set to their defaults without building the argument
+    parser (unless disabled with ``fast``).
+
+    :rtype: tuple
+    """
+    if fast and not [arg for arg in args
+                     if arg.startswith('+') or arg == '--']:
+        parser = DefaultsParser()
+        try:
+            argparse_builders(parser)
+            return parser.parse_known_args(args)
+        except NeedsArgparse:
+            pass  # a builder needs the real parser
+    parser = argparse.ArgumentParser(description=main.__doc__,
+                                     prefix_chars='+')
+    argparse_builders(parser)
+    return parser.parse_known_args(args)
+
 from devops_utils.plugin import load_plugins  ##INIT:SUPPRESS##
 BASEDIR=os.path.dirname(__file__)  ##INIT:SUPPRESS##
 load_plugins('runner', globals(), basedir=BASEDIR)  ##INIT:PLUGINS:runner##
+from devops_utils.plugin import get_plugins  ##INIT:SUPPRESS##
+RUNNER_SOURCES.extend(get_plugins('runner', BASEDIR))  ##INIT:SUPPRESS##
 
 def main(args=sys.argv[1:]):
     """Run a program in a devops-utils container.
 
     To see install options run `%(prog)s install --help`.
     """
-    logging.basicConfig(
-        format='(%(module)s:%(funcName)s:%(lineno)s) %(message)s',
-        level=logging.INFO)
-
-    parser = argparse.ArgumentParser(description=main.__doc__,
-                                     prefix_chars='+')
-    argparse_builders(parser)
-    args, prog_args = parser.parse_known_args(args)
+    global trace
+    # decided before parsing so that argparse builders are timed too
+    if '++trace' in args or os.environ.get('DEVOPS_UTILS_TRACE'):
+        trace = Trace(Trace.new_id(), 'runner')
+    if '++profile' in args or trace.id:
+        argparse_builders.timings = []
+
+    # debugging and profiling is about the builders, so don't skip them
+    cache_key = None
+    if not set(args) & set(('++debug', '++profile', '++no-invocation-cache')):
+        with trace.phase('invocation-cache'):
+            cache_key = invocation_key(args)
+            docker_run = invocation_cache_get(cache_key)
+        if docker_run is not None:
+            trace.info['cached'] = True
+            trace_docker_run(docker_run)
+            exit_with(docker_run.executor(docker_run))
+
+    with trace.phase('argparse'):
+        args, prog_args = parse_args(args)
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
         logging.debug('%r', {'args': args, 'prog_args': prog_args})
 
-    docker_run = DockerRunCommand(args.prog, prog_args)
-    docker_run_builders(args, docker_run)
-    logging.debug('%r', {'docker_run': docker_run})
-    logging.debug('%s', docker_run)
+    if args.prog in runner_commands:
+        sys.exit(runner_commands[args.prog](args, prog_args))
 
-    subprocess.check_call(docker_run.cmd)
+    if args.profile or trace.id:
+        docker_run_builders.timings = []
+
+    docker_run = DockerRunCommand(args.prog, prog_args)
+    with trace.phase('builders'):
+        docker_run_builders(args, docker_run)
+    if args.debug:
+        logging.debug('%r', {'docker_run': docker_run})
+        logging.debug('%s', docker_run)
+
+    if args.profile:
+        print(format_timings((argparse_builders.timings or []) +
+                             docker_run_builders.timings,
+                             args.profile_format),
+              file=sys.stderr)
+
+    if cache_key:
+        invocation_cache_put(cache_key, docker_run)
+    if trace.id:
+        trace.add_timings('argparse:', argparse_builders.timings)
+        trace.add_timings('builder:', docker_run_builders.timings)
+        trace_docker_run(docker_run)
+    exit_with(docker_run.executor(docker_run))
 
 
 if __name__ == '__main__':
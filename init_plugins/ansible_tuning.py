@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from devops_utils import ansible_tuning
+
+
+@initfunc
+@initdeps(provides=['file:/etc/ansible/ansible.cfg', 'env:ANSIBLE_FORKS',
+                    'env:ANSIBLE_PIPELINING', 'env:ANSIBLE_SSH_ARGS'],
+          requires=['env:ANSIBLE_SSH_ARGS'])
+def init_ansible_tuning(prog, args):
+    if not os.path.basename(prog).startswith('ansible'):
+        return
+    profile = os.environ.get('DEVOPS_UTILS_ANSIBLE_PROFILE', 'default')
+    if profile == 'off' or not os.path.isdir(
+            os.path.dirname(ansible_tuning.CONFIG)):
+        return
+    ansible_tuning.apply(profile)
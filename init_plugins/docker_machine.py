@@ -18,11 +18,28 @@
 # along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
 import logging
 import shlex
+import tempfile
+import time
 
 from subprocess import check_output
 
+DM_ENV_CACHE_TTL = 3600
+"Default lifetime of cached ``docker-machine env`` output (in seconds)."
+DM_MACHINE_FILES = ('config.json', 'ca.pem', 'cert.pem', 'key.pem',
+                    'server.pem')
+"Files under machine directory that change when machine is re-provisioned."
+DM_NATIVE_DRIVERS = ('amazonec2', 'digitalocean', 'exoscale', 'generic',
+                     'google', 'none', 'openstack', 'rackspace', 'softlayer')
+"""Drivers whose machines' address is stored in config.json.
+
+Environment of machines using other drivers (e.g. virtualbox, which
+may get a different address on each start) is resolved by running
+``docker-machine env``.
+"""
+
 
 def dm_env(script):
     """Yield (var, value) pairs for environment variables for docker machine.
@@ -37,14 +54,136 @@ def dm_env(script):
         logging.debug('dm out line: %r, var: %s, value: %r', line, var, value)
         yield var, value
 
+
+def dm_storage_path():
+    return os.environ.get('MACHINE_STORAGE_PATH',
+                          os.path.expanduser('~/.docker/machine'))
+
+
+def dm_native_env(name):
+    """Return environment for machine ``name`` resolved from its config.
+
+    This is the equivalent of ``docker-machine env`` output, built from
+    ``$MACHINE_STORAGE_PATH/machines/NAME/config.json``.
+
+    :returns: list of (var, value) pairs like :py:func:`dm_env` yields,
+              or None if machine's driver is not in
+              :py:data:`DM_NATIVE_DRIVERS` or config is unusable
+    """
+    machine_dir = os.path.join(dm_storage_path(), 'machines', name)
+    try:
+        with open(os.path.join(machine_dir, 'config.json')) as fobj:
+            config = json.load(fobj)
+    except (IOError, OSError, ValueError) as exc:
+        logging.debug('cannot read config of %s: %s', name, exc)
+        return None
+    driver_name = config.get('DriverName')
+    driver = config.get('Driver') or {}
+    if driver_name not in DM_NATIVE_DRIVERS:
+        logging.debug('cannot resolve %s natively: %s driver', name,
+                      driver_name)
+        return None
+    if driver_name == 'none':
+        url = driver.get('URL')
+    elif driver.get('IPAddress'):
+        url = 'tcp://{}:{}'.format(driver['IPAddress'],
+                                   driver.get('EnginePort') or 2376)
+    else:
+        url = None
+    if not url:
+        return None
+    return [
+        ('DOCKER_TLS_VERIFY', '1'),
+        ('DOCKER_HOST', url),
+        ('DOCKER_CERT_PATH', machine_dir),
+        ('DOCKER_MACHINE_NAME', name),
+    ]
+
+
+def dm_cache_path():
+    """Return path to the ``docker-machine env`` cache file."""
+    return os.environ.get('DM_ENV_CACHE', os.path.join(
+        dm_storage_path(), '.devops-utils', 'env-cache.json'))
+
+
+def dm_cache_key(name):
+    """Return cache key of machine ``name``.
+
+    The key includes modification times of machine config and
+    certificates, so that the cached entry gets invalidated when the
+    machine is re-provisioned.
+    """
+    key = [name]
+    machine_dir = os.path.join(dm_storage_path(), 'machines', name)
+    for fn in DM_MACHINE_FILES:
+        try:
+            key.append(os.path.getmtime(os.path.join(machine_dir, fn)))
+        except OSError:
+            key.append(None)
+    return key
+
+
+def dm_cache_load():
+    try:
+        with open(dm_cache_path()) as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def dm_cache_get(name):
+    """Return cached environment of machine ``name`` or None.
+
+    :returns: list of (var, value) pairs like :py:func:`dm_env` yields
+    """
+    ttl = float(os.environ.get('DM_ENV_CACHE_TTL', DM_ENV_CACHE_TTL))
+    entry = dm_cache_load().get(name)
+    if (entry is None or entry['key'] != dm_cache_key(name) or
+            time.time() - entry['time'] > ttl):
+        return None
+    return [tuple(pair) for pair in entry['env']]
+
+
+def dm_cache_put(name, env):
+    """Store environment of machine ``name`` in cache.
+
+    Failure to write the cache (e.g. read-only storage path) is not an
+    error, the environment just won't be cached.
+
+    :param list env: list of (var, value) pairs
+    """
+    path = dm_cache_path()
+    cache = dm_cache_load()
+    cache[name] = {'key': dm_cache_key(name), 'time': time.time(),
+                   'env': env}
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as fobj:
+            json.dump(cache, fobj)
+        os.rename(tmp, path)
+    except (IOError, OSError) as exc:
+        logging.debug('cannot write %s: %s', path, exc)
+
+
 @initfunc
+@initdeps(provides=['env:DOCKER_HOST', 'env:DOCKER_CERT_PATH',
+                    'env:DOCKER_TLS_VERIFY', 'env:DOCKER_MACHINE_NAME'])
 def init_dm(prog, args):
     if not 'ACTIVE_DM' in os.environ:
         return
-    # parse ``docker-machine env`` output and inject variables into own
-    # environment; this avoids the need for wrapping prog+args in
-    # additional shell invocation
-    cmd = ['docker-machine', 'env', os.environ['ACTIVE_DM']]
-    logging.debug('run: %s', ' '.join(cmd))
-    for var, value in dm_env(check_output(cmd)):
+    name = os.environ['ACTIVE_DM']
+    env = dm_native_env(name)
+    if env is None and not os.environ.get('DM_ENV_REFRESH'):
+        env = dm_cache_get(name)
+    if env is None:
+        # parse ``docker-machine env`` output and inject variables into
+        # own environment; this avoids the need for wrapping prog+args
+        # in additional shell invocation
+        cmd = ['docker-machine', 'env', name]
+        logging.debug('run: %s', ' '.join(cmd))
+        env = list(dm_env(check_output(cmd).decode('utf-8')))
+        dm_cache_put(name, env)
+    for var, value in env:
         os.environ[var] = value
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from devops_utils import fact_cache
+
+
+@initfunc
+@initdeps(provides=['env:ANSIBLE_GATHERING', 'env:ANSIBLE_CACHE_PLUGIN',
+                    'env:ANSIBLE_CACHE_PLUGIN_CONNECTION',
+                    'env:ANSIBLE_CACHE_PLUGIN_TIMEOUT', 'env:PYTHONPATH'])
+def init_fact_cache(prog, args):
+    if not os.path.isdir(fact_cache.CACHE_DIR):
+        return
+    timeout = int(os.environ.get('FACT_CACHE_TIMEOUT', fact_cache.TIMEOUT))
+    facts_dir = os.path.join(fact_cache.CACHE_DIR, fact_cache.FACTS_DIR)
+    if not os.path.isdir(facts_dir):
+        os.mkdir(facts_dir)
+    # environment overrides ansible.cfg, so only set what isn't set
+    os.environ.setdefault('ANSIBLE_GATHERING', 'smart')
+    os.environ.setdefault('ANSIBLE_CACHE_PLUGIN', 'jsonfile')
+    os.environ.setdefault('ANSIBLE_CACHE_PLUGIN_CONNECTION', facts_dir)
+    os.environ.setdefault('ANSIBLE_CACHE_PLUGIN_TIMEOUT', str(timeout))
+    if prog in ('ansible', 'ansible-playbook'):
+        fact_cache.record_run(fact_cache.CACHE_DIR, timeout)
+        # count hits and misses of the run's lookups
+        path = [fact_cache.write_site()]
+        if os.environ.get('PYTHONPATH'):
+            path.append(os.environ['PYTHONPATH'])
+        os.environ['PYTHONPATH'] = os.pathsep.join(path)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from devops_utils import galaxy_cache
+
+
+def galaxy_requirements():
+    """Return path of the requirements file to install, if any."""
+    if 'GALAXY_REQUIREMENTS' in os.environ:
+        return os.environ['GALAXY_REQUIREMENTS']
+    for path in galaxy_cache.REQUIREMENTS:
+        if os.path.exists(path):
+            return path
+
+
+def prepend_path(name, path):
+    """Prepend ``path`` to colon-separated list in env variable ``name``."""
+    if os.environ.get(name):
+        path = '{}:{}'.format(path, os.environ[name])
+    os.environ[name] = path
+
+
+@initfunc
+@initdeps(provides=['env:ANSIBLE_ROLES_PATH', 'env:ANSIBLE_COLLECTIONS_PATHS'],
+          requires=['env:SSH_AUTH_SOCK', 'file:/root/.ssh/id_rsa',
+                    'file:/root/.ssh/config'])
+def init_galaxy_cache(prog, args):
+    if prog not in ('ansible', 'ansible-playbook'):
+        return
+    if not os.path.isdir(galaxy_cache.CACHE_DIR):
+        return
+    requirements = galaxy_requirements()
+    if not requirements:
+        return
+    max_size = int(os.environ.get('GALAXY_CACHE_SIZE', galaxy_cache.MAX_SIZE))
+    entry = galaxy_cache.resolve(galaxy_cache.CACHE_DIR, requirements,
+                                 max_size * 1024 * 1024)
+    prepend_path('ANSIBLE_ROLES_PATH', os.path.join(entry, 'roles'))
+    if os.path.isdir(os.path.join(entry, 'collections')):
+        prepend_path('ANSIBLE_COLLECTIONS_PATHS',
+                     os.path.join(entry, 'collections'))
@@ -19,6 +19,7 @@
 
 
 @initfunc
+@initdeps(provides=['env:SSH_AUTH_SOCK'])
 def init_ssh_agent(prog, args):
     if not os.path.exists('/tmp/ssh_agent'):
         return
@@ -26,12 +27,49 @@ def init_ssh_agent(prog, args):
 
 
 @initfunc
+@initdeps(provides=['file:/root/.ssh/id_rsa'])
 def init_ssh_key(prog, args):
     install_file_if_exists('/var/local/ssh.key', '/root/.ssh/id_rsa',
                            'root', 'root', 0o600)
 
 
 @initfunc
+@initdeps(provides=['file:/root/.ssh/config'])
 def init_ssh_config(prog, args):
     install_file_if_exists('/var/local/ssh_config', '/root/.ssh/config',
                            'root', 'root', 0o600)
+
+
+SSH_MUX_CONFIG = '''
+# shared master connections (devops-utils ++ssh-mux)
+Match exec "test -S {path} || {connect} %r %h %p"
+    ControlMaster no
+    ControlPath {path}
+
+Host *
+    ControlMaster auto
+    ControlPath /root/.ssh/cm-%r@%h:%p
+    ControlPersist 60s
+'''
+
+
+@initfunc
+@initdeps(provides=['file:/root/.ssh/config', 'env:ANSIBLE_SSH_ARGS'],
+          requires=['file:/root/.ssh/config'])
+def init_ssh_mux(prog, args):
+    dir = os.environ.get('DEVOPS_UTILS_SSH_MUX_DIR')
+    if not dir:
+        return
+    # unless the master connection is there already, ssh asks the
+    # ssh-mux server (started by the runner) to start it, so that it
+    # outlives this container; the cheap test spares starting Python
+    # for every ssh run
+    config = '/root/.ssh/config'
+    with open(config, 'a') as fobj:
+        fobj.write(SSH_MUX_CONFIG.format(
+            path=os.path.join(dir, '%r@%h:%p'),
+            connect='devops-utils-ssh-mux connect --dir {}'.format(dir)))
+    os.chmod(config, 0o600)
+    # ansible passes ControlMaster/ControlPersist/ControlPath on command
+    # line by default, which would override the above
+    os.environ.setdefault('ANSIBLE_SSH_ARGS', '-C')
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from devops_utils import vault
+
+try:
+    from shutil import which
+except ImportError:  # python 2
+    from distutils.spawn import find_executable as which
+
+
+@initfunc
+@initdeps(provides=['args', 'env:PYTHONPATH',
+                    'env:DEVOPS_UTILS_VAULT_SOCK'])
+def init_vault(prog, args):
+    if not os.path.isdir(vault.AGENT_DIR) or \
+            not os.path.basename(prog).startswith('ansible'):
+        return
+    os.environ['DEVOPS_UTILS_VAULT_SOCK'] = vault.SOCKET
+    path = [vault.write_site()]
+    if os.environ.get('PYTHONPATH'):
+        path.append(os.environ['PYTHONPATH'])
+    os.environ['PYTHONPATH'] = os.pathsep.join(path)
+    client = which(vault.CLIENT)
+    if client:
+        args[:] = vault.client_args(args, client)
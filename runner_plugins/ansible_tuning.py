@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@argparse_builder
+def argparse_ansible_tuning(parser):
+    parser.add_argument('++ansible-profile',
+                        choices=('default', 'fast', 'safe', 'off'),
+                        help=('tune Ansible forks, pipelining, etc. to '
+                              'container resources for speed or '
+                              'compatibility, or not at all (def: default)'))
+    parser.add_argument('++cpus', metavar='N',
+                        help='number of CPUs available to the container')
+    parser.add_argument('++memory', metavar='SIZE',
+                        help='memory limit of the container (e.g. 2g)')
+
+
+@docker_run_builder
+def docker_run_ansible_tuning(args, docker_run):
+    if args.ansible_profile:
+        docker_run.docker_args.extend([
+            '-e', 'DEVOPS_UTILS_ANSIBLE_PROFILE={}'.format(
+                args.ansible_profile),
+        ])
+    if args.cpus:
+        docker_run.docker_args.append('--cpus={}'.format(args.cpus))
+    if args.memory:
+        docker_run.docker_args.append('--memory={}'.format(args.memory))
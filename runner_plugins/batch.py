@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@argparse_builder
+def argparse_batch(parser):
+    parser.add_argument('++jobs', type=int, metavar='N',
+                        help=('with batch, run up to N programs at once '
+                              '(def: %(default)s)'))
+    parser.add_argument('++fail-fast', action='store_true',
+                        help='with batch, stop once a program fails')
+    parser.set_defaults(jobs=1)
+
+
+@runner_command('batch')
+def batch_command(args, cmd_args):
+    """Run programs listed in a file, one per line, in one container."""
+    parser = argparse.ArgumentParser(prog='{} batch'.format(RUNNER_NAME),
+                                     description=batch_command.__doc__)
+    parser.add_argument('file', help=('file listing programs and their '
+                                      'arguments, or - for standard input'))
+    cmd_args = parser.parse_args(cmd_args)
+
+    prog_args = ['--jobs', str(args.jobs)]
+    if args.fail_fast:
+        prog_args.append('--fail-fast')
+    docker_run = DockerRunCommand('batch', prog_args)
+    docker_run_builders(args, docker_run)
+    # the list is sent on standard input, so it can't be a terminal
+    docker_run.docker_args = [arg for arg in docker_run.docker_args
+                              if arg not in ('-t', '--tty')]
+    if cmd_args.file != '-':
+        fd = os.open(cmd_args.file, os.O_RDONLY)
+        os.dup2(fd, 0)
+        os.close(fd)
+    exit_with(docker_run.executor(docker_run))
@@ -18,15 +18,117 @@
 # along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
 
 
+DEV_SYNC_STATS = {
+    'Number of files transferred': 'files',
+    'Number of regular files transferred': 'files',
+    'Total file size': 'size',
+    'Total bytes sent': 'sent',
+}
+"Statistics of ``rsync --stats`` reported by :py:func:`dev_sync`."
+
+
+def dev_sync_volume(project=None):
+    """Return name of source volume for ``project`` directory.
+
+    :param str project: project directory (def: current directory)
+    """
+    project = os.path.abspath(project or os.getcwd())
+    digest = hashlib.sha1(project.encode('utf-8')).hexdigest()[:12]
+    return 'devops-utils-src-{}-{}'.format(
+        os.path.basename(project) or 'root', digest)
+
+
+def dockerignore_filters(path):
+    """Return rsync filter rules equivalent to ``.dockerignore`` ``path``.
+
+    Patterns are relative to the project directory and the last matching
+    one wins, while rsync uses the first matching rule, so the rules are
+    anchored and reversed.
+    """
+    rules = []
+    with open(path) as fobj:
+        for line in fobj:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            include = line.startswith('!')
+            pattern = os.path.normpath(line.lstrip('!').strip()).lstrip('/')
+            if pattern == '.':
+                continue
+            rules.append('{} /{}'.format('+' if include else '-', pattern))
+    return rules[::-1]
+
+
+def dev_sync(volume, src=None):
+    """Copy changes in ``src`` directory to docker ``volume``.
+
+    Runs rsync with a container mounting the volume as the remote end,
+    so only differences are transferred, to whichever docker host is in
+    use.  Files excluded by ``.dockerignore`` in ``src`` aren't copied
+    (and are removed from the volume).
+
+    :param str src: directory to copy (def: current directory)
+    :returns: statistics (see :py:data:`DEV_SYNC_STATS`) and time taken
+    :rtype: dict
+    """
+    src = src or os.getcwd()
+    # rsync runs "RSH HOST RSYNC_PATH --server ...", so with the
+    # container's entrypoint as the host and image as the rsync path it
+    # runs rsync in a container
+    cmd = ['rsync', '-rlpt', '--delete', '--delete-excluded', '--stats',
+           '--blocking-io',
+           '--rsh=docker run --rm -i -v {}:/opt/app --entrypoint'.format(
+               volume),
+           '--rsync-path={}'.format(DOCKER_IMAGE)]
+    ignore = os.path.join(src, '.dockerignore')
+    if os.path.exists(ignore):
+        cmd.extend('--filter={}'.format(rule)
+                   for rule in dockerignore_filters(ignore))
+    cmd.extend([os.path.join(src, ''), 'rsync:/opt/app/'])
+    logging.debug('sync source: %s', ' '.join(cmd))
+
+    start = time.time()
+    try:
+        output = subprocess.check_output(cmd).decode('utf-8')
+    except OSError:
+        sys.exit('++dev=sync requires rsync')
+    except subprocess.CalledProcessError as exc:
+        sys.exit('syncing source to volume {} failed ({})'.format(
+            volume, exc.returncode))
+    stats = {'seconds': time.time() - start}
+    for line in output.splitlines():
+        name, _, value = line.partition(':')
+        if name in DEV_SYNC_STATS:
+            stats[DEV_SYNC_STATS[name]] = int(
+                value.split()[0].replace(',', ''))
+    return stats
+
+
 @argparse_builder
 def argparse_dev_src(parser):
-    parser.add_argument('++dev', action='store_true',
+    parser.add_argument('++dev', '++dev=mount', dest='dev',
+                        action='store_const', const='mount',
                         help='mount source instead of using copy in the image')
+    # exact option strings match before splitting on "=", so this
+    # doesn't take the program name as ++dev value
+    parser.add_argument('++dev=sync', dest='dev', action='store_const',
+                        const='sync',
+                        help=('copy changes in source to a volume instead '
+                              '(e.g. for remote docker hosts)'))
 
 
 @docker_run_builder
 def docker_run_dev_src(args, docker_run):
-    if args.dev:
+    if args.dev == 'sync':
+        volume = dev_sync_volume()
+        logging.debug('%r', {'dev_sync': dev_sync(volume)})
+        # has to sync on every run
+        docker_run.cacheable = False
+        docker_run.docker_args.extend([
+            '-v', '{}:/opt/app'.format(volume),
+            '-w', '/opt/app',
+        ])
+    elif args.dev:
         docker_run.docker_args.extend([
             '-v', '{}:/opt/app'.format(os.getcwd()),
             '-w', '/opt/app',
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+httplib = LazyModule('httplib' if sys.version_info[0] < 3 else 'http.client',
+                     'httplib')
+socket = LazyModule('socket')
+struct = LazyModule('struct')
+
+DOCKER_API_VERSION = '1.24'
+DOCKER_API_SOCKET = '/var/run/docker.sock'
+
+
+class DockerAPIError(Exception):
+    """Docker Engine API request failed.
+
+    :ivar int status: HTTP status of the response (None if there's none)
+    """
+    def __init__(self, message, status=None):
+        super(DockerAPIError, self).__init__(message)
+        self.status = status
+
+
+def unix_http_connection(socket_path):
+    """Return HTTP connection over unix socket ``socket_path``.
+
+    The connection class is defined here as :py:mod:`httplib` is only
+    imported when the API is used.
+    """
+    class UnixHTTPConnection(httplib.HTTPConnection):
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+
+    return UnixHTTPConnection('localhost')
+
+
+class DockerAPI(object):
+    """Minimal client of the Docker Engine API listening on a unix socket.
+
+    All requests except :py:meth:`attach` (which takes over its own
+    connection) are sent over a single keep-alive connection.
+
+    :param str socket_path: path to the docker daemon socket
+    """
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.conn = unix_http_connection(socket_path)
+
+    def url(self, path):
+        return '/v{}{}'.format(DOCKER_API_VERSION, path)
+
+    def request(self, method, path, body=None):
+        """Send a request and return decoded JSON response (if any).
+
+        :raises DockerAPIError: if the daemon returns an error
+        """
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, self.url(path), body, headers)
+        resp = self.conn.getresponse()
+        data = resp.read().decode('utf-8')
+        logging.debug('%s %s: %s %r', method, path, resp.status, data)
+        if resp.status >= 400:
+            raise DockerAPIError('{} {}: {} {}'.format(
+                method, path, resp.status, data.strip()), resp.status)
+        return json.loads(data) if data.strip() else None
+
+    def pull(self, image):
+        """Pull ``image`` (its ``latest`` tag unless one is given).
+
+        The daemon streams progress as JSON messages, errors met after
+        the pull started are reported in them rather than the status.
+
+        :raises DockerAPIError: if the pull fails
+        """
+        name, tag = api_image_tag(image)
+        path = '/images/create?fromImage={}&tag={}'.format(name, tag)
+        self.conn.request('POST', self.url(path))
+        resp = self.conn.getresponse()
+        data = resp.read().decode('utf-8')
+        logging.debug('POST %s: %s', path, resp.status)
+        if resp.status >= 400:
+            raise DockerAPIError('POST {}: {} {}'.format(
+                path, resp.status, data.strip()), resp.status)
+        for line in data.splitlines():
+            if line.strip() and 'error' in json.loads(line):
+                raise DockerAPIError('pull {}: {}'.format(
+                    image, json.loads(line)['error']))
+
+    def attach(self, container, stdin):
+        """Attach to container streams and return the hijacked socket.
+
+        :param str container: container ID
+        :param bool stdin: whether to attach stdin too
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        path = self.url('/containers/{}/attach?stream=1&stdout=1&stderr=1{}'
+                        .format(container, '&stdin=1' if stdin else ''))
+        sock.sendall('POST {} HTTP/1.1\r\nHost: localhost\r\n'
+                     'Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n'
+                     .format(path).encode('ascii'))
+        head = b''
+        while not head.endswith(b'\r\n\r\n'):
+            byte = sock.recv(1)
+            if not byte:
+                raise DockerAPIError('attach: connection closed')
+            head += byte
+        status = head.split(None, 2)[1]
+        if status not in (b'101', b'200'):
+            raise DockerAPIError('attach: {}'.format(head.decode('utf-8')))
+        return sock
+
+
+def api_image_tag(image):
+    """Split ``image`` into name and tag (or digest) to pull.
+
+    The tag defaults to ``latest``, as without one the daemon pulls
+    all tags of the image.
+    """
+    if '@' in image:
+        name, _, digest = image.partition('@')
+        return name, digest
+    name, sep, tag = image.rpartition(':')
+    if sep and '/' not in tag:  # not a registry port
+        return name, tag
+    return image, 'latest'
+
+
+def api_create(api, config):
+    """Create container from ``config``, pulling its image if missing.
+
+    Like ``docker run`` does, as the daemon doesn't pull it on create.
+
+    :return: container ID
+    """
+    try:
+        return api.request('POST', '/containers/create', config)['Id']
+    except DockerAPIError as exc:
+        if exc.status != 404:  # no such image
+            raise
+    sys.stderr.write("Unable to find image '{}' locally\n".format(
+        config['Image']))
+    api.pull(config['Image'])
+    return api.request('POST', '/containers/create', config)['Id']
+
+
+def api_socket_path():
+    """Return path to docker daemon socket or None if it's not a unix one."""
+    host = os.environ.get('DOCKER_HOST')
+    if not host:
+        return DOCKER_API_SOCKET
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return None
+
+
+def api_memory_bytes(size):
+    """Return memory ``size`` given as to ``docker run`` in bytes."""
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    unit = size[-1:].lower()
+    if unit in units:
+        return int(float(size[:-1]) * units[unit])
+    return int(size)
+
+
+def api_create_config(docker_run):
+    """Translate ``docker_run`` into Engine API container create request.
+
+    :returns: (config, remove) tuple, where config is the request body
+              and remove says whether to remove the container afterwards
+    :raises ValueError: if ``docker_run`` uses an unsupported option
+    """
+    host_config = {'Binds': []}
+    config = {
+        'Image': DOCKER_IMAGE, 'Cmd': [docker_run.prog] + docker_run.prog_args,
+        'Env': [], 'Labels': {}, 'Tty': False,
+        'AttachStdin': False, 'OpenStdin': False, 'StdinOnce': False,
+        'AttachStdout': True, 'AttachStderr': True,
+        'HostConfig': host_config,
+    }
+    remove = False
+    with_value = ('-e', '--env', '-v', '--volume', '-w', '--workdir',
+                  '-l', '--label', '--net', '--network', '--cpus',
+                  '-m', '--memory')
+    args = iter(docker_run.docker_args + trace_docker_args())
+    for arg in args:
+        opt, eq, value = arg.partition('=')
+        if opt in with_value and not eq:
+            value = next(args, None)
+            if value is None:
+                raise ValueError('missing value for {}'.format(opt))
+        if arg in ('-i', '--interactive'):
+            config.update(AttachStdin=True, OpenStdin=True, StdinOnce=True)
+        elif arg in ('-t', '--tty'):
+            config['Tty'] = True
+        elif arg == '--rm':
+            remove = True
+        elif arg == '--privileged':
+            host_config['Privileged'] = True
+        elif opt in ('-e', '--env'):
+            if '=' not in value:  # pass through from own environment
+                if value not in os.environ:
+                    continue
+                value = '{}={}'.format(value, os.environ[value])
+            config['Env'].append(value)
+        elif opt in ('-v', '--volume'):
+            host_config['Binds'].append(value)
+        elif opt in ('-w', '--workdir'):
+            config['WorkingDir'] = value
+        elif opt in ('-l', '--label'):
+            key, _, value = value.partition('=')
+            config['Labels'][key] = value
+        elif opt in ('--net', '--network'):
+            host_config['NetworkMode'] = value
+        elif opt == '--cpus':
+            host_config['NanoCpus'] = int(float(value) * 10 ** 9)
+        elif opt in ('-m', '--memory'):
+            host_config['Memory'] = api_memory_bytes(value)
+        else:
+            raise ValueError('unsupported docker run option: {}'.format(arg))
+    return config, remove
+
+
+def api_pump_stdin(fd, sock):
+    """Copy data from file descriptor ``fd`` to ``sock`` until EOF."""
+    while True:
+        data = os.read(fd, 4096)
+        if not data:
+            break
+        sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def api_recv(sock, size):
+    """Receive exactly ``size`` bytes from ``sock`` or less on EOF."""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def api_copy_output(sock, tty, stdout, stderr):
+    """Copy container output from attached ``sock`` until EOF.
+
+    Without a TTY, the stream is multiplexed: each frame has an 8 byte
+    header with stream type and payload size.
+    """
+    while True:
+        if tty:
+            data, out = sock.recv(4096), stdout
+        else:
+            header = api_recv(sock, 8)
+            if len(header) < 8:
+                break
+            stream, size = struct.unpack('>BxxxL', header)
+            data, out = api_recv(sock, size), stderr if stream == 2 else stdout
+        if not data:
+            break
+        out.write(data)
+        out.flush()
+
+
+def api_forward_signals(socket_path, container):
+    """Forward :py:data:`FORWARD_SIGNALS` received by runner to container.
+
+    Like ``docker run`` does by default (``--sig-proxy``).
+
+    :return: previous signal handlers, by signal number
+    :rtype: dict
+    """
+    def forward(signum, frame):
+        DockerAPI(socket_path).request('POST', '/containers/{}/kill?signal={}'
+                                       .format(container, signum))
+    handlers = {}
+    for name in FORWARD_SIGNALS:
+        signum = getattr(signal, name)
+        handlers[signum] = signal.signal(signum, forward)
+    return handlers
+
+
+def api_run(docker_run, socket_path, stdin=None, stdout=None, stderr=None):
+    """Execute ``docker_run`` via Docker Engine API.
+
+    The sequence is: create (pulling the image if it's missing), attach,
+    start, wait and (for ``--rm``) delete the container.  Container start
+    slots held by ``docker_run`` (see :py:func:`admission_acquire`) are
+    released once it's started.
+
+    :param DockerRunCommand docker_run: the command to execute
+    :param str socket_path: path to the docker daemon socket
+    :param int stdin: file descriptor to send to container stdin
+    :param stdout: binary file object to write container stdout to
+    :param stderr: binary file object to write container stderr to
+    :return: exit status of the program
+    """
+    if stdin is None:
+        stdin = sys.stdin.fileno()
+    stdout = stdout or getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = stderr or getattr(sys.stderr, 'buffer', sys.stderr)
+    config, remove = api_create_config(docker_run)
+
+    api = DockerAPI(socket_path)
+    trace.hand_over()
+    with trace.phase('docker-create'):
+        container = api_create(api, config)
+    term_attrs = None
+    handlers = {}
+    try:
+        sock = api.attach(container, config['OpenStdin'])
+        with trace.phase('docker-start'):
+            api.request('POST', '/containers/{}/start'.format(container))
+        admission_release(docker_run)
+        trace.write(trace_dir())
+        handlers = api_forward_signals(socket_path, container)
+        if config['Tty'] and os.isatty(stdin):
+            import termios
+            import tty
+            term_attrs = termios.tcgetattr(stdin)
+            tty.setraw(stdin)
+            if hasattr(os, 'get_terminal_size'):
+                size = os.get_terminal_size(stdin)
+                api.request('POST', '/containers/{}/resize?h={}&w={}'.format(
+                    container, size.lines, size.columns))
+        if config['OpenStdin']:
+            pump = threading.Thread(target=api_pump_stdin, args=(stdin, sock))
+            pump.daemon = True
+            pump.start()
+        api_copy_output(sock, config['Tty'], stdout, stderr)
+        sock.close()
+        status = api.request(
+            'POST', '/containers/{}/wait'.format(container))['StatusCode']
+    finally:
+        admission_release(docker_run)
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if term_attrs is not None:
+            termios.tcsetattr(stdin, termios.TCSADRAIN, term_attrs)
+        if remove:
+            api.request('DELETE', '/containers/{}?force=1'.format(container))
+    return status
+
+
+def docker_api(docker_run):
+    """Execute a :py:class:`DockerRunCommand` using Docker Engine API.
+
+    Falls back to :py:func:`docker_cli` if the daemon isn't reachable
+    over a unix socket or the command uses options not translated to
+    the API.
+    """
+    socket_path = api_socket_path()
+    if socket_path is None or not os.path.exists(socket_path):
+        logging.debug('no docker socket, falling back to CLI')
+        return docker_cli(docker_run)
+    try:
+        api_create_config(docker_run)
+    except ValueError as exc:
+        logging.debug('%s, falling back to CLI', exc)
+        return docker_cli(docker_run)
+    with trace.phase('admission'):
+        admission_acquire(docker_run)
+    try:
+        status = api_run(docker_run, socket_path)
+    except DockerAPIError as exc:
+        sys.exit('docker: {}'.format(exc))
+    return run_post_run_hooks(docker_run, status)
+
+
+INVOCATION_CACHE_ENV.append('DEVOPS_UTILS_BACKEND')
+
+
+@argparse_builder
+def argparse_docker_api(parser):
+    parser.add_argument('++backend', choices=('cli', 'api'),
+                        help=('run containers using docker CLI or Docker '
+                              'Engine API (def: %(default)s)'))
+    parser.set_defaults(backend=os.environ.get('DEVOPS_UTILS_BACKEND', 'cli'))
+
+
+@docker_run_builder
+def docker_run_docker_api(args, docker_run):
+    if args.backend == 'api' and docker_run.executor is docker_cli:
+        docker_run.executor = docker_api
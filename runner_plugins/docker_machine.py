@@ -17,16 +17,99 @@
 # You should have received a copy of the GNU General Public License
 # along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
 
+fnmatch = LazyModule('fnmatch')
+functools = LazyModule('functools')
+
+
+def dm_is_multi(spec):
+    """Return whether ``++dm`` value may select more than one machine."""
+    return any(c in spec for c in ',*?[')
+
+
+def dm_machines(docker_run, spec):
+    """Return names of machines matching ``spec``.
+
+    :param DockerRunCommand docker_run: command (its docker options are
+        used to run ``docker-machine ls`` in the container if needed)
+    :param str spec: comma separated list of machine names or glob
+        patterns
+    """
+    patterns = [pattern for pattern in spec.split(',') if pattern]
+    names = None
+    machines = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            if names is None:
+                cmd = ['docker', 'run', '--rm']
+                cmd.extend([arg for arg in docker_run.docker_args
+                            if arg not in ('-i', '-t', '--rm')])
+                cmd.extend([DOCKER_IMAGE, 'docker-machine', 'ls', '-q'])
+                logging.debug('list machines: %s', ' '.join(cmd))
+                names = subprocess.check_output(cmd).decode('utf-8').split()
+            matched = fnmatch.filter(names, pattern)
+        else:
+            matched = [pattern]
+        machines.extend(name for name in matched if name not in machines)
+    return machines
+
+
+def dm_fanout(docker_run, spec, parallel):
+    """Execute ``docker_run`` against all machines matching ``spec``.
+
+    Runs up to ``parallel`` containers at once, prints their output
+    prefixed with machine name and a timing summary at the end.  Exits
+    with the highest exit status of all runs.
+    """
+    machines = dm_machines(docker_run, spec)
+    if not machines:
+        sys.exit('no docker machines match {}'.format(spec))
+    runs = [(name, DockerRunCommand(
+        docker_run.prog, docker_run.prog_args,
+        docker_run.docker_args + ['-e', 'ACTIVE_DM={}'.format(name)]))
+        for name in machines]
+
+    results = run_parallel(runs, parallel)
+
+    width = max(len(name) for name in machines + ['machine'])
+    sys.stderr.write('{:{}}  {:>6}  {:>8}\n'.format(
+        'machine', width, 'status', 'seconds'))
+    for name, status, duration in results:
+        sys.stderr.write('{:{}}  {:6}  {:8.2f}\n'.format(
+            name, width, status, duration))
+    status = max(status if status >= 0 else 128 - status
+                 for _, status, _ in results)
+    if status:
+        sys.exit(status)
+
 
 @argparse_builder
 def argparse_dm(parser):
     parser.add_argument('++dm', help=('docker machine to activate before '
-                                      'running the program'))
+                                      'running the program; a comma '
+                                      'separated list of names or glob '
+                                      'patterns runs it on all matching '
+                                      'machines concurrently'))
+    parser.add_argument('++parallel', type=int, metavar='N',
+                        help=('maximum number of machines to run on at once '
+                              '(def: %(default)s)'))
+    parser.set_defaults(parallel=4)
+    parser.add_argument('++dm-refresh', action='store_true',
+                        help=('ignore cached environment of the docker '
+                              'machine (refresh it)'))
+
 
 @docker_run_builder
 def docker_run_dm(args, docker_run):
     if not args.dm:
         return
-    docker_run.docker_args.extend([
-        '-e', 'ACTIVE_DM={}'.format(args.dm),
-    ])
+    if dm_is_multi(args.dm):
+        if getattr(args, 'pool', False):
+            sys.exit('++pool cannot be used with multiple docker machines')
+        docker_run.executor = functools.partial(
+            dm_fanout, spec=args.dm, parallel=args.parallel)
+    else:
+        docker_run.docker_args.extend([
+            '-e', 'ACTIVE_DM={}'.format(args.dm),
+        ])
+    if args.dm_refresh:
+        docker_run.docker_args.extend(['-e', 'DM_ENV_REFRESH=1'])
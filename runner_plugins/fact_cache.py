@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+FACT_CACHE_DIR = '/var/local/ansible_cache'
+
+
+def fact_cache_volume(project=None):
+    """Return name of fact cache volume for ``project`` directory.
+
+    :param str project: project directory (def: current directory)
+    """
+    project = os.path.abspath(project or os.getcwd())
+    digest = hashlib.sha1(project.encode('utf-8')).hexdigest()[:12]
+    return 'devops-utils-facts-{}-{}'.format(
+        os.path.basename(project) or 'root', digest)
+
+
+@argparse_builder
+def argparse_fact_cache(parser):
+    parser.add_argument('++fact-cache', action='store_true',
+                        help=('keep Ansible facts in a per-project volume '
+                              'between runs'))
+    parser.add_argument('++fact-cache-volume', metavar='VOLUME',
+                        help=('volume for the fact cache (def: derived '
+                              'from current directory)'))
+    parser.add_argument('++fact-cache-timeout', type=int, metavar='SECONDS',
+                        help=('re-gather facts cached longer than this '
+                              '(def: %(default)s)'))
+    parser.set_defaults(fact_cache_timeout=86400)
+
+
+@docker_run_builder
+def docker_run_fact_cache(args, docker_run):
+    if not args.fact_cache:
+        return
+    docker_run.docker_args.extend([
+        '-v', '{}:{}'.format(args.fact_cache_volume or fact_cache_volume(),
+                             FACT_CACHE_DIR),
+        '-e', 'FACT_CACHE_TIMEOUT={}'.format(args.fact_cache_timeout),
+    ])
+
+
+@runner_command('cache')
+def cache_command(args, cmd_args):
+    """Inspect or clear the Ansible fact cache of a project."""
+    parser = argparse.ArgumentParser(prog='{} cache'.format(RUNNER_NAME),
+                                     description=cache_command.__doc__)
+    parser.add_argument('action', choices=('stats', 'clear'),
+                        help=('show number of cached hosts, size and hit '
+                              'rate, or remove cached facts'))
+    parser.add_argument('--volume',
+                        help='fact cache volume (def: %(default)s)')
+    parser.set_defaults(volume=fact_cache_volume())
+    cmd_args = parser.parse_args(cmd_args)
+
+    with open(os.devnull, 'w') as devnull:
+        exists = subprocess.call(
+            ['docker', 'volume', 'inspect', cmd_args.volume],
+            stdout=devnull, stderr=devnull) == 0
+    if not exists:
+        print('no fact cache volume {}'.format(cmd_args.volume))
+        return 0
+    print('volume:   {}'.format(cmd_args.volume))
+    cmd = ['docker', 'run', '--rm',
+           '-v', '{}:{}'.format(cmd_args.volume, FACT_CACHE_DIR),
+           DOCKER_IMAGE, 'fact-cache', cmd_args.action]
+    logging.debug('cmd: %s', ' '.join(cmd))
+    return subprocess.call(cmd)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@argparse_builder
+def argparse_galaxy_cache(parser):
+    parser.add_argument('++galaxy-cache', action='store_true',
+                        help=('install Ansible Galaxy requirements via a '
+                              'cache keyed by the requirements file'))
+    parser.add_argument('++galaxy-requirements', metavar='FILE',
+                        help=('requirements file, relative to working '
+                              'directory in the container (def: '
+                              'requirements.yml or roles/requirements.yml)'))
+    parser.add_argument('++galaxy-cache-volume', metavar='VOLUME',
+                        help='volume for the cache (def: %(default)s)')
+    parser.add_argument('++galaxy-cache-size', type=int, metavar='MIB',
+                        help=('remove least recently used requirements '
+                              'when the cache is larger (def: %(default)s)'))
+    parser.set_defaults(galaxy_cache_volume='devops-utils-galaxy',
+                        galaxy_cache_size=1024)
+
+
+@docker_run_builder
+def docker_run_galaxy_cache(args, docker_run):
+    if not args.galaxy_cache:
+        return
+    docker_run.docker_args.extend([
+        '-v', '{}:/var/local/galaxy_cache'.format(args.galaxy_cache_volume),
+        '-e', 'GALAXY_CACHE_SIZE={}'.format(args.galaxy_cache_size),
+    ])
+    if args.galaxy_requirements:
+        docker_run.docker_args.extend([
+            '-e', 'GALAXY_REQUIREMENTS={}'.format(args.galaxy_requirements),
+        ])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+functools = LazyModule('functools')
+
+POOL_LABEL = 'devops-utils.pool'
+
+
+def pool_docker_args(docker_run):
+    """Return ``docker run`` arguments shared by all runs in a container.
+
+    These are the arguments of ``docker_run`` minus the ones only
+    relevant to a single interactive run (``-i``, ``-t`` and ``--rm``).
+    """
+    return [arg for arg in docker_run.docker_args
+            if arg not in ('-i', '-t', '--rm')]
+
+
+def pool_fingerprint(docker_run, zygote=False):
+    """Return fingerprint of image, mounts and environment of ``docker_run``.
+
+    Pooled containers are reused only by commands with equal
+    fingerprints.
+
+    :param bool zygote: whether the container should run the zygote
+    """
+    data = [DOCKER_IMAGE, pool_docker_args(docker_run)]
+    if zygote:
+        data.append('zygote')
+    data = json.dumps(data)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def pool_containers(fingerprint=None, fmt=None):
+    """Return running pooled containers.
+
+    :param str fingerprint: only return containers with this fingerprint
+    :param str fmt: ``docker ps`` format of the returned lines (def:
+                    container IDs)
+    :rtype: list
+    """
+    label = POOL_LABEL
+    if fingerprint is not None:
+        label = '{}={}'.format(POOL_LABEL, fingerprint)
+    cmd = ['docker', 'ps', '--filter', 'label={}'.format(label)]
+    cmd.extend(['--format', fmt] if fmt else ['-q'])
+    return subprocess.check_output(cmd).decode('utf-8').splitlines()
+
+
+def pool_start(docker_run, fingerprint, ttl, zygote=False):
+    """Start a pooled container for ``docker_run`` and return its ID.
+
+    The container runs ``pool-keeper`` which exits (and so removes the
+    container) once no program has been running in it for ``ttl``
+    seconds.  With ``zygote``, the keeper also starts the zygote.
+    """
+    cmd = ['docker', 'run', '-d', '--rm',
+           '--label', '{}={}'.format(POOL_LABEL, fingerprint),
+           '--label', '{}.ttl={}'.format(POOL_LABEL, ttl)]
+    cmd.extend(pool_docker_args(docker_run))
+    cmd.extend(trace_volume())
+    cmd.extend([DOCKER_IMAGE, 'pool-keeper', '--ttl', str(ttl)])
+    if zygote:
+        cmd.append('--zygote')
+    logging.debug('start pooled container: %s', ' '.join(cmd))
+    return subprocess.check_output(cmd).decode('utf-8').strip()
+
+
+def pool_exec_cmd(container, docker_run):
+    """Return ``docker exec`` command running ``docker_run`` in container.
+
+    The trace ID of the current run is passed here, as the container
+    serves both traced and untraced runs.
+    """
+    cmd = ['docker', 'exec']
+    cmd.extend([arg for arg in docker_run.docker_args if arg in ('-i', '-t')])
+    if trace.id:
+        cmd.extend(['-e', 'DEVOPS_UTILS_TRACE={}'.format(trace.id)])
+    cmd.extend([container, 'docker-init', docker_run.prog])
+    cmd.extend(docker_run.prog_args)
+    return cmd
+
+
+def pool_exec(docker_run, ttl, zygote=False):
+    """Execute ``docker_run`` in a pooled container, starting one if needed."""
+    fingerprint = pool_fingerprint(docker_run, zygote)
+    containers = pool_containers(fingerprint)
+    if containers:
+        container = containers[0]
+    else:
+        container = pool_start(docker_run, fingerprint, ttl, zygote)
+    cmd = pool_exec_cmd(container, docker_run)
+    logging.debug('cmd: %s', ' '.join(cmd))
+    return run_command(cmd, docker_run)
+
+
+@argparse_builder
+def argparse_pool(parser):
+    parser.add_argument('++pool', action='store_true',
+                        help=('run the program in a long-lived container '
+                              'reused by subsequent runs'))
+    parser.add_argument('++pool-ttl', type=int, metavar='SECONDS',
+                        help=('remove pooled container after it has been '
+                              'idle for this long (def: %(default)s)'))
+    parser.add_argument('++zygote', action='store_true',
+                        help=('with ++pool, preload Ansible and Fabric in '
+                              'the pooled container'))
+    parser.set_defaults(pool_ttl=600)
+
+
+@docker_run_builder
+def docker_run_pool(args, docker_run):
+    if args.zygote and not args.pool:
+        sys.exit('++zygote requires ++pool')
+    if not args.pool:
+        return
+    docker_run.executor = functools.partial(pool_exec, ttl=args.pool_ttl,
+                                            zygote=args.zygote)
+
+
+@runner_command('pool')
+def pool_command(args, cmd_args):
+    """Manage pooled containers."""
+    parser = argparse.ArgumentParser(prog='{} pool'.format(RUNNER_NAME),
+                                     description=pool_command.__doc__)
+    parser.add_argument('action', choices=('ls', 'prune'),
+                        help=('list running pooled containers, or remove '
+                              'all of them'))
+    cmd_args = parser.parse_args(cmd_args)
+
+    if cmd_args.action == 'ls':
+        fmt = '\t'.join([
+            '{{.ID}}', '{{.Label "%s"}}' % POOL_LABEL,
+            '{{.Label "%s.ttl"}}' % POOL_LABEL, '{{.Status}}'])
+        print('CONTAINER\tFINGERPRINT\tTTL\tSTATUS')
+        for line in pool_containers(fmt=fmt):
+            print(line)
+        return 0
+
+    containers = pool_containers()
+    if containers:
+        subprocess.check_call(['docker', 'rm', '-f'] + containers)
+    return 0
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+functools = LazyModule('functools')
+re = LazyModule('re')
+string = LazyModule('string')
+
+SHARD_RANGE = r'\[([^\]:]+):([^\]:]+)(?::(\d+))?\]'
+SHARD_RECAP = r'^(\S+)\s*:\s*((?:\w+=\d+\s*)+)$'
+SHARD_COLOR = r'\x1b\[[0-9;]*m'
+
+
+def shard_option(prog_args, short, longs):
+    """Return values of option ``short``/``longs`` in ``prog_args``.
+
+    :param list prog_args: arguments of ``ansible-playbook``
+    :param str short: short option, e.g. ``-i``
+    :param tuple longs: long option names, e.g. ``('--inventory',)``
+    :rtype: list
+    """
+    values = []
+    args = iter(prog_args)
+    for arg in args:
+        if arg == '--':
+            break
+        if arg == short or arg in longs:
+            values.append(next(args, ''))
+        elif arg.startswith(short) and not arg.startswith('--'):
+            values.append(arg[len(short):])
+        elif arg.split('=', 1)[0] in longs and '=' in arg:
+            values.append(arg.split('=', 1)[1])
+    return values
+
+
+def shard_expand(pattern):
+    """Return host names matching INI inventory host ``pattern``.
+
+    Expands ranges like ``web[01:10:2].example.com`` and ``db-[a:c]``
+    the way Ansible does.
+    """
+    match = re.search(SHARD_RANGE, pattern)
+    if not match:
+        return [pattern]
+    beg, end, step = match.groups()
+    step = int(step or 1)
+    if beg.isdigit() and end.isdigit():
+        width = len(beg) if beg.startswith('0') and len(beg) > 1 else 0
+        names = ['{:0{}d}'.format(i, width) if width else str(i)
+                 for i in range(int(beg), int(end) + 1, step)]
+    else:
+        letters = string.ascii_letters
+        names = list(letters[letters.index(beg):letters.index(end) + 1:step])
+    hosts = []
+    for name in names:
+        hosts.extend(shard_expand('{}{}{}'.format(
+            pattern[:match.start()], name, pattern[match.end():])))
+    return hosts
+
+
+def shard_parse_ini(fobj):
+    """Return names of hosts in INI inventory ``fobj`` in order.
+
+    Group variables and children sections are skipped, each host is
+    listed once even if in several groups.
+    """
+    hosts = []
+    kind = 'hosts'
+    for line in fobj:
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            kind = line[1:-1].rpartition(':')[2] if ':' in line else 'hosts'
+            continue
+        if kind != 'hosts':
+            continue
+        host = line.split()[0]
+        head, _, port = host.rpartition(':')
+        if port.isdigit() and ':' not in re.sub(SHARD_RANGE, '', head):
+            host = head  # strip port, unless an IPv6 address
+        hosts.extend(name for name in shard_expand(host)
+                     if name not in hosts)
+    return hosts
+
+
+def shard_is_ini(path):
+    """Return whether inventory ``path`` can be parsed on the host."""
+    if not os.path.isfile(path) or os.access(path, os.X_OK):
+        return False
+    if os.path.splitext(path)[1] in ('.yml', '.yaml', '.json'):
+        return False
+    with open(path) as fobj:
+        for line in fobj:
+            line = line.strip()
+            if line and line[0] not in '#;':
+                return not line.startswith(('---', '{'))
+    return True
+
+
+def shard_inventory_hosts(docker_run):
+    """Return names of hosts in inventories given to ``ansible-playbook``.
+
+    Host lists (e.g. ``-i a,b,``) and static INI files are parsed on the
+    host, other inventories (YAML, directories, scripts) are listed by
+    ``ansible-inventory`` run in the container.
+    """
+    sources = shard_option(docker_run.prog_args, '-i',
+                           ('--inventory', '--inventory-file'))
+    if not sources:
+        sys.exit('++shards requires an inventory given with -i')
+    hosts = []
+    other = []
+    for source in sources:
+        if ',' in source and not os.path.exists(source):
+            found = [host for host in source.split(',') if host]
+        elif shard_is_ini(source):
+            with open(source) as fobj:
+                found = shard_parse_ini(fobj)
+        elif os.path.exists(source):
+            other.append(source)
+            continue
+        else:
+            sys.exit('inventory {} not found'.format(source))
+        hosts.extend(host for host in found if host not in hosts)
+    if other:
+        cmd = ['docker', 'run', '--rm']
+        cmd.extend([arg for arg in docker_run.docker_args
+                    if arg not in ('-i', '-t', '--rm')])
+        cmd.extend([DOCKER_IMAGE, 'ansible-inventory', '--list'])
+        for source in other:
+            cmd.extend(['-i', source])
+        logging.debug('list inventory: %s', ' '.join(cmd))
+        inventory = json.loads(subprocess.check_output(cmd).decode('utf-8'))
+        for name, group in sorted(inventory.items()):
+            if name != '_meta':
+                hosts.extend(host for host in group.get('hosts', [])
+                             if host not in hosts)
+    return hosts
+
+
+def shard_split(hosts, count):
+    """Split ``hosts`` into up to ``count`` balanced shards.
+
+    Hosts are dealt round-robin, so shard sizes differ by at most one
+    and hosts of each group are spread over all shards.
+    """
+    return [shard for shard in (hosts[i::count] for i in range(count))
+            if shard]
+
+
+def shard_recap(lines):
+    """Return per host stats of the ``PLAY RECAP`` in output ``lines``.
+
+    :returns: dict mapping host names to lists of (name, value) pairs,
+              e.g. ``[('ok', 2), ('changed', 0), ...]``
+    """
+    recap = {}
+    seen = False
+    for line in lines:
+        line = re.sub(SHARD_COLOR, '', line).strip()
+        if 'PLAY RECAP' in line:
+            seen = True
+            continue
+        if not seen:
+            continue
+        match = re.match(SHARD_RECAP, line)
+        if match:
+            recap[match.group(1)] = [
+                (name, int(value)) for name, value in
+                (stat.split('=') for stat in match.group(2).split())]
+        elif recap:
+            break
+    return recap
+
+
+def shard_exec(docker_run, shards):
+    """Execute ``ansible-playbook`` in ``shards`` containers at once.
+
+    Each container runs the playbook limited to one shard of the hosts
+    in the inventory.  Prints the merged ``PLAY RECAP`` and a timing
+    summary at the end, exits with the highest exit status of all
+    shards.
+    """
+    hosts = shard_inventory_hosts(docker_run)
+    if not hosts:
+        sys.exit('no hosts in the inventory to shard')
+    split = shard_split(hosts, shards)
+    runs = [('shard{}'.format(i + 1), DockerRunCommand(
+        docker_run.prog, docker_run.prog_args + ['--limit', ','.join(shard)],
+        docker_run.docker_args))
+        for i, shard in enumerate(split)]
+
+    output = {}
+    results = run_parallel(runs, len(runs), output)
+
+    recap = {}
+    for name, _, _ in results:
+        recap.update(shard_recap(output.get(name, [])))
+    if recap:
+        sys.stdout.write('\nPLAY RECAP ({} shards) {}\n'.format(
+            len(runs), '*' * 50))
+        for host in sorted(recap):
+            sys.stdout.write('{:26} : {}'.format(host, ' '.join(
+                '{}={:<4}'.format(*stat)
+                for stat in recap[host])).rstrip() + '\n')
+
+    width = max(len(name) for name, _ in runs)
+    sys.stderr.write('{:{}}  {:>5}  {:>6}  {:>8}\n'.format(
+        'shard', width, 'hosts', 'status', 'seconds'))
+    for (name, status, duration), shard in zip(results, split):
+        sys.stderr.write('{:{}}  {:5}  {:6}  {:8.2f}\n'.format(
+            name, width, len(shard), status, duration))
+    status = max(status if status >= 0 else 128 - status
+                 for _, status, _ in results)
+    if status:
+        sys.exit(status)
+
+
+@argparse_builder
+def argparse_shards(parser):
+    parser.add_argument('++shards', type=int, metavar='N',
+                        help=('split hosts in the inventory of '
+                              'ansible-playbook into N shards and run them '
+                              'in N containers concurrently'))
+
+
+@docker_run_builder
+def docker_run_shards(args, docker_run):
+    if not args.shards:
+        return
+    if os.path.basename(docker_run.prog) != 'ansible-playbook':
+        sys.exit('++shards only works with ansible-playbook')
+    if shard_option(docker_run.prog_args, '-l', ('--limit',)):
+        sys.exit('++shards cannot be used with --limit')
+    if isinstance(docker_run.executor, functools.partial):
+        sys.exit('++shards cannot be used with ++pool or multiple docker '
+                 'machines')
+    docker_run.executor = functools.partial(shard_exec, shards=args.shards)
@@ -17,12 +17,67 @@
 # You should have received a copy of the GNU General Public License
 # along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
 
+SSH_MUX_LABEL = 'devops-utils.ssh-mux'
+SSH_MUX_DIR = '/var/local/ssh_mux'
+"Mount point of the ssh-mux volume in the containers."
+
+
+def ssh_mux_scope(key):
+    """Return ID of the SSH credentials of the current user.
+
+    Master connections are authenticated with the SSH agent or ``key``
+    of the run starting them, so they are only shared by runs of the
+    same user with the same agent and key.
+    """
+    return hashlib.sha1('\0'.join([
+        str(os.getuid()), os.environ.get('SSH_AUTH_SOCK', ''), key or '',
+    ]).encode('utf-8')).hexdigest()[:12]
+
+
+def ssh_mux_server(docker_run, volume, scope, ttl):
+    """Start ssh-mux server container for ``volume`` unless running.
+
+    There is a server (with its own directory in the volume) for each
+    ``scope`` (see :py:func:`ssh_mux_scope`).  The server container
+    gets the same options as ``docker_run`` (so it has the same SSH
+    agent, key and config), except for the ones only relevant to an
+    interactive run.
+    """
+    label = '{}={}/{}'.format(SSH_MUX_LABEL, volume, scope)
+    running = subprocess.check_output(
+        ['docker', 'ps', '-q', '--filter', 'label={}'.format(label)])
+    if running.strip():
+        return
+    cmd = ['docker', 'run', '-d', '--rm', '--label', label]
+    cmd.extend([arg for arg in docker_run.docker_args
+                if arg not in ('-i', '-t', '--rm')])
+    cmd.extend([DOCKER_IMAGE, 'devops-utils-ssh-mux', 'server',
+                '--dir', '{}/{}'.format(SSH_MUX_DIR, scope),
+                '--ttl', str(ttl)])
+    logging.debug('start ssh-mux server: %s', ' '.join(cmd))
+    subprocess.check_output(cmd)
+
 
 @argparse_builder
 def argparse_ssh_key(parser):
     parser.add_argument('++key', help='SSH key to use')
 
 
+@argparse_builder
+def argparse_ssh_mux(parser):
+    parser.add_argument('++ssh-mux', action='store_true',
+                        help=('reuse SSH connections across runs (via a '
+                              'long-lived container holding them)'))
+    parser.add_argument('++ssh-mux-volume', metavar='VOLUME',
+                        help=('named volume or host directory for the '
+                              'connection sockets (def: a volume per '
+                              'user)'))
+    parser.add_argument('++ssh-mux-ttl', type=int, metavar='SECONDS',
+                        help=('close connections unused for this long '
+                              '(def: %(default)s)'))
+    parser.set_defaults(ssh_mux_ttl=600)
+
+
 @docker_run_builder
 def docker_run_ssh_agent(args, docker_run):
     if 'SSH_AUTH_SOCK' not in os.environ:
@@ -47,8 +102,30 @@ def docker_run_ssh_key(args, docker_run):
 @docker_run_builder
 def docker_run_ssh_config(args, docker_run):
     src = os.path.join(os.path.expanduser('~/.ssh'), 'config')
+    docker_run.cache_paths.append(src)
     if not os.path.exists(src):
         return
     docker_run.docker_args.extend([
         '-v', '{}:/var/local/ssh_config'.format(src),
     ])
+
+
+@docker_run_builder
+def docker_run_ssh_mux(args, docker_run):
+    if not args.ssh_mux:
+        return
+    # the server has to be (re)started if not running
+    docker_run.cacheable = False
+    volume = args.ssh_mux_volume or 'devops-utils-ssh-mux-{}'.format(
+        os.getuid())
+    if os.sep in volume:  # host directory rather than volume name
+        volume = os.path.abspath(volume)
+        if not os.path.isdir(volume):
+            os.makedirs(volume, 0o700)
+    scope = ssh_mux_scope(
+        args.key and os.path.join(os.path.expanduser('~/.ssh'), args.key))
+    docker_run.docker_args.extend([
+        '-v', '{}:{}'.format(volume, SSH_MUX_DIR),
+        '-e', 'DEVOPS_UTILS_SSH_MUX_DIR={}/{}'.format(SSH_MUX_DIR, scope),
+    ])
+    ssh_mux_server(docker_run, volume, scope, args.ssh_mux_ttl)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+binascii = LazyModule('binascii')
+functools = LazyModule('functools')
+
+STANDBY_LABEL = 'devops-utils.standby'
+STANDBY_PREFIX = 'devops-utils-standby-'
+STANDBY_REQUEST = '/var/run/devops-utils-standby.json'
+
+
+def standby_docker_args(docker_run):
+    """Return ``docker create`` arguments of standbys for ``docker_run``.
+
+    Environment variables passed through from the runner's environment
+    (``-e NAME``) get their current values, as standbys created later
+    may be started by runs with different environment.
+    """
+    args = []
+    env = False
+    for arg in docker_run.docker_args:
+        if env and '=' not in arg:
+            arg = '{}={}'.format(arg, os.environ.get(arg, ''))
+        env = arg in ('-e', '--env')
+        args.append(arg)
+    return args
+
+
+def standby_fingerprint(docker_args):
+    """Return fingerprint of image and ``docker create`` arguments.
+
+    Standbys are only started by runs with equal fingerprints.
+    """
+    data = json.dumps([DOCKER_IMAGE, docker_args])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def standby_project():
+    """Return label value identifying current project directory."""
+    return hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:12]
+
+
+def standby_containers(fingerprint=None, fmt=None):
+    """Return standby (created, not yet claimed) containers.
+
+    :param str fingerprint: only return containers with this fingerprint
+    :param str fmt: ``docker ps`` format of the returned lines (def:
+                    container names)
+    :rtype: list
+    """
+    label = STANDBY_LABEL
+    if fingerprint is not None:
+        label = '{}={}'.format(STANDBY_LABEL, fingerprint)
+    cmd = ['docker', 'ps', '-a', '--filter', 'status=created',
+           '--filter', 'label={}'.format(label),
+           '--filter', 'name=^/?{}'.format(STANDBY_PREFIX),
+           '--format', fmt or '{{.Names}}']
+    return subprocess.check_output(cmd).decode('utf-8').splitlines()
+
+
+def standby_claim(fingerprint):
+    """Claim a standby container with ``fingerprint``.
+
+    Claimed container is renamed, so that concurrent runs can't claim it
+    too (renaming by the old name fails for all but one of them).
+
+    :returns: new name of the container or None if there's none left
+    """
+    with open(os.devnull, 'w') as devnull:
+        for name in standby_containers(fingerprint):
+            claimed = 'devops-utils-run-{}'.format(
+                binascii.hexlify(os.urandom(6)).decode('ascii'))
+            if subprocess.call(['docker', 'rename', name, claimed],
+                               stdout=devnull, stderr=devnull) == 0:
+                return claimed
+    return None
+
+
+def standby_request(container, docker_run):
+    """Copy program and arguments of ``docker_run`` into ``container``.
+
+    The request also carries the trace ID of the current run, as the
+    container was created before it.
+    """
+    request = {'argv': [docker_run.prog] + docker_run.prog_args, 'env': {}}
+    if trace.id:
+        request['env']['DEVOPS_UTILS_TRACE'] = trace.id
+    fd, path = tempfile.mkstemp(prefix='devops-utils-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as fobj:
+            json.dump(request, fobj)
+        subprocess.check_call(['docker', 'cp', path,
+                               '{}:{}'.format(container, STANDBY_REQUEST)])
+    finally:
+        os.unlink(path)
+
+
+def standby_create(docker_args, fingerprint):
+    """Create a standby container and return its name."""
+    name = '{}{}'.format(STANDBY_PREFIX,
+                         binascii.hexlify(os.urandom(6)).decode('ascii'))
+    cmd = ['docker', 'create', '--name', name,
+           '--label', '{}={}'.format(STANDBY_LABEL, fingerprint),
+           '--label', '{}.project={}'.format(STANDBY_LABEL, standby_project())]
+    cmd.extend(docker_args)
+    cmd.extend(trace_volume())
+    cmd.extend([DOCKER_IMAGE, 'standby'])
+    logging.debug('create standby container: %s', ' '.join(cmd))
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(cmd, stdout=devnull)
+    return name
+
+
+def standby_gc(fingerprint=None):
+    """Remove standby containers which won't be started.
+
+    These are the ones created from an image other than the current
+    :py:data:`DOCKER_IMAGE` (e.g. since updated) and ones created for
+    current project directory with a fingerprint other than
+    ``fingerprint`` (e.g. since its runner options changed).
+
+    :returns: names of removed containers
+    """
+    fmt = '\t'.join(['{{.Names}}', '{{.Image}}',
+                     '{{.Label "%s"}}' % STANDBY_LABEL,
+                     '{{.Label "%s.project"}}' % STANDBY_LABEL])
+    project = standby_project()
+    stale = []
+    for line in standby_containers(fmt=fmt):
+        name, image, container_fingerprint, container_project = \
+            line.split('\t')
+        if image != DOCKER_IMAGE or (
+                fingerprint and container_project == project and
+                container_fingerprint != fingerprint):
+            stale.append(name)
+    if stale:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['docker', 'rm'] + stale, stdout=devnull,
+                            stderr=devnull)
+    return stale
+
+
+def standby_fill(docker_args, fingerprint, count):
+    """Create standbys until there are ``count`` with ``fingerprint``.
+
+    Also garbage-collects stale standbys (see :py:func:`standby_gc`).
+    Runs filling the same standbys at once are skipped.
+
+    :returns: names of created containers
+    """
+    dir = os.path.join(os.path.dirname(invocation_cache_dir()), 'standby')
+    if not os.path.isdir(dir):
+        os.makedirs(dir, 0o700)
+    fd = os.open(os.path.join(dir, fingerprint), os.O_RDONLY | os.O_CREAT,
+                 0o600)
+    try:
+        if not admission_trylock(fd):
+            return []
+        standby_gc(fingerprint)
+        missing = count - len(standby_containers(fingerprint))
+        return [standby_create(docker_args, fingerprint)
+                for _ in range(missing)]
+    finally:
+        os.close(fd)
+
+
+def standby_refill(docker_run, status, docker_args, fingerprint, count):
+    """Post-run hook filling standbys in background."""
+    run_detached(standby_fill, docker_args, fingerprint, count)
+
+
+def standby_wait_started(container, runner):
+    """Wait until ``container`` starts or ``runner`` process exits.
+
+    Like :py:func:`admission_wait_created`, for the start slots handed
+    over by :py:func:`standby_exec`.
+    """
+    deadline = time.time() + ADMISSION_HOLD
+    cmd = ['docker', 'inspect', '--format', '{{.State.Status}}', container]
+    with open(os.devnull, 'w') as devnull:
+        while time.time() < deadline:
+            try:
+                os.kill(runner, 0)
+                status = subprocess.check_output(cmd, stderr=devnull)
+            except (OSError, subprocess.CalledProcessError):
+                break  # runner exited or container removed
+            if status.strip() != b'created':
+                break
+            time.sleep(ADMISSION_POLL)
+
+
+def standby_exec(docker_run, count):
+    """Execute ``docker_run`` in a standby container, if there's one.
+
+    Otherwise runs it with :py:func:`docker_cli`.  Either way, after
+    the program exits, ``count`` standbys are created for the next
+    runs.  Start slots (see :py:func:`admission_acquire`) are held
+    until the standby is running, by a detached process as the runner
+    waits for the program.
+    """
+    docker_args = standby_docker_args(docker_run)
+    fingerprint = standby_fingerprint(docker_args)
+    docker_run.post_run_hooks.append(functools.partial(
+        standby_refill, docker_args=docker_args, fingerprint=fingerprint,
+        count=count))
+    container = standby_claim(fingerprint)
+    if container is None:
+        logging.debug('no standby container, running one')
+        return docker_cli(docker_run)
+    standby_request(container, docker_run)
+    cmd = ['docker', 'start', '-a']
+    if '-i' in docker_run.docker_args:
+        cmd.append('-i')
+    cmd.append(container)
+    with trace.phase('admission'):
+        admission_acquire(docker_run)
+    if docker_run.admission_fds:
+        run_detached(standby_wait_started, container, os.getpid())
+        admission_release(docker_run)
+    logging.debug('cmd: %s', ' '.join(cmd))
+    return run_command(cmd, docker_run)
+
+
+@argparse_builder
+def argparse_standby(parser):
+    parser.add_argument('++standby', type=int, metavar='N',
+                        help=('start the program in a container created '
+                              'in advance and create N more for following '
+                              'runs after it exits'))
+
+
+@docker_run_builder
+def docker_run_standby(args, docker_run):
+    if not args.standby:
+        return
+    if isinstance(docker_run.executor, functools.partial):
+        sys.exit('++standby cannot be used with ++pool, ++shards or '
+                 'multiple docker machines')
+    docker_run.executor = functools.partial(standby_exec, count=args.standby)
+
+
+@runner_command('standby')
+def standby_command(args, cmd_args):
+    """Manage standby containers."""
+    parser = argparse.ArgumentParser(
+        prog='{} standby'.format(RUNNER_NAME),
+        description=standby_command.__doc__,
+        epilog=('fill creates standbys for runs with the given runner '
+                'options and program, e.g. "standby fill ++dev '
+                'ansible-playbook"'))
+    parser.add_argument('action', choices=('ls', 'fill', 'gc', 'prune'),
+                        help=('list standby containers, create them, '
+                              'remove stale ones, or remove all of them'))
+    parser.add_argument('--count', type=int,
+                        help='number of standbys to fill (def: %(default)s)')
+    parser.set_defaults(count=2)
+    cmd_args, run_args = parser.parse_known_args(cmd_args)
+
+    if cmd_args.action == 'ls':
+        fmt = '\t'.join(['{{.Names}}', '{{.Image}}',
+                         '{{.Label "%s"}}' % STANDBY_LABEL,
+                         '{{.Label "%s.project"}}' % STANDBY_LABEL,
+                         '{{.CreatedAt}}'])
+        print('NAME\tIMAGE\tFINGERPRINT\tPROJECT\tCREATED')
+        for line in standby_containers(fmt=fmt):
+            print(line)
+    elif cmd_args.action == 'fill':
+        run_args, prog_args = parse_args(run_args, fast=False)
+        docker_run = DockerRunCommand(run_args.prog, prog_args)
+        docker_run_builders(run_args, docker_run)
+        docker_args = standby_docker_args(docker_run)
+        for name in standby_fill(docker_args, standby_fingerprint(docker_args),
+                                 cmd_args.count):
+            print(name)
+    elif cmd_args.action == 'gc':
+        for name in standby_gc():
+            print(name)
+    else:
+        containers = standby_containers()
+        if containers:
+            subprocess.check_call(['docker', 'rm', '-f'] + containers)
+    return 0
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+
+@runner_command('trace')
+def trace_command(args, cmd_args):
+    """Report or clear phase timings recorded with ++trace."""
+    parser = argparse.ArgumentParser(prog='{} trace'.format(RUNNER_NAME),
+                                     description=trace_command.__doc__)
+    parser.add_argument('action', choices=('report', 'clear'),
+                        help=('show p50 and p95 duration of each phase, or '
+                              'remove recorded traces'))
+    parser.add_argument('--format', choices=('table', 'json'),
+                        default='table',
+                        help='format of the report (def: %(default)s)')
+    parser.add_argument('--last', type=int, metavar='N',
+                        help='only report the last N runs (def: all)')
+    cmd_args = parser.parse_args(cmd_args)
+
+    path = os.path.join(trace_dir(), TRACE_FILE)
+    if cmd_args.action == 'clear':
+        if os.path.exists(path):
+            os.unlink(path)
+        return 0
+    phases = trace_phases(load_traces(trace_dir()), cmd_args.last)
+    if not phases:
+        print('no traces recorded, run with ++trace first')
+        return 0
+    print(format_trace_report(phases, cmd_args.format))
+    return 0
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 gimoh
+#
+# This file is part of devops-utils.
+#
+# devops-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# devops-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with devops-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+socket = LazyModule('socket')
+
+VAULT_POLL = 1
+"How often (in seconds) the vault agent expires entries."
+
+
+def vault_dir():
+    """Return the directory of the vault agent socket."""
+    return os.path.join(os.path.dirname(invocation_cache_dir()), 'vault')
+
+
+def vault_request(path, op, **params):
+    """Send request ``op`` to the vault agent listening on ``path``.
+
+    :return: the response (dict) or ``None`` if no agent listens
+    """
+    params['op'] = op
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(params).encode('utf-8') + b'\n')
+        fobj = sock.makefile('rb')
+        try:
+            return json.loads(fobj.readline().decode('utf-8'))
+        finally:
+            fobj.close()
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def vault_handle(entries, stats, req):
+    """Return the response of the vault agent to request ``req``.
+
+    :param dict entries: cached values, keys map to lists of value,
+                         cost (seconds it took to get the value) and
+                         expiry time
+    :param dict stats: counters of hits, misses and seconds saved
+    """
+    op = req.get('op')
+    if op == 'get':
+        entry = entries.get(req.get('key'))
+        if entry is None:
+            stats['misses'] += 1
+            return {'value': None}
+        stats['hits'] += 1
+        stats['saved'] += entry[1]
+        return {'value': entry[0]}
+    elif op == 'put':
+        entries[req['key']] = [req['value'], req.get('cost', 0),
+                               time.time() + stats['ttl']]
+        return {}
+    elif op == 'stats':
+        return dict(stats, entries=len(entries), keys=len(
+            [key for key in entries if key.startswith('key:')]))
+    elif op == 'clear':
+        entries.clear()
+        return {}
+    elif op == 'ping':
+        return {}
+    return {'error': 'unknown request {}'.format(op)}
+
+
+def vault_agent(listener, ttl):
+    """Serve vault agent requests on ``listener`` socket.
+
+    Entries expire ``ttl`` seconds after they were stored.  Exits (and
+    removes the socket) once there are no entries and no requests came
+    for ``ttl`` seconds, or on ``stop`` request.
+    """
+    path = listener.getsockname()
+    inode = os.stat(path).st_ino
+    entries = {}
+    stats = {'hits': 0, 'misses': 0, 'saved': 0.0, 'ttl': ttl}
+    last = time.time()
+    listener.settimeout(VAULT_POLL)
+    try:
+        while True:
+            now = time.time()
+            for key in [key for key, entry in entries.items()
+                        if entry[2] <= now]:
+                del entries[key]
+            if not entries and now - last > ttl:
+                break
+            try:
+                conn = listener.accept()[0]
+            except socket.timeout:
+                continue
+            last = time.time()
+            conn.settimeout(5)
+            fobj = conn.makefile('rb')
+            try:
+                req = json.loads(fobj.readline().decode('utf-8'))
+                if req.get('op') == 'stop':
+                    conn.sendall(b'{}\n')
+                    break
+                response = vault_handle(entries, stats, req)
+                conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+            except (socket.error, ValueError, AttributeError, KeyError):
+                pass
+            finally:
+                fobj.close()
+                conn.close()
+    finally:
+        entries.clear()
+        listener.close()
+        try:
+            if os.stat(path).st_ino == inode:  # not replaced meanwhile
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def vault_agent_start(dir, ttl):
+    """Start the vault agent with socket in ``dir`` unless running.
+
+    The socket is bound (and listening) before the runner goes on, so
+    the container can connect to it before the agent accepts.
+
+    :return: path to the agent socket
+    """
+    path = os.path.join(dir, 'agent.sock')
+    if vault_request(path, 'ping') is not None:
+        return path
+    if not os.path.isdir(dir):
+        os.makedirs(dir, 0o700)
+    with open(os.path.join(dir, 'lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if vault_request(path, 'ping') is not None:  # started meanwhile
+            return path
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            listener.bind(path)
+        finally:
+            os.umask(umask)
+        listener.listen(16)
+    logging.debug('start vault agent on %s', path)
+    run_detached(vault_agent, listener, ttl)
+    listener.close()
+    return path
+
+
+@argparse_builder
+def argparse_vault(parser):
+    parser.add_argument('++vault-cache', action='store_true',
+                        help=('keep Ansible vault passwords and derived '
+                              'keys in an agent on this host'))
+    parser.add_argument('++vault-cache-ttl', type=int, metavar='SECONDS',
+                        help=('forget cached passwords and keys after this '
+                              'long (def: %(default)s)'))
+    parser.set_defaults(vault_cache_ttl=3600)
+
+
+@docker_run_builder
+def docker_run_vault(args, docker_run):
+    if not args.vault_cache:
+        return
+    if not os.environ.get('DOCKER_HOST', 'unix://').startswith('unix://'):
+        sys.exit('++vault-cache requires a docker daemon on this host')
+    # the agent has to be (re)started if not running
+    docker_run.cacheable = False
+    vault_agent_start(vault_dir(), args.vault_cache_ttl)
+    # the directory rather than the socket is mounted, so that a
+    # restarted agent is reachable from long-lived containers too
+    scope = hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:12]
+    docker_run.docker_args.extend([
+        '-v', '{}:/tmp/vault_agent'.format(vault_dir()),
+        '-e', 'DEVOPS_UTILS_VAULT_SCOPE={}'.format(scope),
+    ])
+
+
+@runner_command('vault')
+def vault_command(args, cmd_args):
+    """Inspect, clear or stop the vault key cache agent."""
+    parser = argparse.ArgumentParser(prog='{} vault'.format(RUNNER_NAME),
+                                     description=vault_command.__doc__)
+    parser.add_argument('action', choices=('stats', 'clear', 'stop'),
+                        help=('show cached entries, hits and key derivation '
+                              'time saved, forget cached passwords and '
+                              'keys, or stop the agent'))
+    cmd_args = parser.parse_args(cmd_args)
+
+    path = os.path.join(vault_dir(), 'agent.sock')
+    response = vault_request(path, cmd_args.action)
+    if response is None:
+        print('no vault agent running')
+        return 0
+    if cmd_args.action == 'stats':
+        lookups = response['hits'] + response['misses']
+        print('entries:  {} ({} passwords, {} keys)'.format(
+            response['entries'], response['entries'] - response['keys'],
+            response['keys']))
+        print('ttl:      {}s'.format(response['ttl']))
+        print('hit rate: {} ({} hits, {} misses)'.format(
+            '{:.1%}'.format(float(response['hits']) / lookups)
+            if lookups else '-', response['hits'], response['misses']))
+        print('saved:    {:.2f}s of key derivation'.format(response['saved']))
+    return 0
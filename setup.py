@@ -43,6 +43,8 @@ setup(
     entry_points={
         'console_scripts': [
             'docker-init = devops_utils.init:main',
+            'devops-utils-ssh-mux = devops_utils.ssh_mux:main',
+            'devops-utils-vault-client = devops_utils.vault:client',
         ],
     },
     license='GPLv3',